@@ -0,0 +1,110 @@
+"""/analytics на годах истории: отчёт из срезов vs те же цифры прямым проходом по orders.
+
+    python -m benchmarks.bench_analytics --years 3 --per-day 300
+
+Срезы заполняют триггеры миграции 5 при вставке — как в проде. Кэш запросов
+сбрасывается перед каждым замером.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+DAY = 86400
+
+
+def fill_db(path: str, years: int, per_day: int) -> tuple[int, float]:
+    from bot.db import CREATE_SQL
+    from bot.migrations import BOOTSTRAP_SQL, MIGRATIONS
+
+    conn = sqlite3.connect(path)
+    conn.executescript(CREATE_SQL + BOOTSTRAP_SQL)
+    for script in MIGRATIONS:
+        conn.executescript(script)
+    drinks = ["americano", "latte", "cappuccino", "flat white", "mocha"]
+    sizes = ["small", "medium", "large"]
+    rnd = random.Random(42)
+    days = years * 365
+    start = (int(time.time()) // DAY - days) * DAY
+
+    def gen():
+        for d in range(days):
+            for _ in range(per_day):
+                ts = start + d * DAY + 7 * 3600 + rnd.randrange(13 * 3600)
+                yield (rnd.randrange(1, 5000), 1, rnd.choice(drinks), rnd.choice(sizes),
+                       rnd.choice(("yes", "no")), ts, rnd.choice((18000, 24000, 31000)))
+
+    t0 = time.perf_counter()
+    conn.executemany(
+        "INSERT INTO orders(user_id, chat_id, drink, size, milk, created_at, total) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        gen(),
+    )
+    conn.commit()
+    elapsed = time.perf_counter() - t0
+    conn.close()
+    return days * per_day, elapsed
+
+
+SCAN_SQL = [
+    "SELECT (created_at + 10800) / 86400, COUNT(*), SUM(total) FROM orders "
+    "WHERE deleted_at IS NULL AND created_at >= ? AND created_at < ? GROUP BY 1",
+    "SELECT ((created_at + 10800) / 86400 + 3) % 7, (created_at + 10800) / 3600 % 24, COUNT(*) FROM orders "
+    "WHERE deleted_at IS NULL AND created_at >= ? AND created_at < ? GROUP BY 1, 2",
+    "SELECT drink, size, milk, COUNT(*) FROM orders "
+    "WHERE deleted_at IS NULL AND created_at >= ? AND created_at < ? GROUP BY 1, 2, 3",
+    "SELECT COUNT(*) FROM (SELECT user_id FROM orders GROUP BY user_id HAVING MIN(created_at) >= ? "
+    "AND MIN(created_at) < ?)",
+]
+
+
+async def run(periods: list[str], repeat: int) -> None:
+    from bot import db
+    from bot.cache import CACHE
+    from bot.services import analytics
+
+    await db.open_db()
+    conn = sqlite3.connect(db.DB_PATH)
+    print(f"{'период':<8} {'срезы, ms':>10} {'по orders, ms':>14} {'x':>7}")
+    try:
+        for period in periods:
+            best = float("inf")
+            for _ in range(repeat):
+                CACHE.clear()
+                t0 = time.perf_counter()
+                analytics.render_report(await analytics.build_report(period))
+                best = min(best, time.perf_counter() - t0)
+            since, until = analytics.period_bounds(period, int(time.time()))
+            t0 = time.perf_counter()
+            for sql in SCAN_SQL:
+                conn.execute(sql, (since, until)).fetchall()
+            scan = time.perf_counter() - t0
+            print(f"{period:<8} {best * 1e3:>10.1f} {scan * 1e3:>14.1f} {scan / best:>7.0f}")
+    finally:
+        conn.close()
+        await db.close_db()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--years", type=int, default=3)
+    ap.add_argument("--per-day", type=int, default=300)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.sqlite3")
+        rows, elapsed = fill_db(path, args.years, args.per_day)
+        print(f"{rows} заказов, вставка с триггерами срезов: {rows / elapsed:,.0f} строк/с")
+
+        from bot import db
+        from bot.services.analytics import PERIODS
+        db.DB_PATH = Path(path)
+        asyncio.run(run(list(PERIODS), args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+"""Сквозной прогон: синтетические апдейты через bot.main.dp на временной БД.
+
+    python -m benchmarks.bench_e2e --users 20 --iterations 10 --out e2e.json
+    python -m benchmarks.bench_e2e --compare e2e.json     # сравнить с прошлым прогоном
+
+Сеть заменена заглушкой сессии Bot: она отвечает сразу (или через --api-latency-ms),
+запоминает inline-кнопки из ответов, и сценарии жмут именно их — как пользователь.
+Апдейты одного пользователя идут строго по очереди, разные пользователи — параллельно.
+
+На каждый сценарий: пропускная способность, перцентили латентности апдейта, вызовы
+repo, SQL-запросы и вызовы Bot API на апдейт. Результат — JSON с коммитом и параметрами.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Awaitable, Callable
+
+from benchmarks.bench_pool import _pct
+
+SCENARIOS = ("order", "history", "stats", "top", "export", "delete_undo")
+DRINKS = ["americano", "latte", "cappuccino", "flat white", "mocha"]
+DAY = 24 * 60 * 60
+
+
+def seed(path: str, users: int, history: int) -> None:
+    """history заказов на пользователя за последние 60 дней; агрегаты ведут триггеры."""
+    rnd = random.Random(42)
+    now = int(time.time())
+    conn = sqlite3.connect(path)
+
+    def gen():
+        for uid in range(1, users + 1):
+            for _ in range(history):
+                yield (uid, uid, rnd.choice(DRINKS), rnd.choice(("small", "medium", "large")),
+                       rnd.choice(("yes", "no")), now - rnd.randrange(60 * DAY))
+
+    conn.executemany(
+        "INSERT INTO orders(user_id, chat_id, drink, size, milk, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        gen(),
+    )
+    conn.commit()
+    conn.close()
+
+
+def _stub_session(api_latency: float):
+    from aiogram.client.session.base import BaseSession
+    from aiogram.types import InlineKeyboardMarkup, InputFile, Message
+
+    class Session(BaseSession):
+        def __init__(self):
+            super().__init__()
+            self.calls = 0
+            self._ids = itertools.count(1_000_000)
+            # chat_id → [(message_id, callback_data)] из последних ответов бота
+            self.buttons: dict[int, list[tuple[int, str]]] = {}
+
+        async def make_request(self, bot, method, timeout=None):
+            self.calls += 1
+            if api_latency:
+                await asyncio.sleep(api_latency)
+            chat_id = getattr(method, "chat_id", None)
+            message_id = getattr(method, "message_id", None) or next(self._ids)
+            document = getattr(method, "document", None)
+            if isinstance(document, InputFile):
+                async for _ in document.read(bot):
+                    pass
+            markup = getattr(method, "reply_markup", None)
+            if chat_id is not None and isinstance(markup, InlineKeyboardMarkup):
+                self.buttons.setdefault(chat_id, []).extend(
+                    (message_id, b.callback_data) for row in markup.inline_keyboard for b in row if b.callback_data
+                )
+            if method.__returning__ is bool or chat_id is None:
+                return True
+            return Message.model_validate({
+                "message_id": message_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+            })
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+            yield b""
+
+        async def close(self):
+            pass
+
+    return Session()
+
+
+class VirtualUser:
+    def __init__(self, uid: int, bench: "Bench"):
+        self.uid = uid
+        self.bench = bench
+
+    def _who(self) -> dict:
+        return {"id": self.uid, "is_bot": False, "first_name": "U", "language_code": "ru"}
+
+    def _chat(self) -> dict:
+        return {"id": self.uid, "type": "private"}
+
+    async def send(self, text: str) -> None:
+        await self.bench.feed({
+            "message": {"message_id": self.bench.next_id(), "date": int(time.time()),
+                        "chat": self._chat(), "from": self._who(), "text": text},
+        })
+
+    async def click(self, prefix: str) -> bool:
+        """Жмёт последнюю присланную ботом кнопку, чей callback_data начинается с prefix."""
+        for message_id, data in reversed(self.bench.session.buttons.get(self.uid, [])):
+            if data.startswith(prefix):
+                await self.bench.feed({
+                    "callback_query": {
+                        "id": str(self.bench.next_id()), "from": self._who(), "chat_instance": "b",
+                        "data": data,
+                        "message": {"message_id": message_id, "date": int(time.time()),
+                                    "chat": self._chat(), "text": "-"},
+                    },
+                })
+                return True
+        return False
+
+    def forget_buttons(self) -> None:
+        self.bench.session.buttons.pop(self.uid, None)
+
+
+async def order(u: VirtualUser) -> None:
+    await u.send("/order")
+    await u.send(random.choice(DRINKS).title())
+    await u.send(random.choice(("Small", "Medium", "Large")))
+    await u.send(random.choice(("Да", "Нет")))
+
+
+async def history(u: VirtualUser) -> None:
+    u.forget_buttons()
+    await u.send("/history")
+    await u.click("history_filter:all")
+    await u.click("history_more:")
+
+
+async def stats(u: VirtualUser) -> None:
+    await u.send("/stats")
+
+
+async def top(u: VirtualUser) -> None:
+    u.forget_buttons()
+    await u.send("/top")
+    await u.click("top:p:week")
+
+
+async def export(u: VirtualUser) -> None:
+    await u.send("/export month")
+
+
+async def delete_undo(u: VirtualUser) -> None:
+    u.forget_buttons()
+    await u.send("/history")
+    await u.click("history_filter:all")
+    if await u.click("delete:"):
+        await u.click("delete_confirm:")
+        await u.click("undo_delete:")
+
+
+FLOWS: dict[str, Callable[[VirtualUser], Awaitable[None]]] = {
+    "order": order, "history": history, "stats": stats,
+    "top": top, "export": export, "delete_undo": delete_undo,
+}
+
+
+class Bench:
+    def __init__(self, dp, bot, session):
+        self.dp = dp
+        self.bot = bot
+        self.session = session
+        self.latencies: list[float] = []
+        self.sql = 0
+        self._ids = itertools.count(1)
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+    async def feed(self, payload: dict) -> None:
+        from aiogram.types import Update
+
+        update = Update.model_validate({"update_id": self.next_id(), **payload}, context={"bot": self.bot})
+        t0 = time.perf_counter()
+        await self.dp.feed_update(self.bot, update)
+        self.latencies.append(time.perf_counter() - t0)
+
+    def on_sql(self, statement: str) -> None:
+        self.sql += 1
+
+
+def _repo_calls() -> int:
+    from bot import metrics
+
+    return sum(metrics.DB_SECONDS.count(*labels) for labels in list(metrics.DB_SECONDS._series))
+
+
+async def run_scenario(bench: Bench, name: str, users: int, iterations: int) -> dict[str, Any]:
+    flow = FLOWS[name]
+    bench.latencies = []
+    sql0, api0, repo0 = bench.sql, bench.session.calls, _repo_calls()
+
+    async def user_loop(uid: int) -> None:
+        u = VirtualUser(uid, bench)
+        for _ in range(iterations):
+            await flow(u)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(user_loop(uid) for uid in range(1, users + 1)))
+    elapsed = time.perf_counter() - t0
+    # отложенная запись FSM — на счёт этого сценария, а не следующего
+    await bench.dp.storage.flush()
+
+    n = len(bench.latencies)
+    ms = [x * 1000 for x in bench.latencies]
+    return {
+        "updates": n,
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(n / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {q: round(_pct(ms, p), 2) for q, p in (("p50", .5), ("p95", .95), ("p99", .99))}
+        | {"max": round(max(ms, default=0.0), 2)},
+        "repo_calls_per_update": round((_repo_calls() - repo0) / max(n, 1), 2),
+        "sql_per_update": round((bench.sql - sql0) / max(n, 1), 2),
+        "api_calls_per_update": round((bench.session.calls - api0) / max(n, 1), 2),
+    }
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    # DB_FILE уже выставлен в main(): модули бота читают его при импорте
+    from aiogram import Bot
+    from bot import db
+    from bot.main import dp
+
+    await db.init_db()
+    seed(str(db.DB_PATH), args.users, args.history)
+    await db.open_db()
+
+    session = _stub_session(args.api_latency_ms / 1000)
+    bot = Bot("42:TEST", session=session)
+    bench = Bench(dp, bot, session)
+    # пул БД и отдельное соединение FSM-хранилища
+    for conn in [db.get_db(), *db._READERS, await dp.storage._db()]:
+        await conn.set_trace_callback(bench.on_sql)
+
+    results = {}
+    try:
+        await dp.emit_startup(bot=bot)
+        for name in args.scenarios:
+            results[name] = await run_scenario(bench, name, args.users, args.iterations)
+            print(f"{name:<12} {results[name]['updates_per_sec']:>8} upd/s  "
+                  f"p50 {results[name]['latency_ms']['p50']} ms  p99 {results[name]['latency_ms']['p99']} ms  "
+                  f"sql/upd {results[name]['sql_per_update']}", file=sys.stderr)
+    finally:
+        await dp.emit_shutdown(bot=bot)
+        await dp.storage.close()
+        await db.close_db()
+    return results
+
+
+def _commit() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old: dict, new: dict) -> None:
+    if old.get("params") != new["params"]:
+        print(f"внимание: параметры прогонов различаются: {old.get('params')} vs {new['params']}")
+    print(f"было: {old.get('commit')}, стало: {new['commit']}")
+    print(f"{'scenario':<12} {'upd/s':>18} {'p50 ms':>18} {'p99 ms':>18} {'sql/upd':>14}")
+    for name, cur in new["scenarios"].items():
+        prev = old.get("scenarios", {}).get(name)
+        if prev is None:
+            continue
+
+        def cell(a: float, b: float, width: int) -> str:
+            delta = f"{(b - a) / a * 100:+.0f}%" if a else "n/a"
+            return f"{b:>{width - 7}} ({delta:>4})"
+
+        print(f"{name:<12} {cell(prev['updates_per_sec'], cur['updates_per_sec'], 18)} "
+              f"{cell(prev['latency_ms']['p50'], cur['latency_ms']['p50'], 18)} "
+              f"{cell(prev['latency_ms']['p99'], cur['latency_ms']['p99'], 18)} "
+              f"{cell(prev['sql_per_update'], cur['sql_per_update'], 14)}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=20, help="одновременных пользователей")
+    ap.add_argument("--iterations", type=int, default=10, help="повторов сценария на пользователя")
+    ap.add_argument("--history", type=int, default=200, help="заказов на пользователя в исходной БД")
+    ap.add_argument("--api-latency-ms", type=float, default=0.0)
+    ap.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", help="куда записать JSON (иначе — в stdout)")
+    ap.add_argument("--compare", help="JSON прошлого прогона: печатает изменения")
+    args = ap.parse_args()
+
+    random.seed(args.seed)
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DB_FILE"] = os.path.join(tmp, "bench.sqlite3")
+        scenarios = asyncio.run(run(args))
+
+    report = {
+        "commit": _commit(),
+        "timestamp": int(time.time()),
+        "python": sys.version.split()[0],
+        "params": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "scenarios": scenarios,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
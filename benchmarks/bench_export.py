@@ -0,0 +1,103 @@
+"""Экспорт CSV: загрузить всё и собрать в памяти vs потоковая выгрузка пачками.
+
+    python -m benchmarks.bench_export --rows 1000000
+
+Каждый режим запускается в отдельном процессе, чтобы peak RSS не смешивался.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+USER_ID = 1
+
+
+def fill_db(path: str, rows: int) -> None:
+    from bot.db import CREATE_SQL
+    from bot.migrations import BOOTSTRAP_SQL, MIGRATIONS
+
+    conn = sqlite3.connect(path)
+    conn.executescript(CREATE_SQL + BOOTSTRAP_SQL)
+    for script in MIGRATIONS:
+        conn.executescript(script)
+    drinks = ["americano", "latte", "cappuccino", "flat white", "mocha"]
+    sizes = ["small", "medium", "large"]
+    rnd = random.Random(42)
+    start = 1_600_000_000
+
+    def gen():
+        for i in range(rows):
+            yield (USER_ID, USER_ID, rnd.choice(drinks), rnd.choice(sizes),
+                   rnd.choice(("yes", "no")), start + i * 7)
+
+    conn.executemany(
+        "INSERT INTO orders(user_id, chat_id, drink, size, milk, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        gen(),
+    )
+    conn.commit()
+    conn.close()
+
+
+async def run_mode(mode: str) -> dict:
+    from bot import db, repo
+    from bot.helpers import orders_to_csv, spool_orders_csv
+
+    await db.open_db()
+    t0 = time.perf_counter()
+    if mode == "legacy":
+        rows = await repo.orders_for_period(user_id=USER_ID, since=0, until=2_147_483_647)
+        data = orders_to_csv(rows)
+        size, count = len(data), len(rows)
+    else:
+        f, count = await spool_orders_csv(
+            repo.iter_orders_for_period(user_id=USER_ID, since=0, until=2_147_483_647)
+        )
+        with f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+    elapsed = time.perf_counter() - t0
+    await db.close_db()
+    return {
+        "mode": mode,
+        "rows": count,
+        "bytes": size,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": int(count / elapsed) if elapsed else 0,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--mode", choices=["legacy", "stream"])
+    ap.add_argument("--db")
+    args = ap.parse_args()
+
+    if args.mode:
+        print(json.dumps(asyncio.run(run_mode(args.mode))))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.sqlite3")
+        t0 = time.perf_counter()
+        fill_db(path, args.rows)
+        print(f"filled {args.rows} rows in {time.perf_counter() - t0:.1f}s")
+        env = dict(os.environ, DB_FILE=path)
+        for mode in ("legacy", "stream"):
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_export", "--mode", mode],
+                env=env, check=True, capture_output=True, text=True,
+            ).stdout
+            print(out.strip())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Загрузка истории: repo.create_order по строке vs python -m bot.tools.import.
+
+    python -m benchmarks.bench_import --rows 1000000 --users 5000
+
+Файл — CSV в формате /export с колонкой user_id, по времени, как выгружает касса.
+create_order меряется на --sample первых строках (commit на каждую, как в боте).
+"""
+import argparse
+import asyncio
+import csv
+import importlib
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+DRINKS = ["americano", "latte", "cappuccino", "flat white", "mocha"]
+SIZES = ["small", "medium", "large"]
+
+
+def write_csv(path: Path, rows: int, users: int) -> None:
+    rnd = random.Random(42)
+    ts = 1_600_000_000
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["id", "created_at", "drink", "size", "milk", "total", "user_id"])
+        for i in range(rows):
+            ts += rnd.randrange(1, 120)
+            w.writerow([i + 1, datetime.fromtimestamp(ts, timezone.utc).isoformat(timespec="seconds"),
+                        rnd.choice(DRINKS), rnd.choice(SIZES), rnd.choice(("yes", "no")),
+                        rnd.choice(("180.00", "240.00", "310.00", "")), rnd.randrange(1, users + 1)])
+
+
+async def row_by_row(path: Path, sample: int) -> float:
+    from bot import db, repo
+    tool = importlib.import_module("bot.tools.import")
+
+    convert = tool.Converter("csv", user_id=None, chat_id=None, tz="UTC")
+    await db.init_db()
+    await db.open_db()
+    try:
+        t0 = time.perf_counter()
+        for n, (_, fields) in enumerate(tool.iter_records(path, "csv")):
+            if n == sample:
+                break
+            user_id, chat_id, drink, size, milk, ts, _, _, total = convert(fields)
+            await repo.create_order(user_id=user_id, chat_id=chat_id, drink=drink, size=size, milk=milk,
+                                    created_at=ts, total=total)
+        return sample / (time.perf_counter() - t0)
+    finally:
+        await db.close_db()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--users", type=int, default=5000)
+    ap.add_argument("--sample", type=int, default=5000)
+    ap.add_argument("--db-dir", default=None, help="где создавать временную БД (по умолчанию системный tmp)")
+    args = ap.parse_args()
+
+    from bot import db
+    tool = importlib.import_module("bot.tools.import")
+
+    with tempfile.TemporaryDirectory(dir=args.db_dir) as tmp:
+        src = Path(tmp) / "history.csv"
+        write_csv(src, args.rows, args.users)
+        print(f"{args.rows} строк, {os.path.getsize(src) / 2**20:.0f} MB CSV")
+
+        db.DB_PATH = Path(tmp) / "row_by_row.sqlite3"
+        rate = asyncio.run(row_by_row(src, min(args.sample, args.rows)))
+        print(f"create_order по строке: {rate:,.0f} строк/с".replace(",", " "))
+
+        for keep in (False, True):
+            db.DB_PATH = Path(tmp) / f"bulk_{keep}.sqlite3"
+            stats = asyncio.run(tool.load(src, tz="UTC", rebuild_indexes=not keep))
+            label = "bot.tools.import" + (" --keep-indexes" if keep else "")
+            print(f"{label}: {stats.rows_per_sec:,.0f} строк/с".replace(",", " ")
+                  + " · " + " · ".join(f"{k} {v:.2f} с" for k, v in stats.phases.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""create_order под «утренним наплывом»: commit на каждый заказ vs group commit.
+
+    python -m benchmarks.bench_inserts --seconds 5 --producers 64 --db-dir /var/lib/coffee
+
+Выигрыш group commit определяется ценой fsync: на tmpfs/диске с кэшем записи
+commit почти бесплатен, поэтому --db-dir стоит указывать на боевой том.
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+
+
+async def run(window_ms: float, synchronous: str, seconds: float, producers: int) -> int:
+    from bot import db, repo
+
+    db.DB_GROUP_COMMIT_MS = window_ms
+    db.DB_SYNCHRONOUS = synchronous
+    await db.init_db()
+    await db.open_db()
+    done = 0
+    stop_at = time.perf_counter() + seconds
+
+    async def producer(uid: int):
+        nonlocal done
+        while time.perf_counter() < stop_at:
+            await repo.create_order(user_id=uid, chat_id=uid, drink="latte", size="small", milk="no")
+            done += 1
+
+    await asyncio.gather(*(producer(i) for i in range(producers)))
+    await db.close_db()
+    return done
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--seconds", type=float, default=5.0)
+    ap.add_argument("--producers", type=int, default=64)
+    ap.add_argument("--db-dir", default=None, help="где создавать временную БД (по умолчанию системный tmp)")
+    args = ap.parse_args()
+
+    for synchronous in ("FULL", "NORMAL"):
+        for window_ms in (0, 2, 5):
+            with tempfile.TemporaryDirectory(dir=args.db_dir) as tmp:
+                from bot import db
+                db.DB_PATH = Path(tmp) / "bench.sqlite3"
+                n = asyncio.run(run(window_ms, synchronous, args.seconds, args.producers))
+                label = "off" if not window_ms else f"{window_ms}ms"
+                print(f"synchronous={synchronous:<6} group_commit={label:<4} inserts/s={n / args.seconds:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Клавиатура на одно сообщение: собрать разметку + подготовить запрос к Bot API.
+
+    python -m benchmarks.bench_keyboards --n 20000
+
+«было» — новая разметка на каждый вызов и обычная AiohttpSession;
+«стало» — общая разметка из keyboards.py и JSON из MarkupCachingSession.
+Сеть не участвует: меряется только build_form_data.
+"""
+import argparse
+import asyncio
+import time
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import SendMessage
+
+from bot import keyboards
+from bot.session import MarkupCachingSession
+
+CASES = {
+    "drink_kb": ((), {}),
+    "main_kb": ((), {}),
+    "history_actions_kb": ((12345,), {"display_no": 17}),
+    "top_periods_kb": (("week",), {}),
+}
+
+
+def _per_message(session, bot, factory, args, kwargs, n: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(n):
+        markup = factory(*args, **kwargs)
+        session.build_form_data(bot, SendMessage(chat_id=1, text="☕", reply_markup=markup))
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+async def run(n: int) -> None:
+    plain, cached = AiohttpSession(), MarkupCachingSession()
+    bot = Bot("42:TEST", session=plain)
+    print(f"{'клавиатура':<20} {'было, µs':>10} {'стало, µs':>10} {'x':>6}")
+    for name, (args, kwargs) in CASES.items():
+        factory = getattr(keyboards, name)
+        before = _per_message(plain, bot, factory.__wrapped__, args, kwargs, n)
+        after = _per_message(cached, bot, factory, args, kwargs, n)
+        print(f"{name:<20} {before:>10.1f} {after:>10.1f} {before / after:>6.1f}")
+    await plain.close()
+    await cached.close()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=20_000)
+    args = ap.parse_args()
+    asyncio.run(run(args.n))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Цена инструментирования на одно событие.
+
+    python -m benchmarks.bench_metrics --n 200000
+
+Сравнивает голые вызовы с обёрнутыми: Counter.inc / Histogram.observe,
+@timed на пустой корутине, оба middleware вокруг пустого хэндлера. Разница
+на полном dp.feed_update теряется в его собственном разбросе — он печатается
+только для масштаба.
+"""
+import argparse
+import asyncio
+import time
+
+from aiogram import Dispatcher
+from aiogram.types import Message, Update
+
+from bot import metrics
+
+
+def _per_call(fn, n: int) -> float:
+    t0 = time.perf_counter()
+    fn(n)
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+def _bench_primitives(n: int) -> dict[str, float]:
+    c = metrics.Counter("bench_total", "bench", ("fn",))
+    h = metrics.Histogram("bench_seconds", "bench", ("fn",))
+    metrics.REGISTRY.remove(c)
+    metrics.REGISTRY.remove(h)
+
+    def inc(k):
+        for _ in range(k):
+            c.inc("x")
+
+    def observe(k):
+        for _ in range(k):
+            h.observe(0.003, "x")
+
+    def empty(k):
+        for _ in range(k):
+            pass
+
+    base = _per_call(empty, n)
+    return {"counter_inc_us": _per_call(inc, n) - base, "histogram_observe_us": _per_call(observe, n) - base}
+
+
+async def _bench_timed(n: int) -> float:
+    async def bare():
+        return 1
+
+    wrapped = metrics.timed(bare)
+
+    async def loop(fn):
+        t0 = time.perf_counter()
+        for _ in range(n):
+            await fn()
+        return time.perf_counter() - t0
+
+    plain, timed = await loop(bare), await loop(wrapped)
+    return (timed - plain) / n * 1e6
+
+
+def _update(i: int) -> Update:
+    return Update.model_validate({
+        "update_id": i,
+        "message": {"message_id": i, "date": 1700000000, "text": "x",
+                    "chat": {"id": 1, "type": "private"},
+                    "from": {"id": 1, "is_bot": False, "first_name": "U"}},
+    })
+
+
+async def _bench_middlewares(n: int) -> float:
+    """Оба middleware вокруг пустого хэндлера против прямого вызова хэндлера."""
+    async def handler(event, data):
+        return None
+
+    class _Handler:
+        callback = handler
+
+    event = _update(1)
+    data = {"handler": _Handler()}
+    outer, inner = metrics.UpdateMetricsMiddleware(), metrics.HandlerMetricsMiddleware()
+
+    async def wrapped(event, data):
+        return await outer(lambda e, d: inner(handler, e, d), event, data)
+
+    async def loop(fn):
+        t0 = time.perf_counter()
+        for _ in range(n):
+            await fn(event, data)
+        return time.perf_counter() - t0
+
+    plain, instrumented = await loop(handler), await loop(wrapped)
+    return (instrumented - plain) / n * 1e6
+
+
+async def _bench_dispatch(n: int) -> float:
+    """Для масштаба: сколько стоит сам прогон апдейта через dp (без метрик)."""
+    from aiogram import Bot
+
+    dp = Dispatcher()
+
+    @dp.message()
+    async def handle(message: Message):
+        return None
+
+    bot = Bot("42:TEST")
+    updates = [_update(i) for i in range(n)]
+    t0 = time.perf_counter()
+    for u in updates:
+        await dp.feed_update(bot, u)
+    elapsed = time.perf_counter() - t0
+    await bot.session.close()
+    return elapsed / n * 1e6
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=200_000)
+    args = ap.parse_args()
+
+    for name, us in _bench_primitives(args.n).items():
+        print(f"{name:<26} {us:6.2f} µs")
+    print(f"{'timed_wrapper_us':<26} {asyncio.run(_bench_timed(args.n)):6.2f} µs")
+    print(f"{'middlewares_us':<26} {asyncio.run(_bench_middlewares(args.n)):6.2f} µs (update + handler)")
+    n_updates = max(1, args.n // 20)
+    print(f"{'feed_update_us':<26} {asyncio.run(_bench_dispatch(n_updates)):6.2f} µs (для сравнения, без метрик)")
+
+
+if __name__ == "__main__":
+    main()
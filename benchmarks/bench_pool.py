@@ -0,0 +1,79 @@
+"""Смешанная нагрузка чтение/запись при разном числе читателей в пуле.
+
+    python -m benchmarks.bench_pool --rows 200000 --seconds 5
+
+Читатели гоняют drink_counts_between и страницы истории по пользователю
+с большой историей, писатели — create_order. Кроме пропускной способности
+печатается латентность записи: без читателей INSERT стоит в одной очереди
+с тяжёлыми SELECT.
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.bench_export import fill_db
+
+
+def _pct(xs: list[float], q: float) -> float:
+    if not xs:
+        return 0.0
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(q * len(xs)))]
+
+
+async def run(readers: int, seconds: float, concurrency: int, write_share: float) -> tuple[int, int, list[float]]:
+    from bot import db, repo
+
+    db.DB_READERS = readers
+    await db.open_db()
+    rnd = random.Random(readers)
+    reads = writes = 0
+    write_lat: list[float] = []
+    stop_at = time.perf_counter() + seconds
+
+    async def worker():
+        nonlocal reads, writes
+        while time.perf_counter() < stop_at:
+            if rnd.random() < write_share:
+                t0 = time.perf_counter()
+                await repo.create_order(user_id=2, chat_id=2, drink="latte", size="small", milk="no")
+                write_lat.append(time.perf_counter() - t0)
+                writes += 1
+            elif rnd.random() < 0.5:
+                await repo.drink_counts_between(user_id=1, since=0, until=2_147_483_647)
+                reads += 1
+            else:
+                await repo.orders_page_after(user_id=1, drink=None, after=None, limit=6)
+                reads += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    await db.close_db()
+    return reads, writes, write_lat
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=200_000)
+    ap.add_argument("--seconds", type=float, default=5.0)
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--write-share", type=float, default=0.1)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.sqlite3")
+        # DB_PATH читается при импорте bot.db — окружение должно быть готово до fill_db
+        os.environ["DB_FILE"] = path
+        fill_db(path, args.rows)
+        for readers in (0, 1, 2, 4):
+            r, w, lat = asyncio.run(run(readers, args.seconds, args.concurrency, args.write_share))
+            print(
+                f"readers={readers}  reads/s={r / args.seconds:8.1f}  writes/s={w / args.seconds:7.1f}"
+                f"  write p50={_pct(lat, 0.5) * 1000:6.1f}ms p99={_pct(lat, 0.99) * 1000:6.1f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import functools
+import inspect
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "4096"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "60"))
+
+_MISSING = object()
+
+
+class QueryCache:
+    """LRU с TTL для результатов чтения, с индексом «пользователь → ключи».
+
+    Записи без пользователя (глобальные агрегаты) хранятся под user=None и
+    сбрасываются при любой записи. Значения отдаются как есть — не мутировать.
+    """
+
+    def __init__(self, maxsize: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any, int | None]] = OrderedDict()
+        self._by_user: dict[int | None, set[Hashable]] = {}
+        # поколение пользователя: результат, посчитанный до инвалидации, не кладём
+        self._gen: dict[int | None, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return _MISSING
+        expires, value, user = item
+        if expires < time.monotonic():
+            self._drop(key, user)
+            self.misses += 1
+            return _MISSING
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def generation(self, user: int | None) -> int:
+        return self._gen.get(user, 0)
+
+    def put(self, key: Hashable, user: int | None, value: Any, gen: int) -> None:
+        if gen != self.generation(user):
+            return
+        if key in self._data:
+            self._drop(key, self._data[key][2])
+        self._data[key] = (time.monotonic() + self.ttl, value, user)
+        self._by_user.setdefault(user, set()).add(key)
+        while len(self._data) > self.maxsize:
+            old_key, (_, _, old_user) = next(iter(self._data.items()))
+            self._drop(old_key, old_user)
+            self.evictions += 1
+
+    def invalidate_user(self, user_id: int) -> None:
+        """Сбросить всё, что могло измениться после записи пользователя user_id."""
+        for user in (user_id, None):
+            self._gen[user] = self._gen.get(user, 0) + 1
+            for key in self._by_user.pop(user, ()):
+                self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._by_user.clear()
+        self._gen.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _drop(self, key: Hashable, user: int | None) -> None:
+        self._data.pop(key, None)
+        keys = self._by_user.get(user)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[user]
+
+
+CACHE = QueryCache()
+
+
+def _freeze(value: Any) -> Hashable:
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def cached(fn):
+    """Кэширует async-функцию чтения по её аргументам; владелец записи — аргумент user_id."""
+    sig = inspect.signature(fn)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        bound = sig.bind(*args, **kwargs)
+        bound.apply_defaults()
+        user = bound.arguments.get("user_id")
+        key = (fn.__qualname__, _freeze(tuple(bound.arguments.values())))
+        value = CACHE.get(key)
+        if value is not _MISSING:
+            return value
+        gen = CACHE.generation(user)
+        value = await fn(*args, **kwargs)
+        CACHE.put(key, user, value, gen)
+        return value
+
+    return wrapper
@@ -1,6 +1,87 @@
-DRINKS = {"americano": "Americano", "latte": "Latte", "cappuccino": "Cappuccino", "flat white": "Flat white", "mocha": "Mocha"}
+"""Меню: напитки, размеры и добавки с подписями и синонимами на нескольких языках.
 
-SIZES = {"small": "Small", "medium": "Medium", "large": "Large"}
+Таблицы «ввод → код» собираются один раз при импорте. Нажатая кнопка совпадает с
+подписью буква в букву и находится одним dict.get без аллокаций; свободный ввод
+(«FLAT  white», «латте») нормализуется (casefold + схлопывание пробелов) — одна строка.
+"""
+from typing import NamedTuple
 
-def drink_label(code: str) -> str:
-    return "Все" if code == "all" else DRINKS.get(code, code.title())
\ No newline at end of file
+DEFAULT_LOCALE = "en"
+
+
+class Option(NamedTuple):
+    code: str
+    labels: dict[str, str]          # локаль → подпись; DEFAULT_LOCALE обязательна
+    aliases: tuple[str, ...] = ()   # дополнительные написания, в любом регистре
+
+    def label(self, locale: str | None = None) -> str:
+        return self.labels.get(locale or DEFAULT_LOCALE) or self.labels[DEFAULT_LOCALE]
+
+
+DRINK_OPTIONS: tuple[Option, ...] = (
+    Option("americano", {"en": "Americano", "ru": "Американо"}),
+    Option("latte", {"en": "Latte", "ru": "Латте"}, ("лате",)),
+    Option("cappuccino", {"en": "Cappuccino", "ru": "Капучино"}, ("капуччино", "cappucino")),
+    Option("flat white", {"en": "Flat white", "ru": "Флэт уайт"}, ("flatwhite", "флет уайт", "флэт вайт")),
+    Option("mocha", {"en": "Mocha", "ru": "Мокко"}, ("мока", "мокка")),
+)
+
+SIZE_OPTIONS: tuple[Option, ...] = (
+    Option("small", {"en": "Small", "ru": "Маленький"}, ("s", "маленькая")),
+    Option("medium", {"en": "Medium", "ru": "Средний"}, ("m", "средняя")),
+    Option("large", {"en": "Large", "ru": "Большой"}, ("l", "большая")),
+)
+
+# добавки: код добавки → варианты
+MODIFIERS: dict[str, tuple[Option, ...]] = {
+    "milk": (
+        Option("yes", {"en": "Yes", "ru": "Да"}, ("y", "с молоком")),
+        Option("no", {"en": "No", "ru": "Нет"}, ("n", "без молока")),
+    ),
+}
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.casefold().split())
+
+
+class Matcher:
+    """Ввод пользователя → код варианта за O(1)."""
+
+    __slots__ = ("exact", "folded")
+
+    def __init__(self, options: tuple[Option, ...]):
+        self.exact: dict[str, str] = {}
+        self.folded: dict[str, str] = {}
+        for opt in options:
+            for spelling in (opt.code, *opt.labels.values(), *opt.aliases):
+                self.exact.setdefault(spelling, opt.code)
+                key = normalize(spelling)
+                if self.folded.setdefault(key, opt.code) != opt.code:
+                    raise ValueError(f"синоним {spelling!r} у двух вариантов: {self.folded[key]}, {opt.code}")
+
+    def __call__(self, text: str | None) -> str | None:
+        if not text:
+            return None
+        code = self.exact.get(text)
+        if code is None:
+            code = self.folded.get(normalize(text))
+        return code
+
+
+match_drink = Matcher(DRINK_OPTIONS)
+match_size = Matcher(SIZE_OPTIONS)
+match_milk = Matcher(MODIFIERS["milk"])
+
+# код → подпись по умолчанию (историческое API: DRINKS[code], code in DRINKS)
+DRINKS: dict[str, str] = {o.code: o.label() for o in DRINK_OPTIONS}
+SIZES: dict[str, str] = {o.code: o.label() for o in SIZE_OPTIONS}
+
+_DRINK_BY_CODE = {o.code: o for o in DRINK_OPTIONS}
+
+
+def drink_label(code: str, locale: str | None = None) -> str:
+    if code == "all":
+        return "Все"
+    opt = _DRINK_BY_CODE.get(code)
+    return opt.label(locale) if opt else code.title()
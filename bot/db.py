@@ -1,7 +1,11 @@
 from pathlib import Path
 import aiosqlite
+import asyncio
 import logging
 import os
+from .group_commit import GroupCommitter
+from .cache import CACHE
+from .migrations import migrate
 
 db_logger = logging.getLogger("db")
 
@@ -24,33 +28,107 @@ CREATE TABLE IF NOT EXISTS orders (
     locale     TEXT
 );
 
-CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders(user_id, created_at DESC, id DESC);
-CREATE INDEX IF NOT EXISTS idx_orders_drink ON orders(drink);
-CREATE INDEX IF NOT EXISTS idx_orders_deleted ON orders(deleted_at);
+-- рассылки: прогресс сохраняется после каждой пачки получателей, чтобы
+-- после рестарта продолжить с cursor_uid (все user_id <= cursor_uid обработаны)
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    admin_chat   INTEGER NOT NULL,
+    text         TEXT    NOT NULL,
+    status       TEXT    NOT NULL DEFAULT 'running',
+    cursor_uid   INTEGER NOT NULL DEFAULT 0,
+    total        INTEGER NOT NULL DEFAULT 0,
+    sent         INTEGER NOT NULL DEFAULT 0,
+    failed       INTEGER NOT NULL DEFAULT 0,
+    created_at   INTEGER NOT NULL,
+    finished_at  INTEGER
+);
+
+-- состояние FSM (незавершённые заказы и т.п.), см. bot/fsm_storage.py
+CREATE TABLE IF NOT EXISTS fsm_state (
+    key        TEXT PRIMARY KEY,
+    state      TEXT,
+    data       TEXT,
+    updated_at INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_fsm_state_updated ON fsm_state(updated_at);
 """
 
+# пул: один писатель (все INSERT/UPDATE идут через него последовательно)
+# и DB_READERS read-only соединений — в WAL они читают параллельно писателю
+DB_READERS = max(0, int(os.getenv("DB_READERS", "2")))
+
+# group commit: INSERT'ы заказов, пришедшие в пределах окна, коммитятся одной транзакцией.
+# 0 — выключено (commit на каждый заказ, как раньше)
+DB_GROUP_COMMIT_MS = float(os.getenv("DB_GROUP_COMMIT_MS", "0"))
+# PRAGMA synchronous для писателя: FULL — fsync на каждый commit, NORMAL — в WAL
+# последние транзакции могут потеряться при отключении питания, но не при падении процесса
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "FULL").upper()
+
 _DB: aiosqlite.Connection | None = None
+# транзакции писателя не пересекаются: execute ... commit/rollback каждого изменения
+# (и пачки group commit) идут под этим замком, иначе чужой rollback откатит и наше
+_WRITE_LOCK: asyncio.Lock | None = None
+_COMMITTER: GroupCommitter | None = None
+_READERS: list[aiosqlite.Connection] = []
+_reader_rr = 0
 
 async def init_db() -> None:
     async with aiosqlite.connect(DB_PATH) as conn:
         await conn.executescript(CREATE_SQL)
         await conn.commit()
+        await migrate(conn)
         db_logger.info("DB PATH: %s", DB_PATH.resolve())
 
 async def open_db() -> aiosqlite.Connection:
-    global _DB
+    global _DB, _COMMITTER, _WRITE_LOCK
     if _DB is None:
         _DB = await aiosqlite.connect(DB_PATH)
+        _WRITE_LOCK = asyncio.Lock()
         await _DB.execute("PRAGMA foreign_keys=ON;")
+        if DB_SYNCHRONOUS in {"OFF", "NORMAL", "FULL", "EXTRA"}:
+            await _DB.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS};")
+        if DB_GROUP_COMMIT_MS > 0:
+            _COMMITTER = GroupCommitter(_DB, window_ms=DB_GROUP_COMMIT_MS, lock=_WRITE_LOCK)
+    if not _READERS:
+        uri = f"{DB_PATH.resolve().as_uri()}?mode=ro"
+        for _ in range(DB_READERS):
+            _READERS.append(await aiosqlite.connect(uri, uri=True))
     return _DB
 
 def get_db() -> aiosqlite.Connection:
+    """Соединение-писатель. Через него идут все изменения."""
     if _DB is None:
         raise RuntimeError("DB is not opened. Call open_db() first.")
     return _DB
 
+def write_lock() -> asyncio.Lock:
+    """Замок транзакций писателя: под ним — от первого изменения до commit."""
+    if _WRITE_LOCK is None:
+        raise RuntimeError("DB is not opened. Call open_db() first.")
+    return _WRITE_LOCK
+
+def get_committer() -> GroupCommitter | None:
+    """GroupCommitter писателя или None, если group commit выключен."""
+    return _COMMITTER
+
+def get_reader() -> aiosqlite.Connection:
+    """Read-only соединение из пула (round-robin). Без читателей — писатель."""
+    global _reader_rr
+    if not _READERS:
+        return get_db()
+    _reader_rr = (_reader_rr + 1) % len(_READERS)
+    return _READERS[_reader_rr]
+
 async def close_db() -> None:
-    global _DB
+    global _DB, _COMMITTER, _WRITE_LOCK
+    if _COMMITTER is not None:
+        await _COMMITTER.close()
+        _COMMITTER = None
+    for conn in _READERS:
+        await conn.close()
+    _READERS.clear()
     if _DB is not None:
         await _DB.close()
-        _DB = None
\ No newline at end of file
+        _DB = None
+        _WRITE_LOCK = None
+    CACHE.clear()
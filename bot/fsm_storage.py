@@ -0,0 +1,226 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import aiosqlite
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from . import db
+
+log = logging.getLogger("fsm")
+
+# через сколько мс после изменения состояние уходит в SQLite (пачкой)
+FSM_FLUSH_MS = float(os.getenv("FSM_FLUSH_MS", "200"))
+# незавершённый заказ старше этого считается брошенным и удаляется
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", str(24 * 3600)))
+# сколько секунд доверять копии в памяти без перечитывания из БД.
+# <0 — всегда (один процесс); для нескольких инстансов — 0..1 с
+FSM_FRONT_TTL = float(os.getenv("FSM_FRONT_TTL", "-1"))
+FSM_FRONT_SIZE = 10_000
+SWEEP_EVERY_SEC = 600
+
+UPSERT_SQL = """
+INSERT INTO fsm_state(key, state, data, updated_at) VALUES (?, ?, ?, ?)
+ON CONFLICT(key) DO UPDATE SET
+    state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+"""
+
+
+class _Entry:
+    __slots__ = ("state", "data", "touched", "loaded", "version", "flushed")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any], touched: float) -> None:
+        self.state = state
+        self.data = data
+        self.touched = touched          # time.time() последнего изменения — для TTL
+        self.loaded = time.monotonic()  # когда копия сверялась с БД
+        self.version = 0
+        self.flushed = 0                # version, записанная в БД
+
+    @property
+    def dirty(self) -> bool:
+        return self.version != self.flushed
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в таблице fsm_state той же базы, что и orders.
+
+    Чтения и записи идут в словарь в памяти; изменённые ключи через flush_ms
+    пишутся в SQLite одной транзакцией (executemany). Пустое состояние — DELETE.
+    Своё соединение: транзакции хранилища не смешиваются с транзакциями писателя.
+    """
+
+    def __init__(
+        self,
+        path=None,
+        *,
+        flush_ms: float = FSM_FLUSH_MS,
+        state_ttl: float = FSM_STATE_TTL,
+        front_ttl: float = FSM_FRONT_TTL,
+        front_size: int = FSM_FRONT_SIZE,
+        key_builder: KeyBuilder | None = None,
+    ) -> None:
+        self.path = path
+        self.flush_window = flush_ms / 1000
+        self.state_ttl = state_ttl
+        self.front_ttl = front_ttl
+        self.front_size = front_size
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._front: OrderedDict[str, _Entry] = OrderedDict()
+        self._conn: aiosqlite.Connection | None = None
+        self._open_lock = asyncio.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._timer: asyncio.Task | None = None
+        self._last_sweep = time.monotonic()
+
+    # ---------- BaseStorage ----------
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = await self._entry(key)
+        entry.state = state.state if isinstance(state, State) else state
+        self._touch(entry)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._entry(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        entry = await self._entry(key)
+        entry.data = data.copy()
+        self._touch(entry)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._entry(key)).data.copy()
+
+    async def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._conn is not None:
+            await self.flush()
+            await self._conn.close()
+            self._conn = None
+        self._front.clear()
+
+    # ---------- фронт в памяти ----------
+
+    async def _entry(self, key: StorageKey) -> _Entry:
+        k = self.key_builder.build(key)
+        entry = self._front.get(k)
+        if entry is not None and (entry.dirty or self._trusted(entry)):
+            self._front.move_to_end(k)
+            if self._expired(entry.touched):
+                entry.state, entry.data = None, {}
+                self._touch(entry)
+            return entry
+
+        loaded = await self._load(k)
+        # пока читали, ключ мог измениться — свежая копия в памяти важнее
+        current = self._front.get(k)
+        if current is not None and (current is not entry or current.dirty):
+            return current
+        if entry is not None:
+            # обновляем на месте: ссылку на запись могут держать другие корутины
+            entry.state, entry.data, entry.touched = loaded.state, loaded.data, loaded.touched
+            entry.loaded = loaded.loaded
+            loaded = entry
+        self._front[k] = loaded
+        self._front.move_to_end(k)
+        self._evict()
+        return loaded
+
+    def _trusted(self, entry: _Entry) -> bool:
+        return self.front_ttl < 0 or time.monotonic() - entry.loaded <= self.front_ttl
+
+    def _expired(self, touched: float) -> bool:
+        return self.state_ttl > 0 and time.time() - touched > self.state_ttl
+
+    def _touch(self, entry: _Entry) -> None:
+        entry.touched = time.time()
+        entry.loaded = time.monotonic()
+        entry.version += 1
+        if self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    def _evict(self) -> None:
+        if len(self._front) <= self.front_size:
+            return
+        for k in list(self._front):
+            if len(self._front) <= self.front_size:
+                break
+            if not self._front[k].dirty:
+                del self._front[k]
+
+    # ---------- SQLite ----------
+
+    async def _db(self) -> aiosqlite.Connection:
+        async with self._open_lock:
+            if self._conn is None:
+                self._conn = await aiosqlite.connect(self.path or db.DB_PATH)
+                # потеря последних переходов FSM при отключении питания допустима — fsync не ждём
+                await self._conn.execute("PRAGMA synchronous=NORMAL;")
+        return self._conn
+
+    async def _load(self, k: str) -> _Entry:
+        conn = await self._db()
+        async with conn.execute(
+            "SELECT state, data, updated_at FROM fsm_state WHERE key = ?", (k,)
+        ) as cur:
+            row = await cur.fetchone()
+        if row is None or self._expired(row[2]):
+            return _Entry(None, {}, time.time())
+        state, data, updated_at = row
+        return _Entry(state, json.loads(data) if data else {}, float(updated_at))
+
+    async def _flush_later(self) -> None:
+        try:
+            await asyncio.sleep(self.flush_window)
+        finally:
+            self._timer = None
+        try:
+            await self.flush()
+        except Exception:
+            log.exception("fsm flush failed")
+            if self._timer is None and any(e.dirty for e in self._front.values()):
+                self._timer = asyncio.create_task(self._flush_later())
+
+    async def flush(self) -> None:
+        """Записывает в SQLite все изменённые ключи одной транзакцией."""
+        async with self._flush_lock:
+            batch = [(k, e, e.version) for k, e in self._front.items() if e.dirty]
+            sweep = time.monotonic() - self._last_sweep >= SWEEP_EVERY_SEC
+            if not batch and not sweep:
+                return
+
+            upserts, deletes = [], []
+            for k, e, _ in batch:
+                if e.state is None and not e.data:
+                    deletes.append((k,))
+                else:
+                    upserts.append((k, e.state, json.dumps(e.data, ensure_ascii=False), int(e.touched)))
+
+            conn = await self._db()
+            try:
+                if upserts:
+                    await conn.executemany(UPSERT_SQL, upserts)
+                if deletes:
+                    await conn.executemany("DELETE FROM fsm_state WHERE key = ?", deletes)
+                if sweep and self.state_ttl > 0:
+                    await conn.execute("DELETE FROM fsm_state WHERE updated_at < ?",
+                                       (int(time.time() - self.state_ttl),))
+                await conn.commit()
+            except aiosqlite.Error:
+                await conn.rollback()
+                raise
+
+            for _, e, version in batch:
+                e.flushed = max(e.flushed, version)
+            if sweep:
+                self._last_sweep = time.monotonic()
+                for k in [k for k, e in self._front.items() if not e.dirty and self._expired(e.touched)]:
+                    del self._front[k]
+            self._evict()
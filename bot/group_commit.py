@@ -0,0 +1,103 @@
+import asyncio
+import logging
+
+import aiosqlite
+
+log = logging.getLogger("db")
+
+
+class GroupCommitter:
+    """Склеивает INSERT'ы, пришедшие в пределах window_ms, в одну транзакцию.
+
+    Каждый вызывающий получает свой lastrowid; commit (и fsync) — один на пачку.
+    Если commit упал — ошибку получают все ожидающие этой пачки.
+    lock — общий замок транзакций соединения (db.write_lock()): пачка от executemany
+    до commit/rollback идёт под ним, чужие изменения в неё не попадают.
+    """
+
+    def __init__(self, conn: aiosqlite.Connection, *, window_ms: float, max_batch: int = 256,
+                 lock: asyncio.Lock | None = None):
+        self.conn = conn
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._pending: list[tuple[str, tuple, asyncio.Future]] = []
+        self._timer: asyncio.Task | None = None
+        self._flushes: set[asyncio.Task] = set()
+        self._lock = lock or asyncio.Lock()
+
+    async def insert(self, sql: str, params: tuple) -> int:
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append((sql, params, fut))
+        if len(self._pending) >= self.max_batch:
+            # ссылку держим, иначе задачу может собрать GC до завершения
+            task = asyncio.create_task(self.flush())
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+        return await fut
+
+    async def _flush_later(self) -> None:
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            self._timer = None
+        await self.flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    async def flush(self) -> None:
+        async with self._lock:
+            while self._pending:
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+                await self._commit_batch(batch)
+
+    async def _commit_batch(self, batch: list[tuple[str, tuple, asyncio.Future]]) -> None:
+        try:
+            ids = await self._insert_many(batch)
+            await self.conn.commit()
+        except aiosqlite.Error as e:
+            log.exception("group commit failed, batch=%s", len(batch))
+            await self.conn.rollback()
+            ids = [e] * len(batch)
+
+        for (_, _, fut), res in zip(batch, ids):
+            if fut.done():
+                continue
+            if isinstance(res, BaseException):
+                fut.set_exception(res)
+            else:
+                fut.set_result(res)
+
+    async def _insert_many(self, batch: list[tuple[str, tuple, asyncio.Future]]) -> list[int | BaseException]:
+        sql = batch[0][0]
+        if all(item[0] == sql for item in batch):
+            # одна транзакция, один писатель, AUTOINCREMENT — id идут подряд,
+            # так что executemany + last_insert_rowid() дают id каждой строки
+            try:
+                await self.conn.executemany(sql, [params for _, params, _ in batch])
+                cur = await self.conn.execute("SELECT last_insert_rowid()")
+                (last,) = await cur.fetchone()
+                return list(range(last - len(batch) + 1, last + 1))
+            except aiosqlite.IntegrityError:
+                # строки до сбойной уже вставлены — откатываем и вставляем по одной,
+                # чтобы ошибку получил только виновник
+                await self.conn.rollback()
+
+        ids: list[int | BaseException] = []
+        for sql, params, _ in batch:
+            try:
+                cur = await self.conn.execute(sql, params)
+                ids.append(cur.lastrowid)
+            except aiosqlite.IntegrityError as e:
+                ids.append(e)
+        return ids
+
+    async def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
@@ -1,13 +1,15 @@
 import datetime
-import io, csv
-from typing import Iterable
+import io, csv, os
+import tempfile
+from typing import AsyncIterable, Iterable
 
-from aiogram.types import Message
+from aiogram.types import Message, InputFile
 from aiogram.fsm.context import FSMContext
 
 from .order_states import OrderState
 from .keyboards import main_kb, drink_kb, resume_or_cancel_kb
 from .catalog import DRINKS, SIZES
+from .services.pricing import estimate_totals
 
 async def send_home(msg: Message) -> None:
     drinks_text = "\n".join(DRINKS.values())
@@ -98,19 +100,68 @@ def period_bounds(tag_or_from: str | None = None, to: str | None = None) -> tupl
 
     return int(start.timestamp()), int(end.timestamp())
 
+# total — сохранённая сумма заказа (пусто, если её нет; в /analytics такие заказы дают 0),
+# estimated_total — оценка по текущему прайсу только для заказов без суммы
+EXPORT_HEADER = ["id", "created_at", "drink", "size", "milk", "total", "estimated_total"]
+
+# сколько держим в памяти, прежде чем SpooledTemporaryFile уйдёт на диск
+EXPORT_SPOOL_MAX = int(os.getenv("EXPORT_SPOOL_MAX", str(1024 * 1024)))
+
+def _rub(kop: int | None) -> str:
+    return "" if kop is None else f"{kop / 100:.2f}"
+
+def _csv_row(r: tuple, estimate: int | None) -> list:
+    oid, drink, size, milk, created, total = r
+    return [oid, iso_from_epoch(created), drink, size, milk, _rub(total), _rub(estimate)]
+
 def orders_to_csv(rows: Iterable[tuple]) -> bytes:
     buf = io.StringIO(newline="")  # текстовый буфер
     w = csv.writer(buf)
 
-    w.writerow(["id", "created_at", "drink", "size", "milk"])
+    w.writerow(EXPORT_HEADER)
 
-    for r in rows:
-        oid, drink, size, milk, created = r
-        iso_from_epoch(created)
-        created_iso = iso_from_epoch(created)
-
-        w.writerow([oid, created_iso, drink, size, milk])
+    rows = list(rows)
+    for r, estimate in zip(rows, estimate_totals(rows)):
+        w.writerow(_csv_row(r, estimate))
 
     # превратим в bytes
     text = buf.getvalue()
-    return text.encode("utf-8")
\ No newline at end of file
+    return text.encode("utf-8")
+
+async def spool_orders_csv(batches: AsyncIterable[list[tuple]]) -> tuple[tempfile.SpooledTemporaryFile, int]:
+    """Пишет CSV пачками в SpooledTemporaryFile. Возвращает (файл, число строк).
+
+    В памяти одновременно живёт только одна пачка строк и её текст.
+    """
+    out = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX, mode="w+b")
+    buf = io.StringIO(newline="")
+    w = csv.writer(buf)
+    w.writerow(EXPORT_HEADER)
+    count = 0
+
+    try:
+        async for batch in batches:
+            w.writerows(_csv_row(r, estimate) for r, estimate in zip(batch, estimate_totals(batch)))
+            count += len(batch)
+            out.write(buf.getvalue().encode("utf-8"))
+            buf.seek(0)
+            buf.truncate()
+    except BaseException:
+        out.close()
+        raise
+
+    out.write(buf.getvalue().encode("utf-8"))
+    out.seek(0)
+    return out, count
+
+class SpooledInputFile(InputFile):
+    """InputFile поверх открытого бинарного файла — отдаётся в Telegram чанками."""
+
+    def __init__(self, file, filename: str, chunk_size: int = 64 * 1024):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.file = file
+
+    async def read(self, bot):
+        self.file.seek(0)
+        while chunk := self.file.read(self.chunk_size):
+            yield chunk
@@ -1,12 +1,48 @@
+"""Клавиатуры бота.
+
+Модели aiogram неизменяемы (frozen), поэтому одну разметку можно отдавать во
+все сообщения: статические строятся один раз (@cache), с параметрами — кэшируются
+по аргументам с вытеснением (@lru_cache). Уникальные на каждый вызов
+(history_more_kb с курсором, undo_delete_kb с секундами) не кэшируются — попаданий не будет.
+Готовый JSON разметки кэширует сессия бота (bot/session.py) — только для разметок
+из этих кэшей (is_shared): JSON одноразовых вытеснял бы из её кэша общие.
+"""
+import os
+from functools import cache, lru_cache, wraps
+from weakref import WeakValueDictionary
+
 from aiogram.types import (
     InlineKeyboardMarkup, InlineKeyboardButton,
     ReplyKeyboardMarkup, KeyboardButton
 )
-from .catalog import DRINKS
+from .catalog import DRINKS, DRINK_OPTIONS, SIZE_OPTIONS, MODIFIERS
 
 BTN_CANCEL = "Отменить заказ 🚫"
+BTN_BACK = "↩ Назад"
+
+KEYBOARD_CACHE_SIZE = int(os.getenv("KEYBOARD_CACHE_SIZE", "1024"))
+
+# id → разметка из кэша ниже; вытесненная из lru_cache уходит отсюда сама
+_SHARED: WeakValueDictionary = WeakValueDictionary()
+
+
+def _shared(build):
+    """Отмечает разметки, которые строит кэшируемый builder (ставится под @cache / @lru_cache)."""
+    @wraps(build)
+    def wrapper(*args, **kwargs):
+        markup = build(*args, **kwargs)
+        _SHARED[id(markup)] = markup
+        return markup
+    return wrapper
 
 
+def is_shared(markup) -> bool:
+    """Разметка из кэша клавиатур — тот же объект придёт ещё не раз."""
+    return _SHARED.get(id(markup)) is markup
+
+
+@cache
+@_shared
 def main_kb():
     return ReplyKeyboardMarkup(
         keyboard=[
@@ -18,12 +54,16 @@ def main_kb():
     )
 
 
-def drink_kb():
+def _reply_rows(labels: list[str], per_row: int) -> list[list[KeyboardButton]]:
+    return [[KeyboardButton(text=t) for t in labels[i:i + per_row]] for i in range(0, len(labels), per_row)]
+
+
+@cache
+@_shared
+def drink_kb(locale: str | None = None):
     return ReplyKeyboardMarkup(
         keyboard=[
-            [KeyboardButton(text="Latte"), KeyboardButton(text="Cappuccino")],
-            [KeyboardButton(text="Americano"), KeyboardButton(text="Flat White")],
-            [KeyboardButton(text="Mocha")],
+            *_reply_rows([o.label(locale) for o in DRINK_OPTIONS], 2),
             [KeyboardButton(text=BTN_CANCEL)],
         ],
         resize_keyboard=True,
@@ -31,21 +71,25 @@ def drink_kb():
     )
 
 
-def size_kb():
+@cache
+@_shared
+def size_kb(locale: str | None = None):
     return ReplyKeyboardMarkup(
         keyboard=[
-            [KeyboardButton(text="Small"), KeyboardButton(text="Medium"), KeyboardButton(text="Large")],
-            [KeyboardButton(text="↩ Назад"), KeyboardButton(text=BTN_CANCEL)],
+            [KeyboardButton(text=o.label(locale)) for o in SIZE_OPTIONS],
+            [KeyboardButton(text=BTN_BACK), KeyboardButton(text=BTN_CANCEL)],
         ],
         resize_keyboard=True,
         one_time_keyboard=True,
     )
 
 
-def milk_kb():
+@cache
+@_shared
+def milk_kb(locale: str | None = None):
     return ReplyKeyboardMarkup(
         keyboard=[
-            [KeyboardButton(text="Yes"), KeyboardButton(text="No"), KeyboardButton(text="↩ Назад")],
+            [*(KeyboardButton(text=o.label(locale)) for o in MODIFIERS["milk"]), KeyboardButton(text=BTN_BACK)],
             [KeyboardButton(text=BTN_CANCEL)],
         ],
         resize_keyboard=True,
@@ -53,6 +97,8 @@ def milk_kb():
     )
 
 
+@cache
+@_shared
 def resume_or_cancel_kb():
     return ReplyKeyboardMarkup(
         keyboard=[[KeyboardButton(text="Продолжить заказ"), KeyboardButton(text=BTN_CANCEL)]],
@@ -61,6 +107,8 @@ def resume_or_cancel_kb():
     )
 
 
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+@_shared
 def history_actions_kb(order_id: int, display_no: int | None = None) -> InlineKeyboardMarkup:
     tag = f"№{display_no}" if display_no is not None else f"#{order_id}"
     b1 = InlineKeyboardButton(text=f"🔁 Повторить {tag}", callback_data=f"repeat:{order_id}")
@@ -68,6 +116,8 @@ def history_actions_kb(order_id: int, display_no: int | None = None) -> InlineKe
     return InlineKeyboardMarkup(inline_keyboard=[[b1, b2]])
 
 
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+@_shared
 def confirm_delete_kb(order_id: int, display_no: int) -> InlineKeyboardMarkup:
     yes = InlineKeyboardButton(
         text=f"✅ Да, удалить №{display_no}",
@@ -80,6 +130,8 @@ def confirm_delete_kb(order_id: int, display_no: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[[yes], [cancel]])
 
 
+@cache
+@_shared
 def history_filter_kb() -> InlineKeyboardMarkup:
     rows = [[InlineKeyboardButton(text="☕ Все", callback_data="history_filter:all")]]
     codes = list(DRINKS.items())
@@ -92,15 +144,18 @@ def history_filter_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
-def history_more_kb(*, drink: str, offset: int, remain: int) -> InlineKeyboardMarkup:
+def history_more_kb(*, drink: str, cursor: tuple[int, int]) -> InlineKeyboardMarkup:
+    created_at, order_id = cursor
     return InlineKeyboardMarkup(inline_keyboard=[[
         InlineKeyboardButton(
-            text=f"Показать ещё {remain}",
-            callback_data=f"history_more:{drink}:{offset}",
+            text="Показать ещё",
+            callback_data=f"history_more:{drink}:{created_at}:{order_id}",
         )
     ]])
 
 
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+@_shared
 def repeat_confirm_kb(order_id: int, display_no: int) -> InlineKeyboardMarkup:
     ok = InlineKeyboardButton(
         text=f"✅ Оформить как №{display_no}",
@@ -119,6 +174,8 @@ def undo_delete_kb(order_id: int, *, seconds_left: int) -> InlineKeyboardMarkup:
     ]])
 
 
+@cache
+@_shared
 def after_order_kb() -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(
         keyboard=[[KeyboardButton(text="➕ Заказать ещё"), KeyboardButton(text="🏠 В меню")]],
@@ -127,6 +184,8 @@ def after_order_kb() -> ReplyKeyboardMarkup:
     )
 
 
+@cache
+@_shared
 def export_periods_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="Сегодня",   callback_data="exp:p:today")],
@@ -136,6 +195,8 @@ def export_periods_kb() -> InlineKeyboardMarkup:
     ])
 
 
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+@_shared
 def export_drink_kb(period: str) -> InlineKeyboardMarkup:
     rows = [[InlineKeyboardButton(text="☕ Все", callback_data=f"exp:d:{period}:all")]]
     codes = list(DRINKS.items())
@@ -148,6 +209,8 @@ def export_drink_kb(period: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+@_shared
 def top_periods_kb(active: str = "30d") -> InlineKeyboardMarkup:
     def lbl(code: str, text: str) -> str:
         return f"• {text}" if code == active else text
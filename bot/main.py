@@ -4,29 +4,39 @@ from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from aiogram import F
 from aiogram.client.default import DefaultBotProperties
-import asyncio, os, math
+import asyncio, os
 from aiogram import Bot, Dispatcher
-from aiogram.filters import CommandStart, Command
-from aiogram.types import Message, BufferedInputFile, CallbackQuery
+from aiogram.filters import CommandStart, Command, CommandObject
+from aiogram.types import Message, CallbackQuery, BufferedInputFile
 from dotenv import load_dotenv
 from .order_states import OrderState
 import time
 from .db import init_db, open_db, close_db, DB_PATH
-from .catalog import DRINKS, SIZES
+from .cache import CACHE
+from .catalog import DRINKS, SIZES, match_drink, match_size, match_milk
 from .keyboards import (main_kb, drink_kb, size_kb, milk_kb, resume_or_cancel_kb,
 history_actions_kb, history_filter_kb, undo_delete_kb, repeat_confirm_kb,
-                        BTN_CANCEL, export_periods_kb, confirm_delete_kb, export_drink_kb,
+                        BTN_CANCEL, BTN_BACK, export_periods_kb, confirm_delete_kb, export_drink_kb,
                         top_periods_kb, after_order_kb)
-from .services.history import send_history_page
+from .services.history import send_history_page, parse_cb
 from .services.stats import render_stats
+from .services.pricing import quote_order
+from .services import analytics
+from .services.broadcast import start_broadcast_job, resume_broadcasts, stop_broadcasts
+from .webhook import run_webhook
+from .fsm_storage import SQLiteStorage
+from .session import MarkupCachingSession
+from . import migrations, metrics, profiler
 from .services.undo import remember_deleted, get_pending, seconds_left, start_undo_countdown, UNDO_DEADLINE_SEC, UNDO_BIN
-from .helpers import send_home, start_order_flow, period_bounds, orders_to_csv
+from .helpers import send_home, start_order_flow, period_bounds, spool_orders_csv, SpooledInputFile
 from datetime import datetime, timedelta
-from .repo import (get_order_by_id, create_order, soft_delete, undo_delete, orders_for_period,
+from html import escape
+from .repo import (get_order_by_id, create_order, soft_delete, undo_delete, iter_orders_for_period,
                    drink_counts_between, ping_db, count_orders, count_deleted, db_size_bytes, count_total_orders,
-                   last_order_at, distinct_users_with_orders, user_order_number)
+                   last_order_at, count_users_with_orders, create_broadcast, user_order_numbers,
+                   window_end, DAY, HOUR)
 import logging
-from .utils import fmt_ts, fmt_size
+from .utils import fmt_ts, fmt_size, fmt_money
 from aiogram.fsm.state import State, StatesGroup
 
 # ---------- Конфигурация ----------
@@ -48,9 +58,12 @@ logger = logging.getLogger("bot")
 load_dotenv()
 TOKEN = os.getenv("BOT_TOKEN")
 BOT_VERSION = os.getenv("BOT_VERSION", "0.1.0")
+# polling — по умолчанию; webhook — aiohttp-сервер (см. bot/webhook.py)
+RUN_MODE = os.getenv("RUN_MODE", "polling").lower()
 STARTED_AT: float | None = None
 bot: Bot | None = None
-dp = Dispatcher()
+dp = Dispatcher(storage=SQLiteStorage())
+metrics.setup_dispatcher(dp)
 
 # ---------- Меню ----------
 
@@ -80,47 +93,7 @@ def _fmt_uptime(second: int) -> str:
 def _parse_drink_token(tok: str | None) -> str | None:
     if not tok:
         return None
-    code = tok.strip().lower()
-    return code if code in DRINKS else None
-
-async def _undo_countdown(key: tuple[int, int]):
-    while True:
-        payload = UNDO_BIN.get(key)
-        if not payload:
-            return
-
-        remain = math.ceil(payload["until"] - time.time())
-        if remain <= 0:
-            break
-
-        try:
-            sec = max(0, int(payload['until'] - time.time()))
-            await bot.edit_message_reply_markup(
-                chat_id=payload["chat_id"],
-                message_id=payload["message_id"],
-                reply_markup=undo_delete_kb(payload["order_id"], seconds_left=sec),
-            )
-        except TelegramBadRequest as e:
-            if "message is not modified" not in str(e).lower():
-                logger.warning("undo tick error:", e)
-                break
-
-        await asyncio.sleep(1)
-
-    payload = UNDO_BIN.pop(key, None)
-    if payload:
-        with suppress(TelegramBadRequest):
-            await bot.edit_message_reply_markup(
-                chat_id=payload["chat_id"],
-                message_id=payload["message_id"],
-                reply_markup=None
-            )
-            await bot.edit_message_text(
-                chat_id=payload["chat_id"],
-                message_id=payload["message_id"],
-                text=f"🗑 Заказ #{payload['order_id']} удалён навсегда.",
-                disable_web_page_preview=True
-            )
+    return match_drink(tok)
 
 def _to_epoch(x):
     if isinstance(x, int):
@@ -141,14 +114,12 @@ def _bounds_for_top(period: str) -> tuple[int, int]:
         start_today = now.replace(hour=0, minute=0, second=0, microsecond=0)
         since_dt = start_today - timedelta(days=6)
         until_dt = start_today + timedelta(days=1)
-    elif period in ("month", "30d"):
-        since_dt = now - timedelta(days=30)
-        until_dt = now + timedelta(seconds=1)
     elif period == "all":
         return 0, 2_147_483_647
     else:
-        since_dt = now - timedelta(days=30)
-        until_dt = now + timedelta(seconds=1)
+        # «последние 30 дней» — до конца текущего часа, иначе ключ кэша меняется каждую секунду
+        until = window_end(int(now.timestamp()), HOUR)
+        return until - 30 * DAY, until
     return int(since_dt.timestamp()), int(until_dt.timestamp())
 
 def _period_label(period: str) -> str:
@@ -180,31 +151,32 @@ async def do_export(
 
     since, until = _to_epoch(since), _to_epoch(until)
 
-    rows = await orders_for_period(
+    batches = iter_orders_for_period(
         user_id=user_id or message.from_user.id,
         since=since,
         until=until,
         drink=drink
     )
+    data, total = await spool_orders_csv(batches)
 
-    if not rows:
-        await message.answer("За указанный период записей нет.")
-        return
+    with data:
+        if not total:
+            await message.answer("За указанный период записей нет.")
+            return
 
-    if drink:
-        filename = filename.replace(".csv", f"_{drink}.csv")
+        if drink:
+            filename = filename.replace(".csv", f"_{drink}.csv")
 
-    data = orders_to_csv(rows)
-    doc = BufferedInputFile(data, filename=filename)
+        doc = SpooledInputFile(data, filename=filename)
 
-    drink_label = "Все" if not drink else DRINKS.get(drink, drink.title())
-    caption = (
-        f"Экспорт: {filename}\n"
-        f"Фильтр: {period_label} · {drink_label}\n"
-        f"Записей: {len(rows)}"
-    )
+        drink_label = "Все" if not drink else DRINKS.get(drink, drink.title())
+        caption = (
+            f"Экспорт: {filename}\n"
+            f"Фильтр: {period_label} · {drink_label}\n"
+            f"Записей: {total}"
+        )
 
-    await message.answer_document(document=doc, caption=caption)
+        await message.answer_document(document=doc, caption=caption)
 
 def _render_top(rows: list[tuple[str, int]], *, title: str, width: int = 12) -> str:
     if not rows:
@@ -218,13 +190,6 @@ def _render_top(rows: list[tuple[str, int]], *, title: str, width: int = 12) ->
     return "\n".join(lines)
 
 # ---------- 2. Хэндлеры ----------
-async def _user_order_no_by_id(user_id: int, order_id: int) -> int:
-    rows = await orders_for_period(user_id=user_id, since=0, until=2_147_483_647, drink=None)
-    rows = sorted(rows, key=lambda r: r[4])
-    for i, (oid, *_rest) in enumerate(rows, start=1):
-        if oid == order_id:
-            return i
-    return 0
 
 @dp.message(Command("broadcast"))
 async def start_broadcast(msg: Message, state: FSMContext):
@@ -242,25 +207,17 @@ async def do_broadcast(msg: Message, state: FSMContext):
         return
 
     text = msg.html_text
-    users = await distinct_users_with_orders()
+    total = await count_users_with_orders()
+    await state.clear()
 
-    if not users:
-        await state.clear()
+    if not total:
         await msg.answer("Некому отправлять: в базе нет пользователей с заказами.")
         return
 
-    await msg.answer("🚀 Стартую рассылку…")
-    sent = 0
-    for uid in users:
-        try:
-            await msg.bot.send_message(uid, text, disable_web_page_preview=True)
-            sent += 1
-        except Exception as e:
-            logger.warning("broadcast fail uid=%s: %s", uid, e)
-        await asyncio.sleep(0.03)
-
-    await state.clear()
-    await msg.answer(f"✅ Готово. Отправлено: {sent}/{len(users)}")
+    job_id = await create_broadcast(admin_chat=msg.chat.id, text=text, total=total)
+    progress = await msg.answer("🚀 Стартую рассылку…")
+    # рассылка идёт в фоне; прогресс, скорость и ETA — правками этого сообщения
+    start_broadcast_job(msg.bot, job_id, progress_message_id=progress.message_id)
 
 
 @dp.message(F.text.in_({BTN_CANCEL, "Отменить заказ 🚫"}))
@@ -314,13 +271,13 @@ async def handle_history(message: Message):
 async def on_history_filter(callback: CallbackQuery):
     await callback.answer()
     drink = callback.data.split(":")[1].lower()
-    await send_history_page(callback.message, drink, 0, user_id=callback.from_user.id)
+    await send_history_page(callback.message, drink, None, user_id=callback.from_user.id)
 
 @dp.callback_query(F.data.startswith("history_more:"))
 async def on_history_more(callback: CallbackQuery):
     await callback.answer()
-    _, drink, off = callback.data.split(":")
-    await send_history_page(callback.message, drink, int(off), user_id=callback.from_user.id)
+    cb = parse_cb(callback.data)
+    await send_history_page(callback.message, cb["drink"], cb["cursor"], user_id=callback.from_user.id)
 
 def _start_of_today_epoch() -> int:
     now = datetime.now().astimezone()
@@ -355,12 +312,11 @@ async def on_delete_first(callback: CallbackQuery):
     await callback.answer()
     order_id = int(callback.data.split(":", 1)[1])
 
-    row = await get_order_by_id(user_id=callback.from_user.id, order_id=order_id)
-    if not row:
+    numbers = await user_order_numbers(callback.from_user.id, [order_id])
+    mine_no = numbers.get(order_id)
+    if mine_no is None:
         await callback.answer("Не нашёл заказ 😕", show_alert=True)
         return
-    _, _, _, _, created = row
-    mine_no = await user_order_number(callback.from_user.id, int(created))
 
     await callback.message.edit_reply_markup(
         reply_markup=confirm_delete_kb(order_id, mine_no)
@@ -419,11 +375,10 @@ async def on_delete_cancel(callback: CallbackQuery):
     await callback.answer("Ок, не удаляем ✋")
     order_id = int(callback.data.split(":", 1)[1])
 
-    row = await get_order_by_id(user_id=callback.from_user.id, order_id=order_id)
-    if not row:
+    numbers = await user_order_numbers(callback.from_user.id, [order_id])
+    mine_no = numbers.get(order_id)
+    if mine_no is None:
         return
-    _, _, _, _, created = row
-    mine_no = await user_order_number(callback.from_user.id, int(created))
 
     await callback.message.edit_reply_markup(
         reply_markup=history_actions_kb(order_id, display_no=mine_no)
@@ -469,8 +424,8 @@ async def handle_top(message: Message):
         await message.answer("Формат: /top [week|month|30d|all]")
         return
     since, until = _bounds_for_top(period)
-    rows = await drink_counts_between(user_id=message.from_user.id, since=since, until=until)
-    rows = [(d, int(c)) for d, c in rows][:5]
+    rows = await drink_counts_between(user_id=message.from_user.id, since=since, until=until, limit=5)
+    rows = [(d, int(c)) for d, c in rows]
     text = _render_top(rows, title=f"🏆 Топ {_period_label(period)}:")
     await message.answer(text, reply_markup=top_periods_kb(active=period))
 
@@ -479,8 +434,8 @@ async def on_top_period(callback: CallbackQuery):
     await callback.answer()
     period = callback.data.split(":")[2]  # week|month|30d|all
     since, until = _bounds_for_top(period)
-    rows = await drink_counts_between(user_id=callback.from_user.id, since=since, until=until)
-    rows = [(d, int(c)) for d, c in rows][:5]
+    rows = await drink_counts_between(user_id=callback.from_user.id, since=since, until=until, limit=5)
+    rows = [(d, int(c)) for d, c in rows]
     text = _render_top(rows, title=f"🏆 Топ {_period_label(period)}:")
 
     try:
@@ -492,8 +447,8 @@ async def on_top_period(callback: CallbackQuery):
 async def handle_top_button(message: Message):
     period = "30d"
     since, until = _bounds_for_top(period)
-    rows = await drink_counts_between(user_id=message.from_user.id, since=since, until=until)
-    rows = [(d, int(c)) for d, c in rows][:5]
+    rows = await drink_counts_between(user_id=message.from_user.id, since=since, until=until, limit=5)
+    rows = [(d, int(c)) for d, c in rows]
     text = _render_top(rows, title=f"🏆 Топ {_period_label(period)}:")
     await message.answer(text, reply_markup=top_periods_kb(active=period))
 
@@ -504,8 +459,8 @@ async def handle_cancel(message: Message, state: FSMContext):
 
 @dp.message(OrderState.drink)
 async def handle_drink(message: Message, state: FSMContext):
-    drink = message.text.capitalize().lower()
-    if drink not in DRINKS:
+    drink = match_drink(message.text)
+    if drink is None:
         await message.answer(f"Такого напитка нет в меню 😅 Напиши один из: {', '.join(DRINKS.values())}")
         return
 
@@ -517,7 +472,7 @@ async def handle_drink(message: Message, state: FSMContext):
 
 @dp.message(OrderState.size)
 async def handle_size(message: Message, state: FSMContext):
-    if message.text == "↩ Назад":
+    if message.text == BTN_BACK:
         await state.update_data(size=None)
         await state.set_state(OrderState.drink)
         await message.answer(
@@ -526,8 +481,8 @@ async def handle_size(message: Message, state: FSMContext):
         )
         return
 
-    size = message.text.capitalize().lower()
-    if size not in SIZES:
+    size = match_size(message.text)
+    if size is None:
         await message.answer(
             "Размер должен быть: Small / Medium / Large. Попробуй ещё раз.",
             reply_markup=size_kb(),
@@ -542,7 +497,7 @@ async def handle_size(message: Message, state: FSMContext):
 
 @dp.message(OrderState.milk)
 async def handle_milk(message: Message, state: FSMContext):
-    if message.text == "↩ Назад":
+    if message.text == BTN_BACK:
         await state.update_data(milk=None)
         await state.set_state(OrderState.size)
         await message.answer(
@@ -556,29 +511,30 @@ async def handle_milk(message: Message, state: FSMContext):
         await message.answer("Заказ отменён ❌", reply_markup=main_kb())
         return
 
-    raw = message.text.strip().lower()
-    norm = {"yes": "yes", "y": "yes", "да": "yes", "no": "no", "n": "no", "нет": "no"}.get(raw)
+    norm = match_milk(message.text)
     if norm is None:
         await message.answer("Напиши Yes/No или Да/Нет 😊")
         return
     if norm == "yes":
         await message.answer("Добавляю молочко 🥛✨")
-    elif norm == "no":
-        await message.answer("Хорошо, без молока 👍")
     else:
-        await message.answer("Напиши Yes/No или Да/Нет 🙂")
-        return
+        await message.answer("Хорошо, без молока 👍")
 
     await state.update_data(milk=norm)
     data = await state.get_data()
 
+    now = int(time.time())
+    price = await quote_order(user_id=message.from_user.id, drink=data["drink"], size=data["size"],
+                              milk=data["milk"], ts=now)
     db_order_id = await create_order(
         user_id=message.from_user.id,
         chat_id=message.chat.id,
         drink=data["drink"],
         size=data["size"],
         milk=data["milk"],
+        created_at=now,
         locale=getattr(message.from_user, "language_code", None),
+        total=price,
     )
     logger.info("[DB] created order id =", db_order_id)
 
@@ -589,7 +545,8 @@ async def handle_milk(message: Message, state: FSMContext):
     f"☕ Напиток: <b>{DRINKS[data['drink']]}</b>\n"
     f"📏 Размер: <b>{SIZES[data['size']]}</b>\n"
     f"🥛 Молоко: <b>{'Добавить' if data['milk']=='yes' else 'Без молока'}</b>\n"
-    f"🕒 {fmt_ts(int(time.time()))}\n"
+    f"💰 Сумма: <b>{fmt_money(price)}</b>\n"
+    f"🕒 {fmt_ts(now)}\n"
     f"ID: <code>#{db_order_id}</code> · Ваш №<b>{mine_no}</b>\n\n"
     "Спасибо за заказ! 🙌"
 )
@@ -627,7 +584,8 @@ async def on_repeat_click(callback: CallbackQuery, state: FSMContext):
         return
 
     oid, drink, size, milk, created = row
-    mine_no = await _user_order_no_by_id(callback.from_user.id, oid)
+    numbers = await user_order_numbers(callback.from_user.id, [oid])
+    mine_no = numbers.get(oid, 0)
 
     preview_text = (
         f"<b>Повторить этот заказ?</b>\n\n"
@@ -660,19 +618,24 @@ async def handle_repeat_confirm(callback: CallbackQuery, state: FSMContext):
 
     _, drink, size, milk, _ = row
 
+    now = int(time.time())
+    price = await quote_order(user_id=callback.from_user.id, drink=drink, size=size, milk=milk, ts=now)
     new_id = await create_order(
         user_id=callback.from_user.id,
         chat_id=callback.message.chat.id,
         drink=drink,
         size=size,
-        milk=milk
+        milk=milk,
+        created_at=now,
+        total=price,
     )
 
     text = (
         "*Твой заказ готов!* 🎉\n\n"
         f"☕️ Напиток: *{DRINKS[drink]}*\n"
         f"📏 Размер: *{SIZES[size]}*\n"
-        f"🥛 Молоко: *{'Добавить' if milk == 'yes' else 'Без молока'}*\n\n"
+        f"🥛 Молоко: *{'Добавить' if milk == 'yes' else 'Без молока'}*\n"
+        f"💰 Сумма: *{fmt_money(price)}*\n\n"
         f"ID: *{new_id}* · {fmt_ts(_now_epoch_tz())}"
     )
     await callback.message.answer(text, parse_mode="Markdown")
@@ -771,14 +734,20 @@ async def handle_health(message: Message):
     uptime_sec = int(time.time() - (STARTED_AT or time.time()))
     uptime = _fmt_uptime(uptime_sec)
 
-    ok = await ping_db()
-    total = await count_total_orders()
-    mine = await count_orders(user_id=message.from_user.id)
-
-    deleted = await count_deleted()
-    last_any = await last_order_at()  # epoch или None
-    last_mine = await last_order_at(message.from_user.id)
+    # все запросы — O(1) (счётчики order_totals, MAX по индексу) и идут параллельно по пулу читателей
+    ok, total, mine, deleted, last_any, last_mine = await asyncio.gather(
+        ping_db(),
+        count_total_orders(),
+        count_orders(user_id=message.from_user.id),
+        count_deleted(),
+        last_order_at(),  # epoch или None
+        last_order_at(message.from_user.id),
+    )
     size_b = db_size_bytes()
+    cache = CACHE.stats()
+    backfills = "".join(
+        f"  · {p.name}: <b>{p.percent}%</b> (id {p.cursor}/{p.until_id})\n" for p in migrations.progress()
+    )
 
     text = (
         "<b>Health</b>\n\n"
@@ -791,9 +760,70 @@ async def handle_health(message: Message):
         f"Твои заказы: <b>{mine}</b>\n"
         f"Последний заказ: <code>{fmt_ts(last_any)}</code>\n"
         f"Твой последний: <code>{fmt_ts(last_mine)}</code>\n"
+        f"Кэш: <code>{cache['size']}</code> записей · hit <b>{cache['hits']}</b> · "
+        f"miss <b>{cache['misses']}</b> · вытеснено <b>{cache['evictions']}</b>\n"
+        f"Схема БД: <code>v{migrations.schema_version()}</code>"
+        + (" · бэкфиллы:\n" + backfills if backfills else "\n")
     )
     await message.answer(text, disable_web_page_preview=True)
 
+@dp.message(Command("analytics"))
+async def handle_analytics(message: Message, command: CommandObject):
+    if ADMIN_IDS and message.from_user.id not in ADMIN_IDS:
+        await message.answer("Команда недоступна.")
+        return
+
+    period = (command.args or "week").strip().lower()
+    if period not in analytics.PERIODS:
+        await message.answer(f"Формат: <code>/analytics [{'|'.join(analytics.PERIODS)}]</code>")
+        return
+    report = await analytics.build_report(period)
+    await message.answer(analytics.render_report(report))
+
+@dp.message(Command("profile"))
+async def handle_profile(message: Message, command: CommandObject):
+    if ADMIN_IDS and message.from_user.id not in ADMIN_IDS:
+        await message.answer("Команда недоступна.")
+        return
+
+    args = (command.args or "").split()
+    seconds = profiler.parse_duration(args[0]) if args else profiler.PROFILE_DEFAULT_SEC
+    mode = args[1].lower() if len(args) > 1 else "sample"
+    if seconds is None or mode not in profiler.MODES:
+        await message.answer(
+            f"Формат: <code>/profile 30s [sample|cpu]</code>, не дольше {profiler.PROFILE_MAX_SEC:g} с."
+        )
+        return
+    if profiler.is_running():
+        await message.answer("Профилирование уже идёт.")
+        return
+
+    await message.answer(f"⏱ Профилирую {seconds:g} с ({mode})…")
+    task = asyncio.create_task(_send_profile(message, seconds, mode))
+    _PROFILE_TASKS.add(task)
+    task.add_done_callback(_PROFILE_TASKS.discard)
+
+
+_PROFILE_TASKS: set[asyncio.Task] = set()
+
+
+async def _send_profile(message: Message, seconds: float, mode: str) -> None:
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    try:
+        if mode == "cpu":
+            stats = await profiler.cpu_profile(seconds)
+            data, summary = profiler.pstats_bytes(stats), profiler.cpu_summary(stats)
+            filename = f"profile-{stamp}.pstats"
+        else:
+            stacks = await profiler.sample(seconds, profiler.handler_codes(dp))
+            data, summary = profiler.collapsed_bytes(stacks), profiler.sample_summary(stacks)
+            filename = f"profile-{stamp}.collapsed.txt"
+        await message.answer_document(BufferedInputFile(data, filename=filename),
+                                      caption=f"<pre>{escape(summary[:900])}</pre>")
+    except Exception:
+        logger.exception("profile failed")
+        await message.answer("Не удалось снять профиль, подробности в логе.")
+
 @dp.message(Command("whoami"))
 async def whoami(message: Message):
     await message.answer(f"your user_id: {message.from_user.id}")
@@ -808,20 +838,34 @@ async def handle_version(message: Message):
 
 async def main():
     global bot, STARTED_AT
-    bot = Bot(TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
+    bot = Bot(TOKEN, session=MarkupCachingSession(), default=DefaultBotProperties(parse_mode="HTML"))
+    metrics.setup_bot(bot)
 
-    if os.getenv("DROP_PENDING_UPDATES", "false").lower() in {"1", "true", "yes"}:
-        await bot.delete_webhook(drop_pending_updates=True)
+    drop_pending = os.getenv("DROP_PENDING_UPDATES", "false").lower() in {"1", "true", "yes"}
+    if RUN_MODE != "webhook":
+        # polling и webhook взаимоисключающие: снимаем вебхук, если он остался от webhook-режима
+        await bot.delete_webhook(drop_pending_updates=drop_pending)
 
     await init_db()
     await open_db()
 
     STARTED_AT = time.time()
+    # долгие заполнения после миграций — в фоне, пачками; заказы принимаются сразу
+    migrations.start_backfills(DB_PATH)
+    await resume_broadcasts(bot)
+    metrics_runner = await metrics.start_server()
 
-    logger.info("Бот запущен...")
+    logger.info("Бот запущен (%s)...", RUN_MODE)
     try:
-        await dp.start_polling(bot)
+        if RUN_MODE == "webhook":
+            await run_webhook(dp, bot, drop_pending_updates=drop_pending)
+        else:
+            await dp.start_polling(bot)
     finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await migrations.stop_backfills()
+        await stop_broadcasts()
         await close_db()
 
 if __name__ == "__main__":
@@ -0,0 +1,285 @@
+"""Метрики в формате Prometheus: время хэндлеров, запросов к БД и вызовов Telegram API.
+
+Счётчики и гистограммы — простые dict по кортежу значений меток, без блокировок:
+всё обновляется из одного event loop. Экспорт — GET /metrics на METRICS_HOST:METRICS_PORT;
+по умолчанию выключен: счётчики заказов и пользователей наружу только по явному METRICS_PORT.
+"""
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable
+
+from aiohttp import web
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+log = logging.getLogger("metrics")
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT") or 0)  # 0 / пусто — сервер метрик не поднимается
+
+# секунды; от быстрых запросов к БД до медленных вызовов API
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REGISTRY: list["Counter | Histogram"] = []
+
+perf_counter = time.perf_counter
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(x: float) -> str:
+    return repr(float(x)) if isinstance(x, float) and not x.is_integer() else str(int(x))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labels
+        self._values: dict[tuple, float] = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labels, value: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def get(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def clear(self) -> None:
+        self._values.clear()
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for values, v in sorted(self._values.items()):
+            out.append(f"{self.name}{_labels(self.labelnames, values)} {_num(v)}")
+        return out
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами.
+
+    На серию — список: счётчики по корзинам (не накопительные, последняя — +Inf)
+    и сумма в конце; накопление делается только при выдаче.
+    """
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labels
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple, list] = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels) -> None:
+        s = self._series.get(labels)
+        if s is None:
+            s = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        s[bisect_left(self.buckets, value)] += 1
+        s[-1] += value
+
+    def count(self, *labels) -> int:
+        s = self._series.get(labels)
+        return sum(s[:-1]) if s else 0
+
+    def quantile(self, q: float, *labels) -> float | None:
+        """Оценка квантиля по корзинам (верхняя граница корзины)."""
+        s = self._series.get(labels)
+        if not s:
+            return None
+        total = sum(s[:-1])
+        seen = 0
+        for bound, n in zip(self.buckets + (float("inf"),), s):
+            seen += n
+            if seen >= q * total:
+                return bound
+        return float("inf")
+
+    def clear(self) -> None:
+        self._series.clear()
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        les = [f'le="{bound}"' for bound in self.buckets] + ['le="+Inf"']
+        for values, s in sorted(self._series.items()):
+            acc = 0
+            for le, n in zip(les, s):
+                acc += n
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, values, le)} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, values)} {_num(s[-1])}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, values)} {acc}")
+        return out
+
+
+def render() -> str:
+    lines: list[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------- метрики бота ----------
+
+UPDATES = Histogram("bot_update_seconds", "Полная обработка апдейта диспетчером", ("type",))
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Время хэндлера (включая его запросы к БД и API)",
+                            ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в хэндлерах", ("handler", "error"))
+DB_SECONDS = Histogram("bot_db_seconds", "Время функций repo.py (с попаданиями в кэш)", ("fn",))
+DB_ERRORS = Counter("bot_db_errors_total", "Исключения в функциях repo.py", ("fn", "error"))
+API_SECONDS = Histogram("bot_api_seconds", "Вызовы Telegram Bot API", ("method",))
+API_CALLS = Counter("bot_api_calls_total", "Вызовы Telegram Bot API по хэндлеру-инициатору",
+                    ("handler", "method"))
+API_ERRORS = Counter("bot_api_errors_total", "Ошибки Telegram Bot API", ("method", "error"))
+
+# хэндлер, в контексте которого идёт код; фоновые задачи наследуют его при создании
+current_handler: contextvars.ContextVar[str] = contextvars.ContextVar("current_handler", default="-")
+
+
+# ---------- инструментирование ----------
+
+def timed(fn):
+    """Время async-функции (или async-генератора) repo → bot_db_seconds{fn=<имя>}.
+
+    У генератора считается только время внутри него, без работы потребителя между элементами.
+    """
+    name = fn.__name__
+
+    if inspect.isasyncgenfunction(fn):
+        @functools.wraps(fn)
+        async def gen_wrapper(*args, **kwargs):
+            agen = fn(*args, **kwargs)
+            spent = 0.0
+            try:
+                while True:
+                    start = perf_counter()
+                    try:
+                        item = await agen.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    finally:
+                        spent += perf_counter() - start
+                    yield item
+            except Exception as e:
+                DB_ERRORS.inc(name, type(e).__name__)
+                raise
+            finally:
+                DB_SECONDS.observe(spent, name)
+                await agen.aclose()
+
+        gen_wrapper.__timed__ = True
+        return gen_wrapper
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as e:
+            DB_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            DB_SECONDS.observe(perf_counter() - start, name)
+
+    wrapper.__timed__ = True
+    return wrapper
+
+
+def _handler_name(data: dict[str, Any]) -> str:
+    handler = data.get("handler")
+    callback = getattr(handler, "callback", None)
+    return getattr(callback, "__name__", None) or "-"
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware на dp.update: апдейт целиком, включая фильтры и FSM."""
+
+    async def __call__(self, handler: Callable[..., Awaitable[Any]], event: Any, data: dict[str, Any]) -> Any:
+        start = perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            UPDATES.observe(perf_counter() - start, getattr(event, "event_type", "unknown"))
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: вызывается только для сработавшего хэндлера, имя — из data['handler']."""
+
+    async def __call__(self, handler: Callable[..., Awaitable[Any]], event: Any, data: dict[str, Any]) -> Any:
+        name = _handler_name(data)
+        token = current_handler.set(name)
+        start = perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            HANDLER_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(perf_counter() - start, name)
+            current_handler.reset(token)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: каждый вызов API, с хэндлером, из которого он сделан."""
+
+    async def __call__(self, make_request, bot: Bot, method):
+        api = type(method).__name__
+        API_CALLS.inc(current_handler.get(), api)
+        start = perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            API_ERRORS.inc(api, type(e).__name__)
+            raise
+        finally:
+            API_SECONDS.observe(perf_counter() - start, api)
+
+
+def setup_dispatcher(dp: Dispatcher) -> None:
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    handler_mw = HandlerMetricsMiddleware()
+    for name, observer in dp.observers.items():
+        if name not in ("update", "error"):
+            observer.middleware(handler_mw)
+
+
+def setup_bot(bot: Bot) -> None:
+    bot.session.middleware(ApiMetricsMiddleware())
+
+
+# ---------- HTTP ----------
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def start_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> web.AppRunner | None:
+    """Поднимает GET /metrics; при METRICS_PORT=0 или занятом порте — None, бот работает дальше."""
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        log.warning("метрики недоступны: %s:%s — %s", host, port, e)
+        await runner.cleanup()
+        return None
+    log.info("metrics on http://%s:%s/metrics", host, port)
+    return runner
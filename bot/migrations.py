@@ -0,0 +1,446 @@
+import asyncio
+import logging
+import os
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+import aiosqlite
+
+from .cache import CACHE
+
+log = logging.getLogger("migrations")
+
+# строк orders за одну транзакцию бэкфилла: писатель ждёт не дольше одной пачки
+MIGRATION_CHUNK = max(1, int(os.getenv("MIGRATION_CHUNK", "1000")))
+# пауза между пачками (не короче самой пачки) — блокировка записи достаётся заказам
+MIGRATION_PAUSE_MS = float(os.getenv("MIGRATION_PAUSE_MS", "20"))
+
+BOOTSTRAP_SQL = """
+-- бэкфилл обрабатывает orders.id в (0, until_id] по возрастанию; всё <= cursor готово.
+-- Строки с id > until_id (новые) с самого начала ведут триггеры.
+CREATE TABLE IF NOT EXISTS schema_backfills (
+    name       TEXT PRIMARY KEY,
+    cursor     INTEGER NOT NULL DEFAULT 0,
+    until_id   INTEGER NOT NULL,
+    updated_at INTEGER
+) WITHOUT ROWID;
+"""
+
+# строка ещё не пройдена бэкфиллом name — триггер её не трогает, бэкфилл увидит итоговое состояние
+_PENDING_ROW = (
+    "EXISTS (SELECT 1 FROM schema_backfills WHERE name = '{name}' "
+    "AND {row}.id > cursor AND {row}.id <= until_id)"
+)
+
+
+def _daily_triggers() -> str:
+    pending_new = _PENDING_ROW.format(name="order_daily_counts", row="NEW")
+    pending_old = _PENDING_ROW.format(name="order_daily_counts", row="OLD")
+    return f"""
+    DROP TRIGGER IF EXISTS trg_orders_daily_insert;
+    DROP TRIGGER IF EXISTS trg_orders_daily_soft_delete;
+    DROP TRIGGER IF EXISTS trg_orders_daily_undo;
+    DROP TRIGGER IF EXISTS trg_orders_daily_delete;
+
+    CREATE TRIGGER trg_orders_daily_insert AFTER INSERT ON orders
+    WHEN NEW.deleted_at IS NULL AND NOT {pending_new}
+    BEGIN
+        INSERT INTO order_daily_counts(user_id, day, drink, cnt)
+        VALUES (NEW.user_id, NEW.created_at / 86400, NEW.drink, 1)
+        ON CONFLICT(user_id, day, drink) DO UPDATE SET cnt = cnt + 1;
+    END;
+
+    CREATE TRIGGER trg_orders_daily_soft_delete AFTER UPDATE OF deleted_at ON orders
+    WHEN OLD.deleted_at IS NULL AND NEW.deleted_at IS NOT NULL AND NOT {pending_old}
+    BEGIN
+        UPDATE order_daily_counts SET cnt = cnt - 1
+        WHERE user_id = OLD.user_id AND day = OLD.created_at / 86400 AND drink = OLD.drink;
+    END;
+
+    CREATE TRIGGER trg_orders_daily_undo AFTER UPDATE OF deleted_at ON orders
+    WHEN OLD.deleted_at IS NOT NULL AND NEW.deleted_at IS NULL AND NOT {pending_new}
+    BEGIN
+        INSERT INTO order_daily_counts(user_id, day, drink, cnt)
+        VALUES (NEW.user_id, NEW.created_at / 86400, NEW.drink, 1)
+        ON CONFLICT(user_id, day, drink) DO UPDATE SET cnt = cnt + 1;
+    END;
+
+    CREATE TRIGGER trg_orders_daily_delete AFTER DELETE ON orders
+    WHEN OLD.deleted_at IS NULL AND NOT {pending_old}
+    BEGIN
+        UPDATE order_daily_counts SET cnt = cnt - 1
+        WHERE user_id = OLD.user_id AND day = OLD.created_at / 86400 AND drink = OLD.drink;
+    END;
+    """
+
+
+def _totals_triggers() -> str:
+    pending_new = _PENDING_ROW.format(name="order_totals", row="NEW")
+    pending_old = _PENDING_ROW.format(name="order_totals", row="OLD")
+    return f"""
+    CREATE TRIGGER IF NOT EXISTS trg_orders_totals_insert AFTER INSERT ON orders
+    WHEN NOT {pending_new}
+    BEGIN
+        UPDATE order_totals SET live = live + (NEW.deleted_at IS NULL),
+                                deleted = deleted + (NEW.deleted_at IS NOT NULL)
+        WHERE id = 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_orders_totals_update AFTER UPDATE OF deleted_at ON orders
+    WHEN (OLD.deleted_at IS NULL) != (NEW.deleted_at IS NULL) AND NOT {pending_old}
+    BEGIN
+        UPDATE order_totals SET live = live + (NEW.deleted_at IS NULL) - (OLD.deleted_at IS NULL),
+                                deleted = deleted + (NEW.deleted_at IS NOT NULL) - (OLD.deleted_at IS NOT NULL)
+        WHERE id = 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_orders_totals_delete AFTER DELETE ON orders
+    WHEN NOT {pending_old}
+    BEGIN
+        UPDATE order_totals SET live = live - (OLD.deleted_at IS NULL),
+                                deleted = deleted - (OLD.deleted_at IS NOT NULL)
+        WHERE id = 1;
+    END;
+    """
+
+
+def _rollup_upsert(row: str, sign: str) -> str:
+    """Заказ row (NEW/OLD) входит в часовой и дневные срезы со знаком sign."""
+    return f"""
+        INSERT INTO order_hourly(hour, orders, revenue, priced)
+        VALUES ({row}.created_at / 3600, {sign}1, {sign}COALESCE({row}.total, 0), {sign}({row}.total IS NOT NULL))
+        ON CONFLICT(hour) DO UPDATE SET orders = orders + excluded.orders,
+            revenue = revenue + excluded.revenue, priced = priced + excluded.priced;
+        INSERT INTO order_mix_daily(day, dim, value, orders, revenue)
+        VALUES ({row}.created_at / 86400, 'drink', {row}.drink, {sign}1, {sign}COALESCE({row}.total, 0)),
+               ({row}.created_at / 86400, 'size', {row}.size, {sign}1, {sign}COALESCE({row}.total, 0)),
+               ({row}.created_at / 86400, 'milk', {row}.milk, {sign}1, {sign}COALESCE({row}.total, 0))
+        ON CONFLICT(day, dim, value) DO UPDATE SET orders = orders + excluded.orders,
+            revenue = revenue + excluded.revenue;
+    """
+
+
+def _rollup_triggers() -> str:
+    pending_new = _PENDING_ROW.format(name="order_rollups", row="NEW")
+    pending_old = _PENDING_ROW.format(name="order_rollups", row="OLD")
+    return f"""
+    CREATE TRIGGER IF NOT EXISTS trg_orders_rollup_insert AFTER INSERT ON orders
+    WHEN NEW.deleted_at IS NULL AND NOT {pending_new}
+    BEGIN {_rollup_upsert("NEW", "+")} END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_orders_rollup_soft_delete AFTER UPDATE OF deleted_at ON orders
+    WHEN OLD.deleted_at IS NULL AND NEW.deleted_at IS NOT NULL AND NOT {pending_old}
+    BEGIN {_rollup_upsert("OLD", "-")} END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_orders_rollup_undo AFTER UPDATE OF deleted_at ON orders
+    WHEN OLD.deleted_at IS NOT NULL AND NEW.deleted_at IS NULL AND NOT {pending_new}
+    BEGIN {_rollup_upsert("NEW", "+")} END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_orders_rollup_delete AFTER DELETE ON orders
+    WHEN OLD.deleted_at IS NULL AND NOT {pending_old}
+    BEGIN {_rollup_upsert("OLD", "-")} END;
+
+    -- первый заказ клиента: MIN не зависит от порядка, поэтому без оглядки на бэкфилл
+    CREATE TRIGGER IF NOT EXISTS trg_orders_customer_insert AFTER INSERT ON orders
+    BEGIN
+        INSERT INTO order_customers(user_id, first_at) VALUES (NEW.user_id, NEW.created_at)
+        ON CONFLICT(user_id) DO UPDATE SET first_at = MIN(first_at, excluded.first_at);
+    END;
+    """
+
+
+# Шаги схемы: PRAGMA user_version = число применённых. Шаг выполняется один раз,
+# в одной транзакции вместе с новым user_version; новые — только в конец.
+# В шагах — только быстрые DDL; всё, что проходит по orders, — через BACKFILLS.
+MIGRATIONS: list[str] = [
+    # 1: индексы под реальные запросы. Все чтения пользователя идут по живым
+    # заказам (deleted_at IS NULL) — частичные индексы меньше и не содержат удалённых.
+    # drink и deleted_at по отдельности почти не селективны — убираем.
+    """
+    DROP INDEX IF EXISTS idx_orders_user_created;
+    DROP INDEX IF EXISTS idx_orders_drink;
+    DROP INDEX IF EXISTS idx_orders_deleted;
+    CREATE INDEX IF NOT EXISTS idx_orders_live_user_created
+        ON orders(user_id, created_at, id) WHERE deleted_at IS NULL;
+    CREATE INDEX IF NOT EXISTS idx_orders_live_user_drink
+        ON orders(user_id, drink, created_at) WHERE deleted_at IS NULL;
+    -- MAX(created_at) по всем и COUNT(*) живых — без прохода по таблице
+    CREATE INDEX IF NOT EXISTS idx_orders_live_created
+        ON orders(created_at) WHERE deleted_at IS NULL;
+    -- удалённых мало: индекс крошечный, COUNT для /health по нему
+    CREATE INDEX IF NOT EXISTS idx_orders_deleted_at
+        ON orders(deleted_at) WHERE deleted_at IS NOT NULL;
+    """,
+    # 2: агрегат для /stats и /top: живые заказы по (пользователь, UTC-день, напиток).
+    # Раньше заполнялся одним INSERT ... SELECT на старте; теперь — фоновым бэкфиллом.
+    """
+    CREATE TABLE IF NOT EXISTS order_daily_counts (
+        user_id INTEGER NOT NULL,
+        day     INTEGER NOT NULL,  -- created_at / 86400
+        drink   TEXT    NOT NULL,
+        cnt     INTEGER NOT NULL,
+        PRIMARY KEY (user_id, day, drink)
+    ) WITHOUT ROWID;
+    INSERT OR IGNORE INTO schema_backfills(name, cursor, until_id)
+    SELECT 'order_daily_counts', 0, COALESCE(MAX(id), 0) FROM orders;
+    -- база, где агрегат уже заполнен прежним init_db: досчитывать нечего
+    UPDATE schema_backfills SET cursor = until_id
+    WHERE name = 'order_daily_counts' AND EXISTS (SELECT 1 FROM order_daily_counts);
+    """ + _daily_triggers(),
+    # 3: счётчики живых и удалённых заказов для /health — одна строка вместо COUNT(*)
+    """
+    CREATE TABLE IF NOT EXISTS order_totals (
+        id      INTEGER PRIMARY KEY CHECK (id = 1),
+        live    INTEGER NOT NULL DEFAULT 0,
+        deleted INTEGER NOT NULL DEFAULT 0
+    );
+    INSERT OR IGNORE INTO order_totals(id) VALUES (1);
+    INSERT OR IGNORE INTO schema_backfills(name, cursor, until_id)
+    SELECT 'order_totals', 0, COALESCE(MAX(id), 0) FROM orders;
+    """ + _totals_triggers(),
+    # 4: сумма заказа в копейках, считается при вставке (coffee_utils.pricing).
+    # ADD COLUMN не переписывает таблицу; у старых заказов NULL — цен тогда не было,
+    # экспорт досчитывает их по прайсу без персональных скидок.
+    """
+    ALTER TABLE orders ADD COLUMN total INTEGER;
+    """,
+    # 5: срезы для /analytics (services/analytics.py). Живые заказы и выручка по UTC-часам —
+    # ряды и тепловая карта; разбивка по напиткам/размерам/молоку — по UTC-суткам,
+    # края диапазона досчитываются по orders, как в drink_counts_between.
+    # order_customers — время первого заказа клиента (включая удалённые) для доли повторных.
+    """
+    CREATE TABLE IF NOT EXISTS order_hourly (
+        hour    INTEGER PRIMARY KEY,  -- created_at / 3600
+        orders  INTEGER NOT NULL,
+        revenue INTEGER NOT NULL,     -- копейки; заказы без суммы дают 0
+        priced  INTEGER NOT NULL      -- из orders — с суммой
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS order_mix_daily (
+        day     INTEGER NOT NULL,     -- created_at / 86400
+        dim     TEXT    NOT NULL,     -- drink | size | milk
+        value   TEXT    NOT NULL,
+        orders  INTEGER NOT NULL,
+        revenue INTEGER NOT NULL,
+        PRIMARY KEY (day, dim, value)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS order_customers (
+        user_id  INTEGER PRIMARY KEY,
+        first_at INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_order_customers_first ON order_customers(first_at);
+    INSERT OR IGNORE INTO schema_backfills(name, cursor, until_id)
+    SELECT 'order_rollups', 0, COALESCE(MAX(id), 0) FROM orders;
+    """ + _rollup_triggers(),
+    # 6: аренда рассылки (services/broadcast.py): какой экземпляр бота её шлёт и до какого
+    # времени. Без неё каждый экземпляр при старте подхватывал все running-рассылки.
+    """
+    ALTER TABLE broadcasts ADD COLUMN owner TEXT;
+    ALTER TABLE broadcasts ADD COLUMN lease_until INTEGER;
+    """,
+]
+
+
+class Backfill(NamedTuple):
+    """Пачка бэкфилла: chunk_sql (один запрос или несколько по очереди) выполняется
+    с параметрами (lo, hi] по orders.id."""
+    name: str
+    chunk_sql: str | tuple[str, ...]
+
+
+BACKFILLS: dict[str, Backfill] = {
+    "order_daily_counts": Backfill(
+        "order_daily_counts",
+        """
+        INSERT INTO order_daily_counts(user_id, day, drink, cnt)
+        SELECT user_id, created_at / 86400, drink, COUNT(*)
+        FROM orders
+        WHERE id > ? AND id <= ? AND deleted_at IS NULL
+        GROUP BY user_id, created_at / 86400, drink
+        ON CONFLICT(user_id, day, drink) DO UPDATE SET cnt = cnt + excluded.cnt
+        """,
+    ),
+    "order_totals": Backfill(
+        "order_totals",
+        """
+        UPDATE order_totals SET
+            live = live + (SELECT COUNT(*) FROM orders WHERE id > ?1 AND id <= ?2 AND deleted_at IS NULL),
+            deleted = deleted + (SELECT COUNT(*) FROM orders WHERE id > ?1 AND id <= ?2 AND deleted_at IS NOT NULL)
+        WHERE id = 1
+        """,
+    ),
+    "order_rollups": Backfill(
+        "order_rollups",
+        (
+            """
+            INSERT INTO order_hourly(hour, orders, revenue, priced)
+            SELECT created_at / 3600, COUNT(*), SUM(COALESCE(total, 0)), COUNT(total) FROM orders
+            WHERE id > ?1 AND id <= ?2 AND deleted_at IS NULL
+            GROUP BY created_at / 3600
+            ON CONFLICT(hour) DO UPDATE SET orders = orders + excluded.orders,
+                revenue = revenue + excluded.revenue, priced = priced + excluded.priced
+            """,
+            """
+            INSERT INTO order_mix_daily(day, dim, value, orders, revenue)
+            SELECT day, dim, value, COUNT(*), SUM(t) FROM (
+                SELECT created_at / 86400 AS day, 'drink' AS dim, drink AS value, COALESCE(total, 0) AS t
+                FROM orders WHERE id > ?1 AND id <= ?2 AND deleted_at IS NULL
+                UNION ALL
+                SELECT created_at / 86400, 'size', size, COALESCE(total, 0)
+                FROM orders WHERE id > ?1 AND id <= ?2 AND deleted_at IS NULL
+                UNION ALL
+                SELECT created_at / 86400, 'milk', milk, COALESCE(total, 0)
+                FROM orders WHERE id > ?1 AND id <= ?2 AND deleted_at IS NULL
+            ) WHERE true
+            GROUP BY day, dim, value
+            ON CONFLICT(day, dim, value) DO UPDATE SET orders = orders + excluded.orders,
+                revenue = revenue + excluded.revenue
+            """,
+            """
+            INSERT INTO order_customers(user_id, first_at)
+            SELECT user_id, MIN(created_at) FROM orders WHERE id > ?1 AND id <= ?2
+            GROUP BY user_id
+            ON CONFLICT(user_id) DO UPDATE SET first_at = MIN(first_at, excluded.first_at)
+            """,
+        ),
+    ),
+}
+
+
+class BackfillProgress(NamedTuple):
+    name: str
+    cursor: int
+    until_id: int
+
+    @property
+    def done(self) -> bool:
+        return self.cursor >= self.until_id
+
+    @property
+    def percent(self) -> int:
+        return 100 if self.done else int(self.cursor * 100 / self.until_id)
+
+
+# прогресс незавершённых бэкфиллов; читатели агрегатов смотрят сюда через is_done()
+_PROGRESS: dict[str, BackfillProgress] = {}
+_VERSION = 0
+_TASK: asyncio.Task | None = None
+_STOP: asyncio.Event | None = None
+
+
+async def _load_progress(conn: aiosqlite.Connection) -> None:
+    _PROGRESS.clear()
+    async with conn.execute("SELECT name, cursor, until_id FROM schema_backfills") as cur:
+        async for row in cur:
+            p = BackfillProgress(*row)
+            if not p.done:
+                _PROGRESS[p.name] = p
+
+
+async def migrate(conn: aiosqlite.Connection) -> int:
+    """Применяет шаги MIGRATIONS после текущего user_version. Возвращает новую версию."""
+    global _VERSION
+    await conn.executescript(BOOTSTRAP_SQL)
+    async with conn.execute("PRAGMA user_version") as cur:
+        (version,) = await cur.fetchone()
+    for n, script in enumerate(MIGRATIONS[version:], start=version + 1):
+        await conn.executescript(f"BEGIN;\n{script}\nPRAGMA user_version = {n};\nCOMMIT;")
+        log.info("DB schema migrated to v%s", n)
+        version = n
+    await _load_progress(conn)
+    _VERSION = version
+    return version
+
+
+def schema_version() -> int:
+    return _VERSION
+
+
+def is_done(name: str) -> bool:
+    return name not in _PROGRESS
+
+
+def progress() -> list[BackfillProgress]:
+    """Незавершённые бэкфиллы — для /health."""
+    return list(_PROGRESS.values())
+
+
+async def _run_one(conn: aiosqlite.Connection, backfill: Backfill, stop: asyncio.Event) -> bool:
+    p = _PROGRESS[backfill.name]
+    statements = (backfill.chunk_sql,) if isinstance(backfill.chunk_sql, str) else backfill.chunk_sql
+    while not p.done:
+        if stop.is_set():
+            return False
+        started = time.monotonic()
+        # пачка и сдвиг курсора — одна транзакция: после падения продолжаем ровно с cursor
+        await conn.execute("BEGIN IMMEDIATE")
+        try:
+            # курсор — из таблицы, уже под замком записи: бэкфилл гонит каждый экземпляр бота,
+            # и пачку, которую прошёл другой, второй раз применять нельзя (агрегаты задвоятся)
+            rows = await conn.execute_fetchall(
+                "SELECT cursor FROM schema_backfills WHERE name = ?", (backfill.name,)
+            )
+            cursor = rows[0][0] if rows else p.until_id
+            hi = min(cursor + MIGRATION_CHUNK, p.until_id)
+            if hi > cursor:
+                for sql in statements:
+                    await conn.execute(sql, (cursor, hi))
+                await conn.execute(
+                    "UPDATE schema_backfills SET cursor = ?, updated_at = ? WHERE name = ?",
+                    (hi, int(time.time()), backfill.name),
+                )
+            await conn.execute("COMMIT")
+        except BaseException:
+            await conn.execute("ROLLBACK")
+            raise
+        p = _PROGRESS[backfill.name] = p._replace(cursor=max(cursor, hi))
+        await asyncio.sleep(max(MIGRATION_PAUSE_MS / 1000, time.monotonic() - started))
+    _PROGRESS.pop(backfill.name, None)
+    # кэш мог запомнить ответы, посчитанные в обход недостроенного агрегата
+    CACHE.clear()
+    log.info("backfill %s done", backfill.name)
+    return True
+
+
+async def run_backfills(path: Path, stop: asyncio.Event | None = None) -> None:
+    """Проходит незавершённые бэкфиллы пачками на отдельном соединении."""
+    if not _PROGRESS:
+        return
+    stop = stop or asyncio.Event()
+    # autocommit: транзакции пачек открываем сами (BEGIN IMMEDIATE)
+    conn = await aiosqlite.connect(path, isolation_level=None)
+    try:
+        for name in list(_PROGRESS):
+            backfill = BACKFILLS.get(name)
+            if backfill is None:
+                log.warning("unknown backfill %s, skipped", name)
+                continue
+            log.info("backfill %s from id>%s to %s", name, _PROGRESS[name].cursor, _PROGRESS[name].until_id)
+            if not await _run_one(conn, backfill, stop):
+                return
+    finally:
+        await conn.close()
+
+
+def start_backfills(path: Path) -> None:
+    global _TASK, _STOP
+    if not _PROGRESS or (_TASK is not None and not _TASK.done()):
+        return
+    _STOP = asyncio.Event()
+    _TASK = asyncio.create_task(run_backfills(path, _STOP))
+    _TASK.add_done_callback(_log_failure)
+
+
+def _log_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        log.error("backfill crashed", exc_info=task.exception())
+
+
+async def stop_backfills() -> None:
+    """Останавливает бэкфиллы между пачками; продолжатся со следующего старта."""
+    global _TASK
+    if _TASK is None:
+        return
+    _STOP.set()
+    await asyncio.gather(_TASK, return_exceptions=True)
+    _TASK = None
@@ -0,0 +1,172 @@
+"""Профилирование живого процесса по команде админа (/profile).
+
+Пока профиль не снимается, ничего не установлено: ни потока, ни sys.setprofile —
+модуль можно держать включённым в проде.
+
+Режимы:
+- sample — поток раз в PROFILE_INTERVAL_MS читает стек потока event loop'а
+  (sys._current_frames) и копит collapsed stacks «кадр;кадр;… число»
+  (flamegraph.pl, speedscope). Корень стека — хэндлер aiogram, в котором шёл код;
+  сэмплы вне хэндлеров — под «<other>». Видно то, что занимает поток loop'а;
+  ожидание БД/сети — это простой loop'а (select под <other>).
+- cpu — cProfile на потоке event loop'а, результат в формате pstats.
+"""
+import asyncio
+import cProfile
+import marshal
+import os
+import pstats
+import re
+import sys
+import threading
+from collections import Counter
+from types import CodeType, FrameType
+
+from aiogram import Dispatcher
+
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DEFAULT_SEC = 30.0
+PROFILE_MAX_SEC = 300.0
+MAX_DEPTH = 128
+OTHER = "<other>"
+
+MODES = ("sample", "cpu")
+
+_DURATION_RE = re.compile(r"^(\d+(?:\.\d+)?)(s|m)?$")
+_ACTIVE = False
+
+
+def parse_duration(text: str) -> float | None:
+    """«30», «30s», «2m» → секунды; иначе None."""
+    m = _DURATION_RE.match(text.strip().lower())
+    if not m:
+        return None
+    seconds = float(m.group(1)) * (60 if m.group(2) == "m" else 1)
+    return seconds if 0 < seconds <= PROFILE_MAX_SEC else None
+
+
+def is_running() -> bool:
+    return _ACTIVE
+
+
+def handler_codes(dp: Dispatcher) -> set[CodeType]:
+    """Код всех хэндлеров диспетчера (и вложенных роутеров) — корни стеков."""
+    codes = set()
+    for router in dp.chain_tail:
+        for observer in router.observers.values():
+            for handler in observer.handlers:
+                code = getattr(handler.callback, "__code__", None)
+                if code is not None:
+                    codes.add(code)
+    return codes
+
+
+_LABELS: dict[CodeType, str] = {}
+
+
+def _label(code: CodeType) -> str:
+    label = _LABELS.get(code)
+    if label is None:
+        path = "/".join(code.co_filename.replace("\\", "/").rsplit("/", 2)[-2:])
+        label = _LABELS[code] = f"{code.co_qualname} ({path}:{code.co_firstlineno})"
+    return label
+
+
+def collapse_frame(frame: FrameType | None, roots: set[CodeType]) -> str:
+    """Стек от корня к листу через «;»; обрезается по хэндлеру, если он есть в стеке."""
+    labels = []
+    root = OTHER
+    while frame is not None and len(labels) < MAX_DEPTH:
+        code = frame.f_code
+        labels.append(_label(code))
+        if code in roots:
+            root = None
+            break
+        frame = frame.f_back
+    if root is not None:
+        labels.append(root)
+    labels.reverse()
+    return ";".join(labels)
+
+
+class StackSampler(threading.Thread):
+    def __init__(self, thread_id: int, roots: set[CodeType], interval: float):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.roots = roots
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self._halt = threading.Event()
+
+    def run(self) -> None:
+        while not self._halt.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse_frame(frame, self.roots)] += 1
+            del frame
+
+    def stop(self) -> Counter[str]:
+        self._halt.set()
+        self.join()
+        return self.stacks
+
+
+async def sample(seconds: float, roots: set[CodeType], *, interval_ms: float = PROFILE_INTERVAL_MS) -> Counter[str]:
+    """Сэмплирует поток текущего event loop'а seconds секунд."""
+    global _ACTIVE
+    if _ACTIVE:
+        raise RuntimeError("profile already running")
+    _ACTIVE = True
+    sampler = StackSampler(threading.get_ident(), roots, interval_ms / 1000)
+    sampler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        stacks = sampler.stop()
+        _ACTIVE = False
+    return stacks
+
+
+async def cpu_profile(seconds: float) -> pstats.Stats:
+    """cProfile на потоке event loop'а: попадают все корутины, что исполнялись в окне."""
+    global _ACTIVE
+    if _ACTIVE:
+        raise RuntimeError("profile already running")
+    _ACTIVE = True
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        prof.disable()
+        _ACTIVE = False
+    return pstats.Stats(prof)
+
+
+def collapsed_bytes(stacks: Counter[str]) -> bytes:
+    return "".join(f"{stack} {n}\n" for stack, n in stacks.most_common()).encode()
+
+
+def pstats_bytes(stats: pstats.Stats) -> bytes:
+    """То же, что Stats.dump_stats пишет в файл: открывается pstats/snakeviz."""
+    return marshal.dumps(stats.stats)
+
+
+def sample_summary(stacks: Counter[str], top: int = 5) -> str:
+    total = sum(stacks.values())
+    if not total:
+        return "сэмплов нет"
+    by_root = Counter()
+    for stack, n in stacks.items():
+        by_root[stack.split(";", 1)[0].split(" (", 1)[0]] += n
+    lines = [f"сэмплов: {total}"]
+    lines += [f"{root} — {n * 100 // total}%" for root, n in by_root.most_common(top)]
+    return "\n".join(lines)
+
+
+def cpu_summary(stats: pstats.Stats, top: int = 5) -> str:
+    rows = sorted(stats.stats.items(), key=lambda kv: kv[1][2], reverse=True)[:top]
+    lines = [f"вызовов: {stats.total_calls}, {stats.total_tt:.2f} с CPU"]
+    for (path, line, name), (_, _, tt, _, _) in rows:
+        lines.append(f"{name} ({os.path.basename(path)}:{line}) — {tt * 1000:.0f} мс")
+    return "\n".join(lines)
@@ -1,39 +1,59 @@
 from __future__ import annotations
-from typing import Any, Optional
+from typing import Any, NamedTuple, Optional
 import aiosqlite, time
 import logging
-from contextlib import contextmanager
 import os
-from .db import get_db, DB_PATH
-
+from .db import get_db, get_reader, get_committer, write_lock, DB_PATH
+from .cache import CACHE, cached
+from .metrics import timed
+from .migrations import is_done as backfill_done
+
+
+# ---------- rows ----------
+# Форма результата задаётся на каждый вызов (_make поверх кортежей sqlite3),
+# row_factory общих соединений не трогаем — иначе конкурентные хэндлеры
+# получают строки «не той формы».
+
+class OrderRow(NamedTuple):
+    id: int
+    drink: str
+    size: str
+    milk: str
+    created_at: int
+
+class ExportRow(NamedTuple):
+    id: int
+    drink: str
+    size: str
+    milk: str
+    created_at: int
+    total: int | None  # копейки; NULL у заказов до появления цен
+
+class DrinkCount(NamedTuple):
+    drink: str
+    cnt: int
 
 # ---------- helpers ----------
 
-def _row_factory(cursor, row):
-    return {col[0]: row[idx] for idx, col in enumerate(cursor.description)}
+async def _fetch_all(db: aiosqlite.Connection, sql: str, params=(), row=None) -> list:
+    rows = await db.execute_fetchall(sql, params)
+    return list(map(row._make, rows)) if row is not None else list(rows)
 
-# ---------- contextmanagers ----------
+async def _fetch_value(db: aiosqlite.Connection, sql: str, params=()):
+    rows = await db.execute_fetchall(sql, params)
+    return rows[0][0] if rows else None
 
-@contextmanager
-def use_dicts(db):
-    prev = db.row_factory
-    db.row_factory = _row_factory
-    try:
-        yield
-    finally:
-        db.row_factory = prev
-
-@contextmanager
-def use_tuples(db):
-    prev = db.row_factory
-    db.row_factory = None
-    try:
-        yield
-    finally:
-        db.row_factory = prev
+async def _write(sql: str, params=()) -> aiosqlite.Cursor:
+    """Изменение с commit на писателе — под общим замком транзакций (см. db.write_lock)."""
+    async with write_lock():
+        db = get_db()
+        cur = await db.execute(sql, params)
+        await db.commit()
+        return cur
 
 # ---------- commands ----------
 
+@timed
 async def create_order(
     *,
     user_id: int,
@@ -43,26 +63,31 @@ async def create_order(
     milk: str,
     created_at: Optional[int] = None,
     locale: Optional[str] = None,
+    total: Optional[int] = None,
 ) -> int:
-    db: aiosqlite.Connection = get_db()
     ts = created_at or int(time.time())
-    cur = await db.execute(
+    sql = """
+        INSERT INTO orders(user_id, chat_id, drink, size, milk, created_at, locale, total)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         """
-        INSERT INTO orders(user_id, chat_id, drink, size, milk, created_at, locale)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        """,
-        (user_id, chat_id, drink, size, milk, ts, locale),
-    )
-    await db.commit()
+    params = (user_id, chat_id, drink, size, milk, ts, locale, total)
+
+    committer = get_committer()
+    if committer is not None:
+        order_id = await committer.insert(sql, params)
+    else:
+        order_id = (await _write(sql, params)).lastrowid
+    CACHE.invalidate_user(user_id)
     logging.getLogger("repo").info("[DB] insert",
         dict(user_id=user_id, chat_id=chat_id, drink=drink, size=size, milk=milk))
-    return cur.lastrowid
+    return order_id
 
 
 # ---------- queries for History / Repeat ----------
 
+@timed
 async def get_orders_page(*, user_id: int, drink: str | None, offset: int, limit: int):
-    db = get_db()
+    db = get_reader()
     sql = (
         "SELECT id, drink, size, milk, created_at "
         "FROM orders "
@@ -79,77 +104,96 @@ async def get_orders_page(*, user_id: int, drink: str | None, offset: int, limit
     logging.getLogger("repo").debug("get_orders_page uid=%s drink=%s offset=%s limit=%s",
                                     user_id, drink, offset, limit)
 
-    with use_dicts(db):
-        cur = await db.execute(sql, params)
-        rows = await cur.fetchall()
-        return rows
+    return await _fetch_all(db, sql, params, OrderRow)
+
+@timed
+@cached
+async def orders_page_after(
+    *,
+    user_id: int,
+    drink: str | None,
+    after: tuple[int, int] | None,
+    limit: int,
+):
+    """Keyset-страница истории: строки строго после курсора (created_at, id)."""
+    db = get_reader()
+    sql = (
+        "SELECT id, drink, size, milk, created_at "
+        "FROM orders "
+        "WHERE user_id = ? AND deleted_at IS NULL "
+    )
+    params: list[Any] = [user_id]
+    if drink and drink != "all":
+        sql += "AND drink = ? "
+        params.append(drink)
+    if after is not None:
+        sql += "AND (created_at, id) > (?, ?) "
+        params += [after[0], after[1]]
+
+    sql += "ORDER BY created_at ASC, id ASC LIMIT ?"
+    params.append(limit)
 
+    return await _fetch_all(db, sql, params, OrderRow)
+
+@timed
+@cached
 async def count_orders(*, user_id: int, drink: str | None = None) -> int:
-    db = get_db()
-    db.row_factory = None
+    db = get_reader()
     sql = "SELECT COUNT(*) FROM orders WHERE user_id=? AND deleted_at IS NULL"
     params: list[Any] = [user_id]
     if drink and drink != "all":
         sql += " AND drink=?"
         params.append(drink)
-    cur = await db.execute(sql, params)
-    (n,) = await cur.fetchone()
-    return int(n)
+    return int(await _fetch_value(db, sql, params) or 0)
 
 
-async def get_order_by_id(*, user_id: int, order_id: int):
-    db = get_db()
-    db.row_factory = None
-    cur = await db.execute(
+@timed
+@cached
+async def get_order_by_id(*, user_id: int, order_id: int) -> OrderRow | None:
+    db = get_reader()
+    rows = await _fetch_all(
+        db,
         "SELECT id, drink, size, milk, created_at "
         "FROM orders WHERE user_id = ? AND id = ? AND deleted_at IS NULL",
         (user_id, order_id),
+        OrderRow,
     )
-    return await cur.fetchone()
+    return rows[0] if rows else None
 
 
 # ---------- soft delete / undo ----------
 
+@timed
 async def soft_delete(*, user_id: int, order_id: int) -> bool:
-    db = get_db()
     now = int(time.time())
-    cur = await db.execute(
+    cur = await _write(
         "UPDATE orders SET deleted_at=? "
         "WHERE id=? AND user_id=? AND deleted_at IS NULL",
         (now, order_id, user_id),
     )
-    await db.commit()
+    CACHE.invalidate_user(user_id)
     return cur.rowcount > 0
 
 
+@timed
 async def undo_delete(*, user_id: int, order_id: int) -> bool:
-    db = get_db()
-    cur = await db.execute(
+    cur = await _write(
         "UPDATE orders SET deleted_at=NULL "
         "WHERE id=? AND user_id=? AND deleted_at IS NOT NULL",
         (order_id, user_id),
     )
-    await db.commit()
+    CACHE.invalidate_user(user_id)
     return cur.rowcount > 0
 
 
 # ---------- extra (top / export) ----------
 
+@timed
 async def top_drinks_last_30d(*, user_id: int, limit: int = 5):
-    db = get_db()
-    since = int(time.time()) - 30 * 24 * 60 * 60
-    sql = (
-        "SELECT drink, COUNT(*) AS cnt "
-        "FROM orders "
-        "WHERE user_id = ? AND deleted_at IS NULL AND created_at >= ? "
-        "GROUP BY drink "
-        "ORDER BY cnt DESC "
-        "LIMIT ?"
-    )
-    with use_tuples(db):
-        cur = await db.execute(sql, (user_id, since, limit))
-        return await cur.fetchall()
+    until = window_end(int(time.time()), HOUR)
+    return await drink_counts_between(user_id=user_id, since=until - 30 * DAY, until=until, limit=limit)
 
+@timed
 async def orders_for_period(
     *,
     user_id: int,
@@ -157,9 +201,9 @@ async def orders_for_period(
     until: int,
     drink: str | None = None
 ):
-    db = get_db()
+    db = get_reader()
     sql = (
-        "SELECT id, drink, size, milk, created_at "
+        "SELECT id, drink, size, milk, created_at, total "
         "FROM orders "
         "WHERE user_id = ? "
         "  AND deleted_at IS NULL "
@@ -173,74 +217,176 @@ async def orders_for_period(
         params.append(drink)
 
     sql += "ORDER BY created_at ASC, id ASC"
-    with use_tuples(db):
-        cur = await db.execute(sql, params)
-        return await cur.fetchall()
+    return await _fetch_all(db, sql, params, ExportRow)
 
-async def drink_counts_between(*, user_id: int, since: int, until: int):
-    db = get_db()
-    db.row_factory = None
-    sql = """
-    SELECT drink, COUNT(*) AS cnt
-    FROM orders
-    WHERE user_id = ?
-      AND deleted_at IS NULL
-      AND created_at >= ?
-      AND created_at <  ?
-    GROUP BY drink
-    ORDER BY cnt DESC
+@timed
+async def iter_orders_for_period(
+    *,
+    user_id: int,
+    since: int,
+    until: int,
+    drink: str | None = None,
+    batch_size: int = 1000,
+):
+    """Те же строки, что и orders_for_period, но пачками по batch_size (keyset по (created_at, id))."""
+    db = get_reader()
+    drink_sql = "AND drink = ? " if drink and drink != "all" else ""
+    tail = "ORDER BY created_at ASC, id ASC LIMIT ?"
+    # первая пачка — от since; дальше только курсор: если оставить в запросе
+    # created_at >= ?, SQLite берёт его границей индекса и каждая пачка сканирует с начала
+    first_sql = (
+        "SELECT id, drink, size, milk, created_at, total FROM orders "
+        "WHERE user_id = ? AND deleted_at IS NULL "
+        "AND created_at >= ? AND created_at < ? " + drink_sql + tail
+    )
+    next_sql = (
+        "SELECT id, drink, size, milk, created_at, total FROM orders "
+        "WHERE user_id = ? AND deleted_at IS NULL "
+        "AND (created_at, id) > (?, ?) AND created_at < ? " + drink_sql + tail
+    )
+    extra = [drink] if drink_sql else []
+
+    sql, params = first_sql, [user_id, since, until, *extra, batch_size]
+    while True:
+        rows = await _fetch_all(db, sql, params, ExportRow)
+        if not rows:
+            return
+        yield rows
+        if len(rows) < batch_size:
+            return
+        last = rows[-1]
+        sql, params = next_sql, [user_id, last.created_at, last.id, until, *extra, batch_size]
+
+DAY = 24 * 60 * 60
+HOUR = 60 * 60
+
+
+def window_end(now: int, step: int) -> int:
+    """Правый край окна «до сейчас» для @cached-чтений: now, округлённое вверх до step.
+
+    С until = now + 1 ключ кэша меняется каждую секунду и чтения не попадают в кэш.
+    Заказов из будущего нет, а запись сбрасывает кэш, так что ответ от округления
+    не меняется; у окон фиксированной длины (since = until - 30 дней) левый край
+    сдвигается не больше чем на step.
     """
+    return (now // step + 1) * step
 
-    cur = await db.execute(sql, (user_id, since, until))
-    rows = await cur.fetchall()
-    return rows
+@timed
+@cached
+async def drink_counts_between(*, user_id: int, since: int, until: int, limit: int | None = None):
+    """Число живых заказов по напиткам в [since, until), по убыванию.
 
+    Полные UTC-сутки берутся из order_daily_counts, неполные края диапазона
+    (локальное «сегодня», «последние 30 дней от сейчас») досчитываются по orders
+    через idx_orders_live_user_created — это не больше двух суток заказов.
+    Пока агрегат достраивается бэкфиллом (bot/migrations.py), весь диапазон — по orders.
+    """
+    db = get_reader()
+    day_lo = -(-since // DAY)   # первые полные сутки
+    day_hi = until // DAY       # сутки, где until уже внутри
+    if day_lo >= day_hi or not backfill_done("order_daily_counts"):
+        day_lo = day_hi = since // DAY
+        head_until, tail_since = until, until
+    else:
+        head_until, tail_since = day_lo * DAY, day_hi * DAY
+
+    sql = """
+    SELECT drink, SUM(cnt) AS cnt FROM (
+        SELECT drink, cnt FROM order_daily_counts
+        WHERE user_id = ? AND day >= ? AND day < ?
+        UNION ALL
+        SELECT drink, 1 FROM orders
+        WHERE user_id = ? AND deleted_at IS NULL AND created_at >= ? AND created_at < ?
+        UNION ALL
+        SELECT drink, 1 FROM orders
+        WHERE user_id = ? AND deleted_at IS NULL AND created_at >= ? AND created_at < ?
+    )
+    GROUP BY drink
+    HAVING SUM(cnt) > 0
+    ORDER BY cnt DESC, drink
+    """
+    params: list[Any] = [
+        user_id, day_lo, day_hi,
+        user_id, since, head_until,
+        user_id, tail_since, until,
+    ]
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return await _fetch_all(db, sql, params, DrinkCount)
+
+@timed
+async def user_order_counts(user_id: int, *, since: int) -> tuple[int, int]:
+    """(живых заказов пользователя всего, из них с since) — для скидок за лояльность и объём."""
+    if backfill_done("order_daily_counts"):
+        total_sql = "SELECT COALESCE(SUM(cnt), 0) FROM order_daily_counts WHERE user_id = ?1"
+    else:
+        total_sql = "SELECT COUNT(*) FROM orders WHERE user_id = ?1 AND deleted_at IS NULL"
+    sql = (
+        f"SELECT ({total_sql}), "
+        "(SELECT COUNT(*) FROM orders WHERE user_id = ?1 AND deleted_at IS NULL AND created_at >= ?2)"
+    )
+    rows = await _fetch_all(get_reader(), sql, (user_id, since))
+    total, recent = rows[0]
+    return int(total), int(recent)
+
+async def _order_totals() -> tuple[int, int] | None:
+    """(живые, удалённые) из order_totals — поддерживаются триггерами; None, пока идёт бэкфилл."""
+    if not backfill_done("order_totals"):
+        return None
+    rows = await _fetch_all(get_reader(), "SELECT live, deleted FROM order_totals WHERE id = 1")
+    return (int(rows[0][0]), int(rows[0][1])) if rows else None
+
+@timed
 async def count_total_orders() -> int:
-    db = get_db()
-    db.row_factory = None
-    cur = await db.execute("SELECT COUNT(*) FROM orders WHERE deleted_at IS NULL")
-    (n,) = await cur.fetchone()
-    return int(n)
+    totals = await _order_totals()
+    if totals is not None:
+        return totals[0]
+    db = get_reader()
+    return int(await _fetch_value(db, "SELECT COUNT(*) FROM orders WHERE deleted_at IS NULL") or 0)
 
+@timed
 async def ping_db() -> bool:
     db = get_db()
     try:
-        cur = await db.execute("SELECT 1")
-        await cur.fetchone()
+        await _fetch_value(db, "SELECT 1")
         return True
     except aiosqlite.Error:
         return False
 
+@timed
 async def count_deleted() -> int:
-    db = get_db()
-    cur = await db.execute("SELECT COUNT(*) FROM orders WHERE deleted_at IS NOT NULL")
-    row = await cur.fetchone()
-    return int(row[0] or 0)
+    totals = await _order_totals()
+    if totals is not None:
+        return totals[1]
+    db = get_reader()
+    return int(await _fetch_value(db, "SELECT COUNT(*) FROM orders WHERE deleted_at IS NOT NULL") or 0)
 
+@timed
 async def last_order_ts_global() -> int | None:
-    db = get_db()
-    db.row_factory = None
-    cur = await db.execute(
-        "SELECT MAX(created_at) FROM orders WHERE deleted_at IS NULL"
-    )
-    (ts,) = await cur.fetchone()
+    db = get_reader()
+    ts = await _fetch_value(db, "SELECT MAX(created_at) FROM orders WHERE deleted_at IS NULL")
     return int(ts) if ts is not None else None
 
+@timed
 async def last_order_ts_for(user_id: int) -> int | None:
-    db = get_db()
-    db.row_factory = None
-    cur = await db.execute(
+    db = get_reader()
+    ts = await _fetch_value(
+        db,
         "SELECT MAX(created_at) FROM orders WHERE user_id=? AND deleted_at IS NULL",
         (user_id,),
     )
-    (ts,) = await cur.fetchone()
     return int(ts) if ts is not None else None
 
 def db_size_bytes() -> int:
-    try:
-        return os.path.getsize(DB_PATH)
-    except (FileNotFoundError, OSError):
-        return 0
+    """Файл БД вместе с -wal и -shm: в WAL-режиме свежие записи живут в -wal до checkpoint."""
+    total = 0
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            total += os.path.getsize(f"{DB_PATH}{suffix}")
+        except OSError:
+            pass
+    return total
 
 def human_bytes(n: int) -> str:
     for unit in ("B", "KB", "MB", "GB", "TB"):
@@ -249,41 +395,249 @@ def human_bytes(n: int) -> str:
         n /= 1024
     return f"{n:.0f} PB"
 
+@timed
+@cached
 async def last_order_at(user_id: int | None = None) -> int | None:
-    db = get_db()
+    db = get_reader()
     if user_id is None:
         sql = "SELECT MAX(created_at) FROM orders WHERE deleted_at IS NULL"
         args = ()
     else:
         sql = "SELECT MAX(created_at) FROM orders WHERE user_id = ? AND deleted_at IS NULL"
         args = (user_id,)
-    cur = await db.execute(sql, args)
-    row = await cur.fetchone()
-    return int(row[0]) if row and row[0] is not None else None
+    ts = await _fetch_value(db, sql, args)
+    return int(ts) if ts is not None else None
+
+@timed
+@cached
+async def user_order_numbers(user_id: int, order_ids: list[int]) -> dict[int, int]:
+    """«Ваш №» для набора заказов одним запросом: {order_id: порядковый номер}.
+
+    Номер — позиция заказа среди живых заказов пользователя по (created_at, id).
+    Префикс до первого заказа считается одним COUNT по индексу, а ROW_NUMBER
+    идёт только по диапазону самой страницы.
+    """
+    if not order_ids:
+        return {}
+    db = get_reader()
+    marks = ", ".join("?" * len(order_ids))
+    sql = f"""
+    WITH page AS (
+        SELECT id, created_at FROM orders
+        WHERE user_id = ? AND deleted_at IS NULL AND id IN ({marks})
+    ),
+    lo AS (SELECT created_at, id FROM page ORDER BY created_at ASC, id ASC LIMIT 1),
+    hi AS (SELECT created_at, id FROM page ORDER BY created_at DESC, id DESC LIMIT 1),
+    base AS (
+        SELECT COUNT(*) AS n FROM orders o, lo
+        WHERE o.user_id = ? AND o.deleted_at IS NULL
+          AND (o.created_at, o.id) < (lo.created_at, lo.id)
+    ),
+    numbered AS (
+        SELECT o.id, base.n + ROW_NUMBER() OVER (ORDER BY o.created_at, o.id) AS no
+        FROM orders o, lo, hi, base
+        WHERE o.user_id = ? AND o.deleted_at IS NULL
+          AND (o.created_at, o.id) >= (lo.created_at, lo.id)
+          AND (o.created_at, o.id) <= (hi.created_at, hi.id)
+    )
+    SELECT id, no FROM numbered WHERE id IN (SELECT id FROM page)
+    """
+    rows = await _fetch_all(db, sql, (user_id, *order_ids, user_id, user_id))
+    return {int(oid): int(no) for oid, no in rows}
+
+@timed
+async def users_with_orders_after(after_uid: int, limit: int) -> list[int]:
+    """Следующая пачка получателей рассылки: user_id > after_uid по возрастанию."""
+    db = get_reader()
+    rows = await _fetch_all(
+        db,
+        "SELECT DISTINCT user_id FROM orders "
+        "WHERE user_id > ? AND deleted_at IS NULL "
+        "ORDER BY user_id LIMIT ?",
+        (after_uid, limit),
+    )
+    return [int(r[0]) for r in rows]
+
+@timed
+async def count_users_with_orders(after_uid: int = 0) -> int:
+    db = get_reader()
+    return int(await _fetch_value(
+        db,
+        "SELECT COUNT(DISTINCT user_id) FROM orders WHERE user_id > ? AND deleted_at IS NULL",
+        (after_uid,),
+    ) or 0)
+
+# ---------- analytics (по всем пользователям) ----------
+
+class Bucket(NamedTuple):
+    start: int    # epoch начала корзины
+    orders: int
+    revenue: int  # копейки
+    priced: int   # заказов с суммой
+
+class MixCount(NamedTuple):
+    dim: str      # drink | size | milk
+    value: str
+    orders: int
+    revenue: int
+
+def _hourly_source(hour_lo: int, hour_hi: int) -> tuple[str, list[Any]]:
+    """Часовые корзины [hour_lo, hour_hi): из order_hourly, а пока он достраивается — по orders."""
+    if backfill_done("order_rollups"):
+        return "SELECT hour, orders, revenue, priced FROM order_hourly WHERE hour >= ? AND hour < ?", \
+            [hour_lo, hour_hi]
+    return (
+        "SELECT created_at / 3600 AS hour, COUNT(*) AS orders, SUM(COALESCE(total, 0)) AS revenue, "
+        "COUNT(total) AS priced FROM orders "
+        "WHERE deleted_at IS NULL AND created_at >= ? AND created_at < ? GROUP BY created_at / 3600",
+        [hour_lo * HOUR, hour_hi * HOUR],
+    )
+
+@timed
+@cached
+async def order_buckets(*, since: int, until: int, step: int = HOUR, shift: int = 0) -> list[Bucket]:
+    """Заказы и выручка в [since, until) по корзинам в step секунд (кратно часу).
 
-async def user_order_number(user_id: int, created_at: int) -> int:
+    Границы корзин — (t + shift) кратно step: shift — смещение пояса (и дней до
+    понедельника для недель). Края диапазона округляются до часа.
+    """
+    source, params = _hourly_source(since // HOUR, -(-until // HOUR))
+    sql = f"""
+    SELECT (hour * 3600 + ?) / ? * ? - ? AS start, SUM(orders), SUM(revenue), SUM(priced)
+    FROM ({source})
+    GROUP BY start
+    HAVING SUM(orders) > 0
+    ORDER BY start
+    """
+    return await _fetch_all(get_reader(), sql, [shift, step, step, shift, *params], Bucket)
+
+@timed
+@cached
+async def order_heatmap(*, since: int, until: int, utc_offset: int = 0) -> list[tuple[int, int, int]]:
+    """(день недели 0=пн, местный час, заказов) в [since, until) — только непустые клетки."""
+    source, params = _hourly_source(since // HOUR, -(-until // HOUR))
+    sql = f"""
+    SELECT ((hour * 3600 + ?) / 86400 + 3) % 7 AS wd, (hour * 3600 + ?) / 3600 % 24 AS h, SUM(orders)
+    FROM ({source})
+    GROUP BY wd, h
+    HAVING SUM(orders) > 0
+    """
+    return await _fetch_all(get_reader(), sql, [utc_offset, utc_offset, *params])
+
+@timed
+@cached
+async def order_mix(*, since: int, until: int) -> list[MixCount]:
+    """Живые заказы и выручка в [since, until) по напиткам, размерам и молоку.
+
+    Полные UTC-сутки — из order_mix_daily, неполные края — по orders через
+    idx_orders_live_created, как в drink_counts_between.
+    """
+    day_lo = -(-since // DAY)
+    day_hi = until // DAY
+    if day_lo >= day_hi or not backfill_done("order_rollups"):
+        day_lo = day_hi = since // DAY
+        head_until, tail_since = until, until
+    else:
+        head_until, tail_since = day_lo * DAY, day_hi * DAY
+
+    edge = """
+        SELECT drink, size, milk, COALESCE(total, 0) AS t FROM orders
+        WHERE deleted_at IS NULL AND created_at >= ? AND created_at < ?
+    """
+    sql = f"""
+    WITH edges AS ({edge} UNION ALL {edge})
+    SELECT dim, value, SUM(orders), SUM(revenue) FROM (
+        SELECT dim, value, orders, revenue FROM order_mix_daily WHERE day >= ? AND day < ?
+        UNION ALL SELECT 'drink', drink, 1, t FROM edges
+        UNION ALL SELECT 'size', size, 1, t FROM edges
+        UNION ALL SELECT 'milk', milk, 1, t FROM edges
+    )
+    GROUP BY dim, value
+    HAVING SUM(orders) > 0
+    ORDER BY dim, SUM(orders) DESC, value
+    """
+    params = [since, head_until, tail_since, until, day_lo, day_hi]
+    return await _fetch_all(get_reader(), sql, params, MixCount)
+
+@timed
+@cached
+async def count_new_customers(*, since: int, until: int) -> int:
+    """Клиентов, чей первый заказ (в том числе удалённый потом) попал в [since, until)."""
+    if backfill_done("order_rollups"):
+        sql = "SELECT COUNT(*) FROM order_customers WHERE first_at >= ? AND first_at < ?"
+    else:
+        sql = ("SELECT COUNT(*) FROM (SELECT user_id FROM orders GROUP BY user_id "
+               "HAVING MIN(created_at) >= ? AND MIN(created_at) < ?)")
+    return int(await _fetch_value(get_reader(), sql, (since, until)) or 0)
+
+# ---------- broadcasts ----------
+
+class BroadcastRow(NamedTuple):
+    id: int
+    admin_chat: int
+    text: str
+    status: str
+    cursor_uid: int
+    total: int
+    sent: int
+    failed: int
+
+_BROADCAST_COLS = "id, admin_chat, text, status, cursor_uid, total, sent, failed"
+
+@timed
+async def create_broadcast(*, admin_chat: int, text: str, total: int) -> int:
+    cur = await _write(
+        "INSERT INTO broadcasts(admin_chat, text, total, created_at) VALUES (?, ?, ?, ?)",
+        (admin_chat, text, total, int(time.time())),
+    )
+    return cur.lastrowid
+
+@timed
+async def get_broadcast(broadcast_id: int) -> BroadcastRow | None:
     db = get_db()
-    db.row_factory = None
-    cur = await db.execute(
-        """
-        SELECT COUNT(*)
-        FROM orders
-        WHERE user_id = ?
-          AND deleted_at IS NULL
-          AND created_at <= ?
-        """,
-        (user_id, created_at),
+    rows = await _fetch_all(
+        db, f"SELECT {_BROADCAST_COLS} FROM broadcasts WHERE id = ?", (broadcast_id,), BroadcastRow
     )
-    (cnt,) = await cur.fetchone()
-    return int(cnt or 0)
+    return rows[0] if rows else None
 
-async def distinct_users_with_orders() -> list[int]:
+@timed
+async def running_broadcasts() -> list[BroadcastRow]:
     db = get_db()
-    db.row_factory = None
-    cur = await db.execute("""
-            SELECT DISTINCT user_id
-            FROM orders
-            WHERE deleted_at IS NULL
-        """)
-    rows = await cur.fetchall()
-    return [int(r[0]) for r in rows if r and r[0] is not None]
\ No newline at end of file
+    return await _fetch_all(
+        db, f"SELECT {_BROADCAST_COLS} FROM broadcasts WHERE status = 'running' ORDER BY id", (), BroadcastRow
+    )
+
+@timed
+async def claim_broadcast(broadcast_id: int, *, owner: str, lease_sec: int) -> bool:
+    """Берёт или продлевает аренду рассылки: удаётся, если она ничья, уже наша или аренда истекла."""
+    now = int(time.time())
+    cur = await _write(
+        "UPDATE broadcasts SET owner = ?, lease_until = ? "
+        "WHERE id = ? AND status = 'running' AND (owner IS NULL OR owner = ? OR lease_until < ?)",
+        (owner, now + lease_sec, broadcast_id, owner, now),
+    )
+    return cur.rowcount > 0
+
+@timed
+async def release_broadcasts(*, owner: str) -> int:
+    """Отдаёт аренды экземпляра при остановке — после рестарта рассылки продолжатся сразу,
+    а не через BROADCAST_LEASE_SEC."""
+    cur = await _write(
+        "UPDATE broadcasts SET owner = NULL, lease_until = NULL WHERE status = 'running' AND owner = ?",
+        (owner,),
+    )
+    return cur.rowcount
+
+@timed
+async def save_broadcast_progress(broadcast_id: int, *, cursor_uid: int, sent: int, failed: int,
+                                  done: bool = False, owner: str | None = None) -> bool:
+    """С owner — только если аренда всё ещё у него; False — рассылку забрал другой экземпляр."""
+    sql = ("UPDATE broadcasts SET cursor_uid = ?, sent = ?, failed = ?, status = ?, finished_at = ? "
+           "WHERE id = ?")
+    params: list[Any] = [cursor_uid, sent, failed, "done" if done else "running",
+                         int(time.time()) if done else None, broadcast_id]
+    if owner is not None:
+        sql += " AND owner = ?"
+        params.append(owner)
+    cur = await _write(sql, params)
+    return cur.rowcount > 0
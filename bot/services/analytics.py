@@ -0,0 +1,171 @@
+"""Аналитика по всей кофейне для /analytics: заказы и выручка по часам/дням/неделям,
+тепловая карта «день недели × час», разбивка по напиткам/размерам/молоку, доля повторных.
+
+Всё читается из срезов, которые триггеры ведут при каждом заказе (миграция 5 в
+bot/migrations.py): ответ на любой период — слияние готовых корзин, а не проход по orders.
+"""
+import asyncio
+import time
+from datetime import datetime
+from html import escape
+from typing import NamedTuple
+from zoneinfo import ZoneInfo
+
+from ..catalog import DRINKS, SIZES
+from ..repo import (DAY, HOUR, Bucket, MixCount, count_new_customers, order_buckets, order_heatmap, order_mix,
+                    window_end)
+from ..utils import TZ, fmt_money
+
+WEEK = 7 * DAY
+
+# период → (сколько последних местных суток, включая сегодня; шаг ряда)
+PERIODS: dict[str, tuple[int | None, int]] = {
+    "today": (1, HOUR),
+    "week": (7, DAY),
+    "month": (30, DAY),
+    "year": (365, WEEK),
+    "all": (None, WEEK),
+}
+PERIOD_LABELS = {"today": "за сегодня", "week": "за неделю", "month": "за 30 дней",
+                 "year": "за год", "all": "за всё время"}
+
+SPARK = "▁▂▃▄▅▆▇█"
+HEAT = " ░▒▓█"
+SPARK_MAX = 48
+WEEKDAYS = ("пн", "вт", "ср", "чт", "пт", "сб", "вс")
+
+
+class Report(NamedTuple):
+    period: str
+    since: int
+    until: int
+    step: int
+    buckets: list[Bucket]
+    heatmap: list[list[int]]  # [день недели][час] → заказов
+    mix: dict[str, list[MixCount]]
+    new_customers: int
+
+    @property
+    def orders(self) -> int:
+        return sum(b.orders for b in self.buckets)
+
+    @property
+    def revenue(self) -> int:
+        return sum(b.revenue for b in self.buckets)
+
+    @property
+    def avg_check(self) -> int | None:
+        priced = sum(b.priced for b in self.buckets)
+        return self.revenue // priced if priced else None
+
+    @property
+    def repeat_rate(self) -> float | None:
+        """Доля заказов от тех, кто уже заказывал раньше: первый заказ у клиента один."""
+        return max(0, self.orders - self.new_customers) / self.orders if self.orders else None
+
+
+def utc_offset(ts: int) -> int:
+    return int(datetime.fromtimestamp(ts, ZoneInfo(TZ)).utcoffset().total_seconds())
+
+
+def period_bounds(period: str, now: int) -> tuple[int, int]:
+    # конец — до конца текущего часа: ключи кэша отчёта живут час, а не секунду
+    until = window_end(now, HOUR)
+    days, _ = PERIODS[period]
+    if days is None:
+        return 0, until
+    off = utc_offset(now)
+    today = now - (now + off) % DAY
+    return today - (days - 1) * DAY, until
+
+
+def _shift(step: int, off: int) -> int:
+    # недели — с понедельника; 1970-01-01 — четверг
+    return off + 3 * DAY if step == WEEK else off
+
+
+async def build_report(period: str, *, now: int | None = None) -> Report:
+    now = int(time.time()) if now is None else now
+    since, until = period_bounds(period, now)
+    _, step = PERIODS[period]
+    off = utc_offset(now)
+    buckets, cells, mix, new = await asyncio.gather(
+        order_buckets(since=since, until=until, step=step, shift=_shift(step, off)),
+        order_heatmap(since=since, until=until, utc_offset=off),
+        order_mix(since=since, until=until),
+        count_new_customers(since=since, until=until),
+    )
+    heatmap = [[0] * 24 for _ in range(7)]
+    for wd, h, n in cells:
+        heatmap[wd][h] = n
+    by_dim: dict[str, list[MixCount]] = {"drink": [], "size": [], "milk": []}
+    for m in mix:
+        by_dim.setdefault(m.dim, []).append(m)
+    return Report(period, since, until, step, buckets, heatmap, by_dim, new)
+
+
+def sparkline(values: list[int]) -> str:
+    top = max(values, default=0)
+    if not top:
+        return SPARK[0] * len(values)
+    return "".join(SPARK[-(-v * (len(SPARK) - 1) // top)] for v in values)
+
+
+def _series(r: Report) -> list[tuple[int, int]]:
+    """Ряд по корзинам без пропусков: пустые корзины — нули. Не длиннее SPARK_MAX."""
+    if not r.buckets:
+        return []
+    got = {b.start: b.orders for b in r.buckets}
+    last = r.buckets[-1].start
+    first = max(r.buckets[0].start, last - (SPARK_MAX - 1) * r.step)
+    return [(t, got.get(t, 0)) for t in range(first, last + 1, r.step)]
+
+
+def _fmt_bucket(ts: int, step: int) -> str:
+    dt = datetime.fromtimestamp(ts, ZoneInfo(TZ))
+    return dt.strftime("%H:00") if step == HOUR else dt.strftime("%d.%m")
+
+
+def render_heatmap(heatmap: list[list[int]]) -> str:
+    top = max(map(max, heatmap))
+    rows = ["   0     6     12    18"]
+    for wd, cells in enumerate(heatmap):
+        line = "".join(HEAT[-(-n * (len(HEAT) - 1) // top)] if top else HEAT[0] for n in cells)
+        rows.append(f"{WEEKDAYS[wd]} {line}")
+    return "\n".join(rows)
+
+
+def _share(items: list[MixCount], label) -> str:
+    total = sum(m.orders for m in items)
+    if not total:
+        return "—"
+    return " · ".join(f"{escape(label(m.value))} {m.orders * 100 // total}%" for m in items)
+
+
+def render_report(r: Report) -> str:
+    if not r.orders:
+        return f"📊 <b>Аналитика {PERIOD_LABELS[r.period]}</b>\n\nЗаказов нет."
+
+    rate = r.repeat_rate
+    lines = [
+        f"📊 <b>Аналитика {PERIOD_LABELS[r.period]}</b>",
+        "",
+        f"Заказы: <b>{r.orders}</b> · выручка: <b>{fmt_money(r.revenue)}</b> · "
+        f"средний чек: <b>{fmt_money(r.avg_check)}</b>",
+        f"Новые клиенты: <b>{r.new_customers}</b> · повторные заказы: <b>{round(rate * 100)}%</b>",
+    ]
+
+    series = _series(r)
+    peak_t, peak_n = max(series, key=lambda p: p[1])
+    unit = {HOUR: "часам", DAY: "дням", WEEK: "неделям"}[r.step]
+    lines += [
+        "",
+        f"<b>По {unit}</b> (пик {_fmt_bucket(peak_t, r.step)} — {peak_n}):",
+        f"<pre>{sparkline([n for _, n in series])}</pre>",
+        "<b>Часы пик</b>:",
+        f"<pre>{render_heatmap(r.heatmap)}</pre>",
+        "<b>Напитки</b>: " + _share(r.mix["drink"], lambda c: DRINKS.get(c, c.title())),
+        "<b>Размеры</b>: " + _share(r.mix["size"], lambda c: SIZES.get(c, c.title())),
+        "<b>Молоко</b>: " + _share(r.mix["milk"], lambda c: {"yes": "с молоком", "no": "без"}.get(c, c)),
+    ]
+    return "\n".join(lines)
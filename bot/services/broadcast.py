@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from contextlib import suppress
+
+from aiogram import Bot
+from aiogram.exceptions import (TelegramBadRequest, TelegramForbiddenError,
+                                TelegramNetworkError, TelegramRetryAfter)
+
+from ..repo import (users_with_orders_after, get_broadcast, running_broadcasts,
+                    save_broadcast_progress, claim_broadcast, release_broadcasts)
+
+log = logging.getLogger("broadcast")
+
+# лимит Telegram — ~30 сообщений/с на бота; держим запас
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_WORKERS = max(1, int(os.getenv("BROADCAST_WORKERS", "8")))
+# получателей за одну выборку; прогресс в БД сохраняется после каждой пачки
+BROADCAST_BATCH = 200
+# как часто обновлять сообщение с прогрессом у админа
+PROGRESS_EVERY_SEC = 5.0
+MAX_ATTEMPTS = 5
+# аренда рассылки: продлевается перед каждой пачкой; экземпляр, упавший посреди
+# рассылки, отдаёт её другим не раньше, чем через столько секунд
+BROADCAST_LEASE_SEC = max(1, int(os.getenv("BROADCAST_LEASE_SEC", "120")))
+# кто держит аренду; у каждого процесса свой
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+_RUNNING: dict[int, asyncio.Task] = {}
+# ожидающие чужих рассылок — на случай, если их владелец упадёт
+_WATCHERS: set[asyncio.Task] = set()
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше burst подряд. pause() — общий стоп на flood wait."""
+
+    def __init__(self, rate: float, burst: int | None = None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class _Progress:
+    def __init__(self, job) -> None:
+        self.sent = job.sent
+        self.failed = job.failed
+        self.total = job.total
+        self.started = time.monotonic()
+        self.done_at_start = job.sent + job.failed
+
+    def text(self, *, finished: bool = False) -> str:
+        done = self.sent + self.failed
+        elapsed = max(1e-6, time.monotonic() - self.started)
+        rate = (done - self.done_at_start) / elapsed
+        head = "✅ Рассылка завершена" if finished else "📨 Рассылка идёт"
+        lines = [
+            f"{head}",
+            f"Отправлено: {self.sent} · ошибок: {self.failed} · всего: {self.total}",
+            f"Скорость: {rate:.1f} сообщ./с",
+        ]
+        if not finished:
+            left = max(0, self.total - done)
+            eta = int(left / rate) if rate > 0 else None
+            lines.append(f"Осталось: ~{eta} с" if eta is not None else "Осталось: —")
+        return "\n".join(lines)
+
+
+async def _send_one(bot: Bot, bucket: TokenBucket, uid: int, text: str) -> bool:
+    for _ in range(MAX_ATTEMPTS):
+        await bucket.acquire()
+        try:
+            await bot.send_message(uid, text, disable_web_page_preview=True)
+            return True
+        except TelegramRetryAfter as e:
+            log.warning("broadcast flood wait %ss", e.retry_after)
+            bucket.pause(e.retry_after)
+        except TelegramNetworkError as e:
+            log.warning("broadcast network error uid=%s: %s", uid, e)
+            await asyncio.sleep(1)
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # бот заблокирован / чат удалён — повторять бессмысленно
+            log.info("broadcast skip uid=%s: %s", uid, e)
+            return False
+        except Exception as e:
+            log.warning("broadcast fail uid=%s: %s", uid, e)
+            return False
+    return False
+
+
+async def run_broadcast(bot: Bot, broadcast_id: int, *, progress_message_id: int | None = None,
+                        owner: str = INSTANCE_ID) -> None:
+    if not await claim_broadcast(broadcast_id, owner=owner, lease_sec=BROADCAST_LEASE_SEC):
+        log.info("broadcast id=%s is run by another instance", broadcast_id)
+        return
+    job = await get_broadcast(broadcast_id)
+    if job is None or job.status != "running":
+        return
+
+    bucket = TokenBucket(BROADCAST_RATE)
+    progress = _Progress(job)
+    cursor = job.cursor_uid
+    last_report = 0.0
+
+    async def report(*, finished: bool = False) -> None:
+        nonlocal progress_message_id, last_report
+        last_report = time.monotonic()
+        text = progress.text(finished=finished)
+        with suppress(TelegramBadRequest):
+            if progress_message_id is None:
+                msg = await bot.send_message(job.admin_chat, text)
+                progress_message_id = msg.message_id
+            else:
+                await bot.edit_message_text(text, chat_id=job.admin_chat, message_id=progress_message_id)
+
+    async def worker(queue: asyncio.Queue) -> None:
+        while True:
+            uid = await queue.get()
+            try:
+                if await _send_one(bot, bucket, uid, job.text):
+                    progress.sent += 1
+                else:
+                    progress.failed += 1
+            finally:
+                queue.task_done()
+
+    await report()
+    while True:
+        # аренда истекла и рассылку забрал другой экземпляр (долгий flood wait, зависание) — уступаем
+        if not await claim_broadcast(broadcast_id, owner=owner, lease_sec=BROADCAST_LEASE_SEC):
+            log.warning("broadcast id=%s lease lost at uid>%s", broadcast_id, cursor)
+            return
+        uids = await users_with_orders_after(cursor, BROADCAST_BATCH)
+        if not uids:
+            break
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for uid in uids:
+            queue.put_nowait(uid)
+        workers = [asyncio.create_task(worker(queue)) for _ in range(min(BROADCAST_WORKERS, len(uids)))]
+        try:
+            await queue.join()
+        finally:
+            for w in workers:
+                w.cancel()
+
+        cursor = uids[-1]
+        if not await save_broadcast_progress(broadcast_id, cursor_uid=cursor, sent=progress.sent,
+                                             failed=progress.failed, owner=owner):
+            log.warning("broadcast id=%s lease lost at uid>%s", broadcast_id, cursor)
+            return
+        if time.monotonic() - last_report >= PROGRESS_EVERY_SEC:
+            await report()
+
+    if await save_broadcast_progress(broadcast_id, cursor_uid=cursor, sent=progress.sent,
+                                     failed=progress.failed, done=True, owner=owner):
+        await report(finished=True)
+
+
+def start_broadcast_job(bot: Bot, broadcast_id: int, *, progress_message_id: int | None = None,
+                        owner: str = INSTANCE_ID) -> None:
+    task = asyncio.create_task(run_broadcast(bot, broadcast_id, progress_message_id=progress_message_id,
+                                             owner=owner))
+    _RUNNING[broadcast_id] = task
+    task.add_done_callback(lambda t: _RUNNING.pop(broadcast_id, None))
+    task.add_done_callback(_log_failure)
+
+
+def _log_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        log.error("broadcast crashed", exc_info=task.exception())
+
+
+async def _watch(bot: Bot, broadcast_id: int, owner: str) -> None:
+    """Ждёт чужую рассылку: если владелец перестал продлевать аренду — забирает."""
+    while True:
+        await asyncio.sleep(BROADCAST_LEASE_SEC)
+        job = await get_broadcast(broadcast_id)
+        if job is None or job.status != "running":
+            return
+        if await claim_broadcast(broadcast_id, owner=owner, lease_sec=BROADCAST_LEASE_SEC):
+            log.info("take over broadcast id=%s from uid>%s", broadcast_id, job.cursor_uid)
+            start_broadcast_job(bot, broadcast_id, owner=owner)
+            return
+
+
+async def resume_broadcasts(bot: Bot, *, owner: str = INSTANCE_ID) -> int:
+    """Поднимает рассылки, прерванные рестартом. Возвращает число взятых этим экземпляром.
+
+    Рассылку шлёт тот, кто взял аренду (claim_broadcast — условный UPDATE), остальные
+    экземпляры только ждут, не упадёт ли он.
+    """
+    taken = 0
+    for job in await running_broadcasts():
+        if job.id in _RUNNING:
+            continue
+        if await claim_broadcast(job.id, owner=owner, lease_sec=BROADCAST_LEASE_SEC):
+            log.info("resume broadcast id=%s from uid>%s", job.id, job.cursor_uid)
+            start_broadcast_job(bot, job.id, owner=owner)
+            taken += 1
+        else:
+            watcher = asyncio.create_task(_watch(bot, job.id, owner))
+            _WATCHERS.add(watcher)
+            watcher.add_done_callback(_WATCHERS.discard)
+            watcher.add_done_callback(_log_failure)
+    return taken
+
+
+async def stop_broadcasts(*, owner: str = INSTANCE_ID) -> None:
+    """Останавливает рассылки и наблюдателей до закрытия БД и отдаёт аренды.
+
+    Прогресс сохранён по последнюю завершённую пачку; после рестарта рассылка
+    продолжится с неё (недосланная пачка уйдёт ещё раз — как после падения).
+    """
+    tasks = [*_WATCHERS, *_RUNNING.values()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if tasks:
+        await release_broadcasts(owner=owner)
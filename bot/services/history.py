@@ -1,7 +1,7 @@
 from aiogram.types import Message
 from ..catalog import DRINKS, SIZES
 from ..keyboards import history_actions_kb, history_more_kb
-from ..repo import orders_for_period, user_order_number
+from ..repo import orders_page_after, user_order_numbers
 from ..utils import fmt_ts
 import logging
 
@@ -15,25 +15,35 @@ def _label_drink(code: str) -> str:
 def _label_size(code: str) -> str:
     return SIZES.get(code, code.title())
 
-async def send_history_page(message: Message, drink: str, offset: int, *, user_id: int, page_size: int = 5) -> None:
+async def send_history_page(
+    message: Message,
+    drink: str,
+    cursor: tuple[int, int] | None,
+    *,
+    user_id: int,
+    page_size: int = PAGE_SIZE,
+) -> None:
     drink_code = None if (drink is None or drink.lower() == "all") else drink.lower()
 
-    rows = await orders_for_period(
+    # берём на одну строку больше — так узнаём, есть ли следующая страница, без COUNT(*)
+    rows = await orders_page_after(
         user_id=user_id,
-        since=0,
-        until=2_147_483_647,
-        drink=drink_code
+        drink=drink_code,
+        after=cursor,
+        limit=page_size + 1,
     )
 
     if not rows:
         await message.answer("История заказа пока пуста 🧾")
         return
 
-    page = rows[offset: offset + page_size]
-    remain = max(0, len(rows) - (offset + page_size))
+    page = rows[:page_size]
+    has_more = len(rows) > page_size
+
+    numbers = await user_order_numbers(user_id, [int(r[0]) for r in page])
 
     for oid, dcode, size, milk, created in page:
-        mine_no = await user_order_number(user_id, int(created))
+        mine_no = numbers.get(int(oid), 0)
         text = (
             f"☕ <b>Напиток:</b> {DRINKS.get(dcode, dcode.title())}\n"
             f"📏 <b>Размер:</b> {SIZES.get(size, size.title())}\n"
@@ -44,17 +54,24 @@ async def send_history_page(message: Message, drink: str, offset: int, *, user_i
         kb = history_actions_kb(oid, display_no=mine_no)
         await message.answer(text, reply_markup=kb, parse_mode="HTML", disable_web_page_preview=True)
 
-    if remain > 0:
+    if has_more:
+        last_id, *_rest, last_created = page[-1]
         await message.answer(
             "Показать ещё?",
-            reply_markup=history_more_kb(drink=drink if drink else "all", offset=offset + page_size, remain=remain)
+            reply_markup=history_more_kb(drink=drink if drink else "all", cursor=(int(last_created), int(last_id)))
         )
 
 def parse_cb(data: str) -> dict:
     if data.startswith("history_filter:"):
         _, drink = data.split(":", 1)
-        return {"cmd": "filter", "drink": drink, "offset": 0}
+        return {"cmd": "filter", "drink": drink, "cursor": None}
     if data.startswith("history_more:"):
-        _, drink, off = data.split(":", 2)
-        return {"cmd": "more", "drink": drink, "offset": int(off)}
+        _, drink, *rest = data.split(":", 3)
+        # кнопки, отправленные до keyset-пагинации, несут history_more:<drink>:<offset> —
+        # смещение курсором не станет, такие начинают с первой страницы
+        try:
+            cursor = (int(rest[0]), int(rest[1])) if len(rest) == 2 else None
+        except ValueError:
+            cursor = None
+        return {"cmd": "more", "drink": drink, "cursor": cursor}
     return {"cmd": "unknown", "raw": data}
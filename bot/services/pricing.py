@@ -0,0 +1,57 @@
+from datetime import datetime
+from typing import Sequence
+from zoneinfo import ZoneInfo
+
+from coffee_utils.pricing import DAY, HappyHour, Loyalty, Pricer, Volume
+from ..catalog import DRINKS, SIZES
+from ..repo import ExportRow, user_order_counts
+from ..utils import TZ
+
+# копейки
+PRICES: dict[str, dict[str, int]] = {
+    "americano":  {"small": 15000, "medium": 18000, "large": 21000},
+    "latte":      {"small": 20000, "medium": 24000, "large": 28000},
+    "cappuccino": {"small": 19000, "medium": 23000, "large": 27000},
+    "flat white": {"small": 23000, "medium": 27000, "large": 31000},
+    "mocha":      {"small": 24000, "medium": 28000, "large": 32000},
+}
+MODIFIER_PRICES: dict[str, dict[str, int]] = {"milk": {"yes": 3000, "no": 0}}
+
+RULES = (
+    Loyalty(pct=10, min_orders=10),                            # с 10-го заказа
+    HappyHour(pct=20, start_hour=8, end_hour=10, weekdays=(0, 1, 2, 3, 4)),
+    Volume(pct=5, min_daily=3),                                # третий и дальше за день
+)
+MAX_DISCOUNT_PCT = 30
+
+_missing = [(d, s) for d in DRINKS for s in SIZES if s not in PRICES.get(d, {})]
+if _missing:
+    raise RuntimeError(f"Нет цен для позиций меню: {_missing}")
+
+PRICER = Pricer(
+    PRICES, MODIFIER_PRICES, RULES,
+    # часы happy hour — в том же поясе, в котором бот показывает время (без учёта перехода на летнее)
+    utc_offset=int(datetime.now(ZoneInfo(TZ)).utcoffset().total_seconds()),
+    max_discount_pct=MAX_DISCOUNT_PCT,
+)
+
+
+def local_day_start(ts: int) -> int:
+    return ts - (ts + PRICER.utc_offset) % DAY
+
+
+async def quote_order(*, user_id: int, drink: str, size: str, milk: str, ts: int) -> int:
+    """Сумма нового заказа со скидками: номер заказа и номер за день — с учётом его самого."""
+    total, today = await user_order_counts(user_id, since=local_day_start(ts))
+    return PRICER.price(drink, size, milk, ts, order_no=total + 1, nth_today=today + 1)
+
+
+def estimate_totals(rows: Sequence[ExportRow]) -> list[int | None]:
+    """Оценка по прайсу для старых строк без суммы (NULL) — одним проходом, без персональных
+    скидок (номер заказа тогда не хранился). Для строк с сохранённой суммой — None:
+    оценка не подменяет то, что клиент заплатил на самом деле."""
+    if all(r.total is not None for r in rows):
+        return [None] * len(rows)
+    priced = PRICER.price_batch([r.drink for r in rows], [r.size for r in rows],
+                                [r.milk for r in rows], [r.created_at for r in rows])
+    return [None if r.total is not None else p for r, p in zip(rows, priced)]
@@ -1,15 +1,62 @@
 from collections import Counter
-from datetime import date, datetime
+from datetime import date
+from typing import Iterable, Mapping
 from ..catalog import drink_label
-from ..storage import read_orders_json
+from ..storage import day_drink_counts
 
-def today_only(items: list[dict]) -> list[dict]:
-    today = date.today()
-    return [o for o in items if datetime.fromisoformat(o["ts"]).date() == today]
+# период → сколько последних дней (включая сегодня); None — за всё время
+PERIODS: dict[str, int | None] = {"today": 1, "week": 7, "month": 30, "all": None}
 
-def count_by_drink(items: list[dict]) -> Counter:
+# «YYYY-MM-DD» → порядковый номер дня; дат в логе немного, разбираем каждую один раз
+_DAY_NO: dict[str, int] = {}
+
+
+def _day_no(prefix: str) -> int:
+    n = _DAY_NO.get(prefix)
+    if n is None:
+        n = _DAY_NO[prefix] = date.fromisoformat(prefix).toordinal()
+    return n
+
+
+def today_only(items: Iterable[dict]) -> list[dict]:
+    today = date.today().isoformat()
+    return [o for o in items if o["ts"][:10] == today]
+
+def count_by_drink(items: Iterable[dict]) -> Counter:
     return Counter(o["drink"] for o in items)
 
+
+def _fold(per_day: Counter, periods: Mapping[str, int | None], today: date | None) -> dict[str, Counter]:
+    today_no = (today or date.today()).toordinal()
+    out = {name: Counter() for name in periods}
+    for (prefix, drink), n in per_day.items():
+        age = today_no - _day_no(prefix)
+        for name, days in periods.items():
+            if days is None or 0 <= age < days:
+                out[name][drink] += n
+    return out
+
+
+def aggregate(records: Iterable[dict], periods: Mapping[str, int | None] = PERIODS,
+              *, today: date | None = None) -> dict[str, Counter]:
+    """Один проход по записям → {период: Counter(напиток → число)}."""
+    per_day = Counter((o["ts"][:10], o["drink"]) for o in records)
+    return _fold(per_day, periods, today)
+
+
+def aggregate_batches(batches: Iterable[Iterable[tuple[bytes, bytes]]],
+                      periods: Mapping[str, int | None] = PERIODS,
+                      *, today: date | None = None) -> dict[str, Counter]:
+    """То же по пачкам пар (b"YYYY-MM-DD", напиток в utf-8) из storage.iter_day_drink_batches."""
+    raw = Counter()
+    for batch in batches:
+        raw.update(batch)
+    per_day = Counter()
+    for (day, drink), n in raw.items():
+        per_day[day.decode(), drink.decode()] += n
+    return _fold(per_day, periods, today)
+
+
 def render_stats(cnt: Counter, *, label=drink_label) -> str:
     if not cnt:
         return "_нет данных_"
@@ -22,11 +69,10 @@ def render_stats(cnt: Counter, *, label=drink_label) -> str:
     return "\n".join(lines)
 
 def format_stats() -> str:
-    items = read_orders_json()
-    all_cnt = count_by_drink(items)
-    today_cnt = count_by_drink(today_only(items))
+    # счётчики по дням ведёт storage (ORDERS_LOG_DAYS) — лог целиком не перечитывается
+    cnt = _fold(day_drink_counts(), {"today": 1, "all": None}, None)
     return (
         "*Статистика по напиткам*\n\n"
-        "За сегодня:\n" + render_stats(today_cnt) + "\n\n"
-        "За всё время:\n" + render_stats(all_cnt)
+        "За сегодня:\n" + render_stats(cnt["today"]) + "\n\n"
+        "За всё время:\n" + render_stats(cnt["all"])
     )
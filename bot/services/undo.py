@@ -1,4 +1,7 @@
+import heapq
+import itertools
 import math
+import os
 import time
 import asyncio
 from contextlib import suppress
@@ -8,6 +11,9 @@ from aiogram import Bot
 from aiogram.exceptions import TelegramBadRequest
 
 UNDO_DEADLINE_SEC = 10
+# как часто перерисовывать счётчик на кнопке «Вернуть»: правок на одно удаление
+# ≈ UNDO_DEADLINE_SEC / UNDO_TICK_SEC, а не раз в секунду
+UNDO_TICK_SEC = max(1, int(os.getenv("UNDO_TICK_SEC", "5")))
 UNDO_BIN: Dict[Tuple[int, int], dict] = {}
 
 def remember_deleted(*, user_id: int, order_id: int, item: dict,
@@ -39,35 +45,88 @@ def seconds_left(rec: dict) -> int:
     return max(0, math.ceil(rec["deadline"] - time.monotonic()))
 
 
-def start_undo_countdown(bot: Bot, key: Tuple[int, int]) -> None:
-    """Запускает фоновой отсчёт для конкретного сообщения."""
-    asyncio.create_task(_countdown_loop(bot, key))
+class UndoScheduler:
+    """Один таймер на все отложенные удаления.
+
+    В куче лежат события (время, seq, вид, ключ, запись, бот): «tick» — перерисовать
+    счётчик, «expire» — удалить навсегда. Задача спит до ближайшего события;
+    все события, наступившие к пробуждению, обрабатываются одной пачкой.
+    Отменённые (undo) записи не вынимаются из кучи — их пропускаем при срабатывании.
+    """
 
+    def __init__(self) -> None:
+        self._heap: list[tuple[float, int, str, Tuple[int, int], dict, Bot]] = []
+        self._seq = itertools.count()
+        self._changed: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._inflight: set[asyncio.Task] = set()
 
-async def _countdown_loop(bot: Bot, key: Tuple[int, int]) -> None:
-    last_shown = None
-    while True:
+    def schedule(self, bot: Bot, key: Tuple[int, int]) -> None:
         rec = UNDO_BIN.get(key)
         if not rec:
             return
-        left = seconds_left(rec)
-        if left <= 0:
-            break
-        if left != last_shown:
-            with suppress(TelegramBadRequest):
-                await bot.edit_message_reply_markup(
-                chat_id=rec["chat_id"],
-                message_id=rec["message_id"],
-                reply_markup=undo_delete_kb(rec["order_id"], seconds_left=left),
-            )
-            last_shown = left
-
-        await asyncio.sleep(0.2)
-
-    rec = UNDO_BIN.pop(key, None)
-    if not rec:
-        return
+        deadline = rec["deadline"]
+        now = time.monotonic()
+        for left in range(UNDO_TICK_SEC, UNDO_DEADLINE_SEC, UNDO_TICK_SEC):
+            when = deadline - left
+            if when > now:
+                heapq.heappush(self._heap, (when, next(self._seq), "tick", key, rec, bot))
+        heapq.heappush(self._heap, (deadline, next(self._seq), "expire", key, rec, bot))
+        self._ensure_running()
+
+    def _ensure_running(self) -> None:
+        if self._task is None or self._task.done():
+            self._changed = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        else:
+            self._changed.set()
+
+    async def _run(self) -> None:
+        while self._heap:
+            self._changed.clear()
+            delay = self._heap[0][0] - time.monotonic()
+            if delay > 0:
+                # новое событие может оказаться раньше текущего — тогда просыпаемся по сигналу
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._changed.wait(), timeout=delay)
+                continue
+
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, kind, key, rec, bot = heapq.heappop(self._heap)
+                if UNDO_BIN.get(key) is not rec:
+                    continue
+                if kind == "tick":
+                    self._spawn(_show_left(bot, rec))
+                else:
+                    UNDO_BIN.pop(key, None)
+                    self._spawn(_finalize(bot, rec))
+
+    def _spawn(self, coro) -> None:
+        # правки в Telegram не держат таймер: медленный ответ API не сдвигает чужие дедлайны
+        task = asyncio.create_task(coro)
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+
+SCHEDULER = UndoScheduler()
+
+
+def start_undo_countdown(bot: Bot, key: Tuple[int, int]) -> None:
+    """Ставит удаление в общий планировщик: обновление счётчика и финальное удаление."""
+    SCHEDULER.schedule(bot, key)
+
+
+async def _show_left(bot: Bot, rec: dict) -> None:
+    with suppress(TelegramBadRequest):
+        await bot.edit_message_reply_markup(
+            chat_id=rec["chat_id"],
+            message_id=rec["message_id"],
+            reply_markup=undo_delete_kb(rec["order_id"], seconds_left=seconds_left(rec)),
+        )
 
+
+async def _finalize(bot: Bot, rec: dict) -> None:
     with suppress(TelegramBadRequest):
         await bot.edit_message_reply_markup(
             chat_id=rec["chat_id"],
@@ -80,4 +139,4 @@ async def _countdown_loop(bot: Bot, key: Tuple[int, int]) -> None:
             message_id=rec["message_id"],
             text=f"🗑 Заказ #{rec['order_id']} удалён навсегда.",
             disable_web_page_preview=True,
-        )
\ No newline at end of file
+        )
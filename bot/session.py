@@ -0,0 +1,67 @@
+"""Сессия Bot API с кэшем сериализованной разметки клавиатур.
+
+AiohttpSession на каждый запрос делает model_dump всего метода и заново собирает
+JSON reply_markup. Клавиатуры из keyboards.py — одни и те же неизменяемые объекты,
+поэтому их JSON считается один раз на объект. Ключ — id объекта; запись держит
+сам объект, так что id не переиспользуется, пока запись жива. Кэшируются только
+разметки из кэшей keyboards.py (is_shared): одноразовые (курсор истории, таймер
+undo) больше не придут и лишь вытесняли бы общие.
+"""
+import os
+from collections import OrderedDict
+from typing import Any, Dict
+
+from aiohttp import FormData
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import (ForceReply, InlineKeyboardMarkup, InputFile, ReplyKeyboardMarkup,
+                           ReplyKeyboardRemove)
+
+from .keyboards import is_shared
+
+MARKUP_JSON_CACHE_SIZE = int(os.getenv("MARKUP_JSON_CACHE_SIZE", "2048"))
+
+_MARKUPS = (InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove, ForceReply)
+
+
+class MarkupCachingSession(AiohttpSession):
+    def __init__(self, *args: Any, markup_cache_size: int = MARKUP_JSON_CACHE_SIZE, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.markup_cache_size = markup_cache_size
+        self._markup_json: OrderedDict[int, tuple[Any, str]] = OrderedDict()
+        self.markup_hits = 0
+        self.markup_misses = 0
+
+    def markup_json(self, markup: Any, bot: Bot) -> str:
+        if not is_shared(markup):
+            return self.prepare_value(markup.model_dump(warnings=False), bot=bot, files={})
+        item = self._markup_json.get(id(markup))
+        if item is not None and item[0] is markup:
+            self._markup_json.move_to_end(id(markup))
+            self.markup_hits += 1
+            return item[1]
+        self.markup_misses += 1
+        value = self.prepare_value(markup.model_dump(warnings=False), bot=bot, files={})
+        self._markup_json[id(markup)] = (markup, value)
+        if len(self._markup_json) > self.markup_cache_size:
+            self._markup_json.popitem(last=False)
+        return value
+
+    def build_form_data(self, bot: Bot, method: TelegramMethod[Any]) -> FormData:
+        markup = getattr(method, "reply_markup", None)
+        if not isinstance(markup, _MARKUPS):
+            return super().build_form_data(bot, method)
+
+        # тот же порядок, что в AiohttpSession.build_form_data (aiogram 3.12), но разметка — из кэша
+        form = FormData(quote_fields=False)
+        files: Dict[str, InputFile] = {}
+        for key, value in method.model_dump(warnings=False, exclude={"reply_markup"}).items():
+            value = self.prepare_value(value, bot=bot, files=files)
+            if not value:
+                continue
+            form.add_field(key, value)
+        form.add_field("reply_markup", self.markup_json(markup, bot))
+        for key, value in files.items():
+            form.add_field(key, value.read(bot), filename=value.filename or key)
+        return form
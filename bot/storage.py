@@ -1,27 +1,279 @@
 import json
+import logging
+import os
+import re
+import threading
+from collections import Counter
 from datetime import datetime
 from json import JSONDecodeError
-ORDERS_JSON = "orders.json"
+from typing import Iterator
 
-def read_orders_json() -> list:
+log = logging.getLogger("storage")
+
+ORDERS_JSON = "orders.json"      # старый формат: один JSON-массив, переписывался целиком
+ORDERS_LOG = "orders.jsonl"      # одна запись — одна строка, только дописываем
+ORDERS_LOG_ID = ORDERS_LOG + ".id"
+# счётчики (день, напиток) по логу до смещения offset — /stats дочитывает только дописанное
+ORDERS_LOG_DAYS = ORDERS_LOG + ".days"
+# после стольких дописываний лог переписывается начисто (битые строки, дубли id)
+ORDERS_COMPACT_EVERY = int(os.getenv("ORDERS_COMPACT_EVERY", "10000"))
+
+_lock = threading.Lock()
+_last_id: dict[str, int] = {}   # путь лога → последний выданный id
+_appends = 0
+
+
+def _tail_id() -> int:
+    """id последней целой записи лога: читаем только хвост файла."""
+    try:
+        with open(ORDERS_LOG, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            chunk = 4096
+            while True:
+                start = max(0, size - chunk)
+                f.seek(start)
+                lines = f.read(size - start).splitlines()
+                # первая строка окна может быть обрезана — её не трогаем, пока есть файл левее
+                for line in reversed(lines[1:] if start else lines):
+                    try:
+                        return int(json.loads(line)["id"])
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                if not start:
+                    return 0
+                chunk *= 4
+    except FileNotFoundError:
+        return 0
+
+
+def _load_last_id() -> int:
+    try:
+        with open(ORDERS_LOG_ID, "r", encoding="utf-8") as f:
+            sidecar = int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        sidecar = 0
+    # счётчик пишется после записи в лог: при падении между ними верим логу
+    return max(sidecar, _tail_id())
+
+
+def _write_last_id(value: int) -> None:
+    tmp = ORDERS_LOG_ID + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(str(value))
+    os.replace(tmp, ORDERS_LOG_ID)
+
+
+def _migrate_legacy() -> None:
+    if os.path.exists(ORDERS_LOG) or not os.path.exists(ORDERS_JSON):
+        return
     try:
         with open(ORDERS_JSON, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except (FileNotFoundError, JSONDecodeError):
-        return []
-def write_orders_json(items: list) -> None:
-    with open(ORDERS_JSON, "w", encoding="utf-8") as f:
-        json.dump(items, f, ensure_ascii=False, indent=2) # type: ignore[arg-type]
-def save_order_json(data: dict) -> int:
-    items = read_orders_json()
-    new_id = max([it.get("id", 0) for it in items], default=0) + 1
-    record = {
-        "id": new_id,
-        "ts": datetime.now().isoformat(timespec="seconds"),
-        "drink": data["drink"],
-        "size": data["size"],
-        "milk": data["milk"],
-    }
-    items.append(record)
+            items = json.load(f)
+    except JSONDecodeError:
+        log.warning("%s повреждён, миграция пропущена", ORDERS_JSON)
+        return
     write_orders_json(items)
-    return new_id
\ No newline at end of file
+    os.replace(ORDERS_JSON, ORDERS_JSON + ".bak")
+    log.info("%s → %s: %s записей", ORDERS_JSON, ORDERS_LOG, len(items))
+
+
+def iter_orders_json() -> Iterator[dict]:
+    """Потоково отдаёт записи лога. Недописанную (битую) строку пропускает."""
+    _migrate_legacy()
+    try:
+        f = open(ORDERS_LOG, "r", encoding="utf-8")
+    except FileNotFoundError:
+        return
+    with f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except JSONDecodeError:
+                log.warning("skip torn line in %s", ORDERS_LOG)
+
+
+# проекция (дата, напиток) прямо из байтов лога — без json.loads на каждую запись.
+# Строки пишет save_order_json, порядок ключей фиксирован: id, ts, drink, ...
+_DAY_DRINK_RE = re.compile(rb'"ts": "(.{10})[^"]*", "drink": "([^"\\]*)"')
+
+
+def _day_drink_pairs(buf: bytes, end: int) -> list[tuple[bytes, bytes]]:
+    pairs = _DAY_DRINK_RE.findall(buf, 0, end)
+    if len(pairs) == buf.count(b"\n", 0, end) + (buf[end - 1] != 0x0A):
+        return pairs
+    # в куске есть строки другого вида (старый формат, экранирование, битая строка)
+    pairs = []
+    for line in buf[:end].splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            o = json.loads(line)
+        except (JSONDecodeError, UnicodeDecodeError):
+            log.warning("skip torn line in %s", ORDERS_LOG)
+            continue
+        pairs.append((o["ts"][:10].encode(), o["drink"].encode()))
+    return pairs
+
+
+def iter_day_drink_batches(chunk_size: int = 1 << 20) -> Iterator[list[tuple[bytes, bytes]]]:
+    """Потоково отдаёт пачки пар (b"YYYY-MM-DD", напиток в utf-8) — для агрегатов по логу.
+
+    Байты не декодируются: пар много, различных — единицы; декодировать стоит ключи агрегата.
+    """
+    _migrate_legacy()
+    try:
+        f = open(ORDERS_LOG, "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        tail = b""
+        while True:
+            chunk = f.read(chunk_size)
+            buf = tail + chunk if tail else chunk
+            # режем по последнему \n; в конце файла берём и строку без него
+            cut = buf.rfind(b"\n") + 1 if chunk else len(buf)
+            tail = buf[cut:]
+            if cut:
+                yield _day_drink_pairs(buf, cut)
+            if not chunk:
+                break
+
+
+def _load_days() -> tuple[Counter, int, int | None]:
+    try:
+        with open(ORDERS_LOG_DAYS, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        counts = Counter({(day, drink): n for day, drink, n in data["counts"]})
+        return counts, int(data["offset"]), data["ino"]
+    except (FileNotFoundError, JSONDecodeError, KeyError, TypeError, ValueError):
+        return Counter(), 0, None
+
+
+def _save_days(counts: Counter, offset: int, ino: int) -> None:
+    tmp = ORDERS_LOG_DAYS + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"ino": ino, "offset": offset,
+                   "counts": [[day, drink, n] for (day, drink), n in counts.items()]}, f, ensure_ascii=False)
+    os.replace(tmp, ORDERS_LOG_DAYS)
+
+
+def day_drink_counts(chunk_size: int = 1 << 20) -> Counter:
+    """Counter((«YYYY-MM-DD», напиток) → заказов) по всему логу.
+
+    Счётчики и смещение, до которого лог учтён, лежат в ORDERS_LOG_DAYS: лог только
+    дописывается, так что каждый вызов читает лишь новые целые строки. Лог, переписанный
+    целиком (write_orders_json, другой inode), считается заново.
+    """
+    _migrate_legacy()
+    try:
+        f = open(ORDERS_LOG, "rb")
+    except FileNotFoundError:
+        return Counter()
+    with f:
+        st = os.fstat(f.fileno())
+        counts, offset, ino = _load_days()
+        if ino != st.st_ino or offset > st.st_size:
+            counts, offset = Counter(), 0
+        start = offset
+        f.seek(offset)
+        raw: Counter = Counter()
+        tail = b""
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            buf = tail + chunk if tail else chunk
+            # недописанная последняя строка ждёт следующего вызова
+            cut = buf.rfind(b"\n") + 1
+            tail = buf[cut:]
+            if cut:
+                raw.update(_day_drink_pairs(buf, cut))
+                offset += cut
+    for (day, drink), n in raw.items():
+        counts[day.decode(), drink.decode()] += n
+    if offset != start:
+        with _lock:
+            # пока читали, лог могли переписать — тогда эти счётчики уже не про него
+            try:
+                if os.stat(ORDERS_LOG).st_ino == st.st_ino:
+                    _save_days(counts, offset, st.st_ino)
+            except OSError as e:
+                log.warning("cannot save %s: %s", ORDERS_LOG_DAYS, e)
+    return counts
+
+
+def read_orders_json() -> list:
+    return list(iter_orders_json())
+
+
+def write_orders_json(items) -> None:
+    """Атомарно переписывает лог целиком (миграция, компакция)."""
+    tmp = ORDERS_LOG + ".tmp"
+    last = 0
+    with open(tmp, "w", encoding="utf-8") as f:
+        for it in items:
+            f.write(json.dumps(it, ensure_ascii=False) + "\n")
+            last = max(last, int(it.get("id", 0)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, ORDERS_LOG)
+    _write_last_id(last)
+    # номер inode старого лога может достаться следующему — счётчики сбрасываем явно
+    try:
+        os.remove(ORDERS_LOG_DAYS)
+    except FileNotFoundError:
+        pass
+
+
+def compact_orders_log() -> None:
+    """Убирает битые строки и повторы id (остаётся первая запись)."""
+    with _lock:
+        seen: set[int] = set()
+
+        def unique():
+            for it in iter_orders_json():
+                if it.get("id") not in seen:
+                    seen.add(it.get("id"))
+                    yield it
+
+        write_orders_json(unique())
+
+
+def save_order_json(data: dict) -> int:
+    global _appends
+    with _lock:
+        _migrate_legacy()
+        if ORDERS_LOG not in _last_id:
+            _last_id[ORDERS_LOG] = _load_last_id()
+        new_id = _last_id[ORDERS_LOG] + 1
+        record = {
+            "id": new_id,
+            "ts": datetime.now().isoformat(timespec="seconds"),
+            "drink": data["drink"],
+            "size": data["size"],
+            "milk": data["milk"],
+        }
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with open(ORDERS_LOG, "a+b") as f:
+            # хвост от упавшей записи без \n — начинаем с новой строки, чтобы не склеиться с ним
+            if f.tell():
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    line = "\n" + line
+            f.write(line.encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        _last_id[ORDERS_LOG] = new_id
+        _write_last_id(new_id)
+        _appends += 1
+        compact = _appends >= ORDERS_COMPACT_EVERY
+        if compact:
+            _appends = 0
+    if compact:
+        compact_orders_log()
+    return new_id
@@ -0,0 +1 @@
+"""Служебные команды: python -m bot.tools.<имя>."""
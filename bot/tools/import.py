@@ -0,0 +1,490 @@
+"""Массовая загрузка истории заказов (POS, старый JSON-лог) в orders.
+
+    python -m bot.tools.import history.csv --user-id 1
+    python -m bot.tools.import bot/orders.json --user-id 1628698929 --tz Europe/Moscow
+
+Форматы — по расширению или --format:
+- csv   — строка заголовка обязательна; колонки как в /export (created_at, drink, size,
+          milk, total в рублях) и необязательные user_id, chat_id, deleted_at, locale;
+- jsonl — объект на строку с теми же полями, total — в копейках, как в orders.total;
+          сюда же — orders.jsonl из bot/storage.py (ts вместо created_at);
+- json  — JSON-массив, старый orders.json из bot/storage.py; читается потоково.
+Время — epoch или ISO 8601, без пояса — в --tz. id из файла не переносится,
+напиток/размер/молоко сверяются с catalog (подписи и синонимы тоже принимаются).
+
+Вся загрузка — одна транзакция: на время неё снимаются триггеры агрегатов и
+(по умолчанию) вторичные индексы orders, строки идут executemany пачками по --batch,
+пока следующая пачка разбирается. В конце индексы строятся заново, в агрегаты
+вливаются суммы, собранные при разборе (прочие бэкфиллы из bot/migrations.py
+досчитываются по новым id), триггеры возвращаются — всё в той же транзакции, так что
+упавшая загрузка не оставляет ничего. Читатели бота всё это время видят прежние данные, запись ждёт; бот лучше остановить.
+"""
+import argparse
+import asyncio
+import csv
+import gc
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from operator import itemgetter
+from pathlib import Path
+from typing import Any, Iterator, NamedTuple
+from zoneinfo import ZoneInfo
+
+import aiosqlite
+
+from .. import db, migrations
+from ..catalog import match_drink, match_milk, match_size
+from ..utils import TZ
+
+IMPORT_BATCH = max(1, int(os.getenv("IMPORT_BATCH", "50000")))
+# кэш страниц соединения загрузки, МБ
+IMPORT_CACHE_MB = int(os.getenv("IMPORT_CACHE_MB", "256"))
+# сколько отклонённых строк показать в отчёте
+MAX_SHOWN_ERRORS = 10
+
+FORMATS = ("csv", "jsonl", "json")
+
+INSERT_SQL = (
+    "INSERT INTO orders(user_id, chat_id, drink, size, milk, created_at, deleted_at, locale, total) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+class ImportStats(NamedTuple):
+    read: int
+    imported: int
+    rejected: int
+    errors: list[tuple[int, str]]   # (строка/запись, причина) — первые MAX_SHOWN_ERRORS
+    phases: dict[str, float]        # этап → секунды
+
+    @property
+    def seconds(self) -> float:
+        return sum(self.phases.values())
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.imported / self.seconds if self.seconds else 0.0
+
+
+# ---------- чтение ----------
+
+# поля записи в порядке, в котором их ждёт Converter
+FIELDS = ("drink", "size", "milk", "created_at", "user_id", "chat_id", "deleted_at", "locale", "total")
+
+
+def detect_format(path: Path) -> str:
+    ext = path.suffix.lower().lstrip(".")
+    if ext not in FORMATS:
+        raise ValueError(f"не знаю формат {path.name}, укажите --format {{{','.join(FORMATS)}}}")
+    return ext
+
+
+def _iter_csv(f) -> Iterator[tuple[int, Any]]:
+    reader = csv.reader(f)
+    header = [h.strip().lower() for h in next(reader, [])]
+    if "created_at" not in header and "ts" in header:
+        header[header.index("ts")] = "created_at"
+    width = len(header)
+    # отсутствующая колонка читается из пустой ячейки, дописанной в конец строки
+    pick = itemgetter(*(header.index(k) if k in header else width for k in FIELDS))
+    for row in reader:
+        if len(row) != width:
+            if row:
+                yield reader.line_num, ValueError(f"{len(row)} колонок вместо {width}")
+            continue
+        row.append("")
+        yield reader.line_num, pick(row)
+
+
+def _fields(rec: Any) -> Any:
+    if not isinstance(rec, dict):
+        return ValueError("запись — не объект")
+    fields = tuple(map(rec.get, FIELDS))
+    return fields if fields[3] or "ts" not in rec else fields[:3] + (rec["ts"],) + fields[4:]
+
+
+def _iter_jsonl(f) -> Iterator[tuple[int, Any]]:
+    for no, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield no, _fields(json.loads(line))
+        except json.JSONDecodeError as e:
+            yield no, ValueError(f"не JSON: {e}")
+
+
+def _iter_json_array(f, chunk_size: int = 1 << 20) -> Iterator[tuple[int, Any]]:
+    """Элементы JSON-массива по одному, не загружая файл целиком."""
+    decode = json.JSONDecoder().raw_decode
+    buf = f.read(chunk_size).lstrip()
+    if not buf.startswith("["):
+        raise ValueError("ожидался JSON-массив")
+    pos, no = 1, 0
+    eof = False
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buf) and buf[pos] == "]":
+            return
+        try:
+            item, end = decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            more = f.read(chunk_size)
+            eof = not more
+            buf = buf[pos:] + more
+            pos = 0
+            continue
+        no += 1
+        yield no, _fields(item)
+        pos = end
+        if pos > chunk_size:
+            buf, pos = buf[pos:], 0
+
+
+def iter_records(path: Path, fmt: str) -> Iterator[tuple[int, Any]]:
+    """(номер строки или записи, значения FIELDS) — или ValueError, если запись не разобрать."""
+    with open(path, "r", encoding="utf-8", newline="" if fmt == "csv" else None) as f:
+        if fmt == "csv":
+            yield from _iter_csv(f)
+        elif fmt == "jsonl":
+            yield from _iter_jsonl(f)
+        else:
+            yield from _iter_json_array(f)
+
+
+# ---------- разбор записи ----------
+
+class _Clock:
+    """epoch / ISO 8601 → epoch. Начало часа кэшируется по «дата, час, пояс»:
+    записи за один час различаются только минутами и секундами."""
+
+    def __init__(self, tz: str):
+        self.tz = ZoneInfo(tz)
+        self._hours: dict[str, int] = {}
+
+    def __call__(self, value: Any) -> int:
+        if type(value) is str and len(value) >= 19:
+            hour = self._hours.get(value[:13] + value[19:])
+            if hour is not None:
+                return hour + int(value[14:16]) * 60 + int(value[17:19])
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return int(value)
+        s = str(value).strip()
+        if s.isdigit():
+            return int(s)
+        dt = datetime.fromisoformat(s)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=self.tz)
+        # с долями секунды не кэшируем: ключей стало бы столько же, сколько строк
+        if len(s) == 19 or len(s) > 19 and s[19] in "+-Z":
+            self._hours[s[:13] + s[19:]] = int(dt.replace(minute=0, second=0).timestamp())
+        return int(dt.timestamp())
+
+
+def _code(memo: dict, match, value: Any, what: str) -> str:
+    """Код варианта из catalog; разных написаний в файле единицы — запоминаем."""
+    code = memo.get(value)
+    if code is None:
+        code = match(value if isinstance(value, str) else None)
+        if code is None:
+            raise ValueError(f"неизвестный {what} {value!r}")
+        memo[value] = code
+    return code
+
+
+class Converter:
+    """Значения FIELDS → кортеж для INSERT_SQL; ValueError с причиной — строка отклоняется."""
+
+    def __init__(self, fmt: str, *, user_id: int | None, chat_id: int | None, tz: str):
+        self.fmt = fmt
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.clock = _Clock(tz)
+        self._drinks: dict[Any, str] = {}
+        self._sizes: dict[Any, str] = {}
+        self._milks: dict[Any, str] = {}
+
+    def _total(self, value: Any) -> int | None:
+        if value is None or value == "":
+            return None
+        if self.fmt == "csv":
+            return round(float(value) * 100)  # рубли, как в /export
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ValueError(f"total {value!r}: ожидались копейки целым числом")
+        return value
+
+    def __call__(self, fields: Any) -> tuple:
+        if isinstance(fields, Exception):
+            raise fields
+        drink, size, milk, created, user_id, chat_id, deleted, locale, total = fields
+        drink = _code(self._drinks, match_drink, drink, "напиток")
+        size = _code(self._sizes, match_size, size, "размер")
+        milk = _code(self._milks, match_milk, milk, "вариант milk")
+        if not created:
+            raise ValueError("нет created_at / ts")
+        user_id = int(user_id or self.user_id or 0)
+        if not user_id:
+            raise ValueError("нет user_id (для файлов без него — --user-id)")
+        return (
+            user_id, int(chat_id or self.chat_id or user_id), drink, size, milk, self.clock(created),
+            self.clock(deleted) if deleted else None, locale or None, self._total(total),
+        )
+
+
+# ---------- агрегаты ----------
+
+class _Rollups:
+    """Агрегаты по загружаемым строкам, в том же проходе, что и разбор.
+
+    GROUP BY по миллионам свежих строк — это сортировка каждой из них, а здесь строки
+    и так проходят через Python по одной. В таблицы суммы вливаются теми же upsert'ами,
+    что делают триггеры (bot/migrations.py). Бэкфиллы не из NAMES досчитываются
+    своим SQL по диапазону новых id.
+    """
+
+    NAMES = frozenset({"order_daily_counts", "order_totals", "order_rollups"})
+
+    def __init__(self):
+        self.live = self.deleted = 0
+        self.daily: dict[tuple[int, int, str], int] = {}
+        self.hourly: dict[int, list[int]] = {}                        # час → [orders, revenue, priced]
+        self.mix: dict[tuple[int, str, str, str], list[int]] = {}    # (день, drink, size, milk) → [orders, revenue]
+        self.first: dict[int, int] = {}
+
+    def add(self, row: tuple) -> None:
+        user_id, _, drink, size, milk, ts, deleted, _, total = row
+        first = self.first.get(user_id)
+        if first is None or ts < first:
+            self.first[user_id] = ts
+        if deleted is not None:
+            self.deleted += 1
+            return
+        self.live += 1
+        day = ts // 86400
+        key = (user_id, day, drink)
+        self.daily[key] = self.daily.get(key, 0) + 1
+        hour = self.hourly.get(ts // 3600)
+        if hour is None:
+            hour = self.hourly[ts // 3600] = [0, 0, 0]
+        mix = self.mix.get((day, drink, size, milk))
+        if mix is None:
+            mix = self.mix[day, drink, size, milk] = [0, 0]
+        hour[0] += 1
+        mix[0] += 1
+        if total is not None:
+            hour[1] += total
+            hour[2] += 1
+            mix[1] += total
+
+    def _mix_rows(self) -> Iterator[tuple]:
+        per_dim: dict[tuple[int, str, str], list[int]] = {}
+        for (day, drink, size, milk), (n, revenue) in self.mix.items():
+            for dim, value in (("drink", drink), ("size", size), ("milk", milk)):
+                acc = per_dim.get((day, dim, value))
+                if acc is None:
+                    per_dim[day, dim, value] = [n, revenue]
+                else:
+                    acc[0] += n
+                    acc[1] += revenue
+        return ((*key, n, revenue) for key, (n, revenue) in per_dim.items())
+
+    async def flush(self, conn: aiosqlite.Connection) -> None:
+        await conn.executemany(
+            "INSERT INTO order_daily_counts(user_id, day, drink, cnt) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(user_id, day, drink) DO UPDATE SET cnt = cnt + excluded.cnt",
+            ((*key, n) for key, n in self.daily.items()),
+        )
+        await conn.execute("UPDATE order_totals SET live = live + ?, deleted = deleted + ? WHERE id = 1",
+                           (self.live, self.deleted))
+        await conn.executemany(
+            "INSERT INTO order_hourly(hour, orders, revenue, priced) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(hour) DO UPDATE SET orders = orders + excluded.orders, "
+            "revenue = revenue + excluded.revenue, priced = priced + excluded.priced",
+            ((hour, *acc) for hour, acc in self.hourly.items()),
+        )
+        await conn.executemany(
+            "INSERT INTO order_mix_daily(day, dim, value, orders, revenue) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(day, dim, value) DO UPDATE SET orders = orders + excluded.orders, "
+            "revenue = revenue + excluded.revenue",
+            self._mix_rows(),
+        )
+        await conn.executemany(
+            "INSERT INTO order_customers(user_id, first_at) VALUES (?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET first_at = MIN(first_at, excluded.first_at)",
+            self.first.items(),
+        )
+
+
+# ---------- загрузка ----------
+
+async def _schema_of(conn: aiosqlite.Connection, kind: str) -> list[tuple[str, str]]:
+    # sql IS NULL — автоиндексы PRIMARY KEY/UNIQUE, их не трогаем
+    return list(await conn.execute_fetchall(
+        "SELECT name, sql FROM sqlite_master WHERE type = ? AND tbl_name = 'orders' AND sql IS NOT NULL",
+        (kind,),
+    ))
+
+
+async def _set_pragmas(conn: aiosqlite.Connection, values: dict[str, Any]) -> dict[str, Any]:
+    old = {}
+    for name, value in values.items():
+        (old[name],) = (await conn.execute_fetchall(f"PRAGMA {name}"))[0]
+        await conn.execute(f"PRAGMA {name} = {value}")
+    return old
+
+
+async def load(
+    path: Path,
+    *,
+    fmt: str | None = None,
+    user_id: int | None = None,
+    chat_id: int | None = None,
+    tz: str = TZ,
+    batch: int = IMPORT_BATCH,
+    rebuild_indexes: bool = True,
+    dry_run: bool = False,
+) -> ImportStats:
+    """Загружает файл в orders по db.DB_PATH (схема создаётся/мигрирует, если нужно)."""
+    fmt = fmt or detect_format(path)
+    convert = Converter(fmt, user_id=user_id, chat_id=chat_id, tz=tz)
+    rollups = _Rollups()
+    phases: dict[str, float] = {}
+    errors: list[tuple[int, str]] = []
+    read = rejected = 0
+
+    await db.init_db()
+    # циклический GC на миллионах живых кортежей и ключей агрегатов только тратит время
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    # autocommit: транзакцией управляем сами
+    conn = await aiosqlite.connect(db.DB_PATH, isolation_level=None)
+    old_pragmas = await _set_pragmas(conn, {
+        "synchronous": "OFF", "cache_size": -IMPORT_CACHE_MB * 1024, "temp_store": "MEMORY",
+    })
+    try:
+        await conn.execute("BEGIN IMMEDIATE")
+        try:
+            id_before = (await conn.execute_fetchall("SELECT COALESCE(MAX(id), 0) FROM orders"))[0][0]
+            triggers = await _schema_of(conn, "trigger")
+            indexes = await _schema_of(conn, "index") if rebuild_indexes else []
+            for name, _ in triggers:
+                await conn.execute(f'DROP TRIGGER "{name}"')
+            for name, _ in indexes:
+                await conn.execute(f'DROP INDEX "{name}"')
+
+            # разбор следующей пачки идёт, пока предыдущая вставляется в потоке aiosqlite
+            started = time.perf_counter()
+            pending: asyncio.Future | None = None
+            rows: list[tuple] = []
+            for no, rec in iter_records(path, fmt):
+                read += 1
+                try:
+                    row = convert(rec)
+                except (ValueError, TypeError) as e:
+                    rejected += 1
+                    if len(errors) < MAX_SHOWN_ERRORS:
+                        errors.append((no, str(e)))
+                    continue
+                rows.append(row)
+                rollups.add(row)
+                if len(rows) >= batch:
+                    if pending is not None:
+                        await pending
+                    pending = asyncio.ensure_future(conn.executemany(INSERT_SQL, rows))
+                    rows = []
+                    await asyncio.sleep(0)  # отдать задачу aiosqlite в очередь сразу
+            if pending is not None:
+                await pending
+            if rows:
+                await conn.executemany(INSERT_SQL, rows)
+            phases["load"] = time.perf_counter() - started
+            id_after = (await conn.execute_fetchall("SELECT COALESCE(MAX(id), 0) FROM orders"))[0][0]
+
+            started = time.perf_counter()
+            for _, sql in indexes:
+                await conn.execute(sql)
+            phases["indexes"] = time.perf_counter() - started
+
+            # агрегаты по новым id (id_before, id_after]
+            started = time.perf_counter()
+            await rollups.flush(conn)
+            for backfill in migrations.BACKFILLS.values():
+                if backfill.name in _Rollups.NAMES:
+                    continue
+                chunk_sql = backfill.chunk_sql
+                for sql in (chunk_sql,) if isinstance(chunk_sql, str) else chunk_sql:
+                    await conn.execute(sql, (id_before, id_after))
+            for _, sql in triggers:
+                await conn.execute(sql)
+            phases["aggregates"] = time.perf_counter() - started
+
+            await conn.execute("ROLLBACK" if dry_run else "COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                await conn.execute("ROLLBACK")
+            raise
+
+        if not dry_run:
+            started = time.perf_counter()
+            await conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            await conn.execute("PRAGMA optimize")
+            phases["checkpoint"] = time.perf_counter() - started
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+        await _set_pragmas(conn, old_pragmas)
+        await conn.close()
+
+    return ImportStats(read, read - rejected, rejected, errors, phases)
+
+
+def render_stats(stats: ImportStats, *, dry_run: bool = False) -> str:
+    lines = [
+        f"{'Проверено' if dry_run else 'Загружено'}: {stats.imported} из {stats.read}, "
+        f"отклонено: {stats.rejected}",
+        f"Время: {stats.seconds:.2f} с · {stats.rows_per_sec:,.0f} строк/с".replace(",", " "),
+        "  " + " · ".join(f"{name} {sec:.2f} с" for name, sec in stats.phases.items()),
+    ]
+    lines += [f"  строка {no}: {reason}" for no, reason in stats.errors]
+    if stats.rejected > len(stats.errors):
+        lines.append(f"  … и ещё {stats.rejected - len(stats.errors)}")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(prog="python -m bot.tools.import",
+                                 description="Загрузка истории заказов в orders")
+    ap.add_argument("path", type=Path)
+    ap.add_argument("--format", choices=FORMATS, default=None, help="по умолчанию — по расширению")
+    ap.add_argument("--db", type=Path, default=None, help=f"по умолчанию {db.DB_PATH}")
+    ap.add_argument("--user-id", type=int, default=None, help="для записей без user_id (старый лог)")
+    ap.add_argument("--chat-id", type=int, default=None, help="для записей без chat_id; иначе = user_id")
+    ap.add_argument("--tz", default=TZ, help="пояс для времени без смещения")
+    ap.add_argument("--batch", type=int, default=IMPORT_BATCH, help="строк на один executemany")
+    ap.add_argument("--keep-indexes", action="store_true",
+                    help="не пересобирать индексы (выгоднее, если в orders уже намного больше строк, чем в файле)")
+    ap.add_argument("--dry-run", action="store_true", help="всё проделать и откатить: проверка файла и замер")
+    args = ap.parse_args()
+
+    if args.db is not None:
+        db.DB_PATH = args.db
+    try:
+        stats = asyncio.run(load(
+            args.path, fmt=args.format, user_id=args.user_id, chat_id=args.chat_id, tz=args.tz,
+            batch=max(1, args.batch), rebuild_indexes=not args.keep_indexes, dry_run=args.dry_run,
+        ))
+    except (OSError, ValueError) as e:
+        sys.exit(f"ошибка: {e}")
+    print(render_stats(stats, dry_run=args.dry_run))
+
+
+if __name__ == "__main__":
+    main()
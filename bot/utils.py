@@ -20,4 +20,10 @@ def fmt_size(num_bytes: int | float | None) -> str:
     while x >= 1024 and i < len(units) - 1:
         x /= 1024.0
         i += 1
-    return f"{x:.1f} {units[i]}"
\ No newline at end of file
+    return f"{x:.1f} {units[i]}"
+
+def fmt_money(kopecks: int | None) -> str:
+    if kopecks is None:
+        return "—"
+    rub, kop = divmod(kopecks, 100)
+    return f"{rub} ₽" if not kop else f"{rub}.{kop:02d} ₽"
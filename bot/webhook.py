@@ -0,0 +1,142 @@
+import asyncio
+import hmac
+import logging
+import os
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+log = logging.getLogger("webhook")
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")            # публичный https://host/path для setWebhook
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")     # обязателен: без него эндпоинт принял бы чужой POST
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", os.getenv("WEBHOOK_PORT", "8080")))
+# сколько апдейтов обрабатывается одновременно и сколько ждёт в очереди на каждый поток
+WEBHOOK_WORKERS = max(1, int(os.getenv("WEBHOOK_WORKERS", "16")))
+WEBHOOK_QUEUE_SIZE = max(1, int(os.getenv("WEBHOOK_QUEUE_SIZE", "256")))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def _shard_key(data: dict) -> int:
+    """Пользователь (или чат) апдейта: его апдейты идут строго по очереди — FSM-шаги не перепутаются."""
+    for value in data.values():
+        if not isinstance(value, dict):
+            continue
+        who = value.get("from") or value.get("chat") or (value.get("message") or {}).get("chat")
+        if isinstance(who, dict) and "id" in who:
+            return int(who["id"])
+    return int(data.get("update_id", 0))
+
+
+class UpdateDispatcher:
+    """Ограниченная очередь апдейтов + пул обработчиков.
+
+    Апдейты раскладываются по WEBHOOK_WORKERS шардам по пользователю: разные
+    пользователи обрабатываются параллельно, один пользователь — последовательно.
+    Переполненный шард отвечает 503, Telegram повторит доставку позже.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, *, workers: int, queue_size: int):
+        self.dp = dp
+        self.bot = bot
+        self.queues = [asyncio.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._worker(q)) for q in self.queues]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        # даём дообработать принятое, потом гасим
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self.queues)), timeout)
+        except asyncio.TimeoutError:
+            log.warning("webhook stop: queues not drained in %ss", timeout)
+        for t in self._tasks:
+            t.cancel()
+
+    def offer(self, data: dict) -> bool:
+        queue = self.queues[_shard_key(data) % len(self.queues)]
+        try:
+            queue.put_nowait(data)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            data = await queue.get()
+            try:
+                update = Update.model_validate(data, context={"bot": self.bot})
+                await self.dp.feed_update(self.bot, update)
+            except Exception:
+                log.exception("update %s failed", data.get("update_id"))
+            finally:
+                queue.task_done()
+
+
+UPDATES = web.AppKey("updates", UpdateDispatcher)
+
+
+def build_app(dp: Dispatcher, bot: Bot, *, path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET,
+              workers: int = WEBHOOK_WORKERS, queue_size: int = WEBHOOK_QUEUE_SIZE) -> web.Application:
+    if not secret:
+        raise ValueError("webhook: пустой секрет — любой POST сошёл бы за апдейт от Telegram")
+    updates = UpdateDispatcher(dp, bot, workers=workers, queue_size=queue_size)
+
+    async def handle(request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            return web.Response(status=401)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if not isinstance(data, dict):
+            return web.Response(status=400)
+        if not updates.offer(data):
+            return web.Response(status=503)
+        return web.Response()
+
+    async def on_startup(app: web.Application) -> None:
+        updates.start()
+
+    async def on_cleanup(app: web.Application) -> None:
+        await updates.stop()
+
+    app = web.Application()
+    app[UPDATES] = updates
+    app.router.add_post(path, handle)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, *, drop_pending_updates: bool = False) -> None:
+    """Поднимает aiohttp-сервер и регистрирует WEBHOOK_URL в Telegram. Работает до отмены."""
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("RUN_MODE=webhook требует WEBHOOK_SECRET")
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            drop_pending_updates=drop_pending_updates,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+    else:
+        log.warning("WEBHOOK_URL не задан: setWebhook не вызываем, ждём апдейты на %s", WEBHOOK_PATH)
+
+    # как start_polling: startup/shutdown-хуки диспетчера (в т.ч. закрытие FSM-хранилища)
+    await dp.emit_startup(bot=bot)
+    runner = web.AppRunner(build_app(dp, bot, secret=WEBHOOK_SECRET))
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    log.info("webhook listening on %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await dp.emit_shutdown(bot=bot)
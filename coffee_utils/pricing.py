@@ -0,0 +1,151 @@
+# coffee_utils/pricing.py
+"""
+Цены и скидки. Деньги — целые копейки, без float в результате.
+
+Правила компилируются один раз в таблицы:
+- базовая цена — dict (напиток, размер, молоко) → копейки (с учётом добавок);
+- время — 168 множителей «день недели × час» (все HappyHour перемножены заранее);
+- лояльность и объём — множитель по номеру заказа (индекс в списке, без поиска).
+Скидки перемножаются, как в order_utils.apply_discounts, с общим потолком.
+price_batch считает пачку одним проходом по колонкам.
+"""
+from typing import Iterable, NamedTuple, Sequence
+
+from .order_utils import apply_discounts
+
+HOUR = 3600
+DAY = 24 * HOUR
+WEEK_SLOTS = 7 * 24
+# 1970-01-01 — четверг; 0 — понедельник
+_EPOCH_WEEKDAY = 3
+
+
+class Loyalty(NamedTuple):
+    """pct% с min_orders-го заказа пользователя (order_no считается с 1)."""
+    pct: float
+    min_orders: int
+
+
+class HappyHour(NamedTuple):
+    """pct% для заказов в [start_hour, end_hour) по местному времени; start > end — через полночь,
+    weekdays — дни, в которые окно начинается."""
+    pct: float
+    start_hour: int
+    end_hour: int
+    weekdays: tuple[int, ...] = (0, 1, 2, 3, 4, 5, 6)
+
+
+class Volume(NamedTuple):
+    """pct% начиная с min_daily-го заказа пользователя за день."""
+    pct: float
+    min_daily: int
+
+
+Rule = Loyalty | HappyHour | Volume
+
+
+def _factor(pct: float) -> float:
+    """Множитель цены для скидки pct% — та же формула, что в apply_discounts."""
+    return apply_discounts({"total": 1.0}, rule=pct)
+
+
+def _count_table(rules: Iterable, threshold: str) -> list[float]:
+    """Множитель по номеру заказа: table[min(n, len - 1)]."""
+    rules = list(rules)
+    size = max((getattr(r, threshold) for r in rules), default=0) + 1
+    table = [1.0] * size
+    for r in rules:
+        for n in range(getattr(r, threshold), size):
+            table[n] *= _factor(r.pct)
+    return table
+
+
+class Pricer:
+    def __init__(
+        self,
+        prices: dict[str, dict[str, int]],
+        modifiers: dict[str, dict[str, int]] | None = None,
+        rules: Sequence[Rule] = (),
+        *,
+        utc_offset: int = 0,
+        max_discount_pct: float = 100,
+    ):
+        """
+        prices: напиток → размер → копейки;
+        modifiers: добавка → вариант → доплата (сейчас одна добавка — milk).
+        """
+        milk = (modifiers or {}).get("milk", {"yes": 0, "no": 0})
+        self._base: dict[tuple[str, str, str], int] = {
+            (drink, size, m): price + extra
+            for drink, sizes in prices.items()
+            for size, price in sizes.items()
+            for m, extra in milk.items()
+        }
+        self.utc_offset = utc_offset
+        self._floor = 1 - max_discount_pct / 100
+
+        self._slot = [1.0] * WEEK_SLOTS
+        for r in rules:
+            if isinstance(r, HappyHour):
+                hours = range(r.start_hour, r.end_hour + (24 if r.end_hour <= r.start_hour else 0))
+                for wd in r.weekdays:
+                    # часы после полуночи — уже следующий день недели
+                    for h in hours:
+                        self._slot[(wd + h // 24) % 7 * 24 + h % 24] *= _factor(r.pct)
+        self._loyalty = _count_table((r for r in rules if isinstance(r, Loyalty)), "min_orders")
+        self._volume = _count_table((r for r in rules if isinstance(r, Volume)), "min_daily")
+
+    def slot(self, ts: int) -> int:
+        t = ts + self.utc_offset
+        return (t // DAY + _EPOCH_WEEKDAY) % 7 * 24 + t // HOUR % 24
+
+    def base(self, drink: str, size: str, milk: str) -> int:
+        try:
+            return self._base[drink, size, milk]
+        except KeyError:
+            raise ValueError(f"Нет цены для {drink}/{size}/{milk}") from None
+
+    def price(self, drink: str, size: str, milk: str, ts: int, *, order_no: int = 0, nth_today: int = 0) -> int:
+        """Цена одного заказа со всеми скидками, в копейках."""
+        base = self.base(drink, size, milk)
+        loyalty, volume = self._loyalty, self._volume
+        factor = (self._slot[self.slot(ts)]
+                  * loyalty[min(order_no, len(loyalty) - 1)]
+                  * volume[min(nth_today, len(volume) - 1)])
+        return int(base * max(factor, self._floor) + 0.5)
+
+    def price_batch(
+        self,
+        drinks: Sequence[str],
+        sizes: Sequence[str],
+        milks: Sequence[str],
+        ts: Sequence[int],
+        *,
+        order_no: Sequence[int] | None = None,
+        nth_today: Sequence[int] | None = None,
+    ) -> list[int | None]:
+        """Цены пачки заказов (колонки одной длины). Неизвестный напиток/размер → None.
+
+        Без order_no / nth_today скидки за лояльность и объём не применяются.
+        """
+        base_get = self._base.get
+        slot_f, floor, off = self._slot, self._floor, self.utc_offset
+        loy, vol = self._loyalty, self._volume
+        loy_last, vol_last = len(loy) - 1, len(vol) - 1
+        n = len(drinks)
+        order_no = order_no if order_no is not None else (0,) * n
+        nth_today = nth_today if nth_today is not None else (0,) * n
+
+        out: list[int | None] = []
+        append = out.append
+        for d, s, m, t, k, q in zip(drinks, sizes, milks, ts, order_no, nth_today):
+            b = base_get((d, s, m))
+            if b is None:
+                append(None)
+                continue
+            t += off
+            f = (slot_f[(t // DAY + _EPOCH_WEEKDAY) % 7 * 24 + t // HOUR % 24]
+                 * loy[k if k < loy_last else loy_last]
+                 * vol[q if q < vol_last else vol_last])
+            append(int(b * (f if f > floor else floor) + 0.5))
+        return out
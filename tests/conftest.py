@@ -0,0 +1,24 @@
+from contextlib import asynccontextmanager
+
+import pytest
+
+from bot import db
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Временная SQLite-база вместо DB_FILE; путь — для сверки сырыми запросами."""
+    path = tmp_path / "test.sqlite3"
+    monkeypatch.setattr(db, "DB_PATH", path)
+    return path
+
+
+@asynccontextmanager
+async def opened_db():
+    """Миграции + открытое соединение на время блока; закрывается и при падении проверки."""
+    await db.init_db()
+    await db.open_db()
+    try:
+        yield
+    finally:
+        await db.close_db()
@@ -0,0 +1,192 @@
+import asyncio
+import random
+import sqlite3
+from collections import Counter
+
+import pytest
+
+from bot import db, migrations, repo
+from bot.services import analytics
+from tests.conftest import opened_db
+
+START = 1_699_833_600  # 2023-11-13 00:00 UTC, понедельник
+DRINKS = ["latte", "mocha", "americano"]
+SIZES = ["small", "medium", "large"]
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(migrations, "MIGRATION_CHUNK", 50)
+    monkeypatch.setattr(migrations, "MIGRATION_PAUSE_MS", 0)
+
+
+def _orders(path):
+    conn = sqlite3.connect(path)
+    rows = conn.execute("SELECT user_id, drink, size, milk, created_at, total, deleted_at FROM orders").fetchall()
+    conn.close()
+    return rows
+
+
+def _expected(rows, since, until, step, shift, off):
+    live = [r for r in rows if r[6] is None and since <= r[4] < until]
+    buckets = Counter()
+    revenue = Counter()
+    for _, _, _, _, ts, total, _ in live:
+        start = (ts + shift) // step * step - shift
+        buckets[start] += 1
+        revenue[start] += total or 0
+    heat = Counter((((ts + off) // 86400 + 3) % 7, (ts + off) // 3600 % 24) for *_, ts, _, _ in live)
+    mix = Counter()
+    for _, drink, size, milk, *_ in live:
+        mix["drink", drink] += 1
+        mix["size", size] += 1
+        mix["milk", milk] += 1
+    first = {}
+    for user, *_, ts, _, _ in rows:
+        first[user] = min(first.get(user, ts), ts)
+    new = sum(since <= ts < until for ts in first.values())
+    return ({s: (buckets[s], revenue[s]) for s in buckets}, dict(heat), dict(mix), new)
+
+
+async def _actual(since, until, step, shift, off):
+    buckets = await repo.order_buckets(since=since, until=until, step=step, shift=shift)
+    heat = await repo.order_heatmap(since=since, until=until, utc_offset=off)
+    mix = await repo.order_mix(since=since, until=until)
+    new = await repo.count_new_customers(since=since, until=until)
+    return ({b.start: (b.orders, b.revenue) for b in buckets}, {(wd, h): n for wd, h, n in heat},
+            {(m.dim, m.value): m.orders for m in mix}, new)
+
+
+def _ranges(rnd):
+    hour = 3600
+    out = [(0, 2_147_483_647, 86400, 0, 0), (START, START + 7 * 86400, hour, 0, 10800)]
+    for _ in range(20):
+        lo, hi = sorted(rnd.randrange(START // hour - 48, START // hour + 40 * 24) * hour for _ in range(2))
+        step = rnd.choice([hour, 86400, 7 * 86400])
+        off = rnd.choice([0, 10800, -18000])
+        out.append((lo, hi, step, off + (3 * 86400 if step > 86400 else 0), off))
+    return out
+
+
+async def _fill(rnd, n):
+    ids = []
+    for _ in range(n):
+        ids.append(await repo.create_order(
+            user_id=rnd.randrange(1, 30), chat_id=1, drink=rnd.choice(DRINKS), size=rnd.choice(SIZES),
+            milk=rnd.choice(["yes", "no"]), created_at=START + rnd.randrange(40 * 86400),
+            total=rnd.choice([None, 18000, 24000]),
+        ))
+    for oid in rnd.sample(ids, n // 5):
+        await db.get_db().execute("UPDATE orders SET deleted_at = 1 WHERE id = ?", (oid,))
+    for oid in rnd.sample(ids, n // 10):
+        await db.get_db().execute("UPDATE orders SET deleted_at = NULL WHERE id = ?", (oid,))
+    await db.get_db().execute("DELETE FROM orders WHERE id IN (?, ?)", (ids[3], ids[7]))
+    await db.get_db().commit()
+
+
+def test_rollups_match_raw_scan(db_path):
+    rnd = random.Random(11)
+
+    async def scenario():
+        async with opened_db():
+            await _fill(rnd, 400)
+            rows = _orders(db_path)
+            for rng in _ranges(rnd):
+                assert await _actual(*rng) == _expected(rows, *rng), rng
+
+    asyncio.run(scenario())
+
+
+def test_rollups_backfilled_for_existing_orders(db_path):
+    rnd = random.Random(5)
+
+    async def prepare():
+        async with opened_db():
+            await _fill(rnd, 300)
+        # база «до» миграции 5: заказы есть, срезов нет
+        conn = sqlite3.connect(db_path)
+        conn.executescript(
+            "DELETE FROM order_hourly; DELETE FROM order_mix_daily; DELETE FROM order_customers; "
+            "INSERT OR REPLACE INTO schema_backfills(name, cursor, until_id) "
+            "SELECT 'order_rollups', 0, MAX(id) FROM orders;"
+        )
+        conn.close()
+
+    async def scenario():
+        async with opened_db():
+            assert not migrations.is_done("order_rollups")
+            rows = _orders(db_path)
+            ranges = _ranges(rnd)
+            during = [await _actual(*rng) for rng in ranges]
+            await migrations.run_backfills(db.DB_PATH)
+            repo.CACHE.clear()
+            after = [await _actual(*rng) for rng in ranges]
+            return [_expected(rows, *rng) for rng in ranges], during, after
+
+    asyncio.run(prepare())
+    expected, during, after = asyncio.run(scenario())
+    assert during == expected
+    assert after == expected
+
+
+def test_report_renders(db_path, monkeypatch):
+    monkeypatch.setattr(analytics, "TZ", "UTC")
+    now = START + 2 * 86400 + 12 * 3600  # среда, 12:00
+
+    async def scenario():
+        async with opened_db():
+            await repo.create_order(user_id=1, chat_id=1, drink="latte", size="small", milk="no",
+                                    created_at=START - 10 * 86400, total=20000)
+            for h, uid in [(8, 1), (8, 2), (9, 2), (33, 3)]:
+                await repo.create_order(user_id=uid, chat_id=uid, drink="latte", size="large", milk="yes",
+                                        created_at=START + h * 3600, total=31000)
+            return await analytics.build_report("week", now=now), await analytics.build_report("today", now=now)
+
+    week, today = asyncio.run(scenario())
+    assert (week.orders, week.revenue, week.avg_check, week.new_customers) == (4, 124000, 31000, 2)
+    assert week.repeat_rate == pytest.approx(0.5)
+    assert week.heatmap[0][8] == 2 and week.heatmap[0][9] == 1 and week.heatmap[1][9] == 1
+    assert [b.orders for b in week.buckets] == [3, 1]
+    text = analytics.render_report(week)
+    assert "Заказы: <b>4</b>" in text and "1240 ₽" in text and "повторные заказы: <b>50%</b>" in text
+    assert "пн " in text and "Large 100%" in text
+    assert today.orders == 0 and "Заказов нет" in analytics.render_report(today)
+
+
+def test_concurrent_backfill_runners_apply_each_chunk_once(db_path):
+    rnd = random.Random(9)
+    tables = ["order_daily_counts", "order_totals", "order_hourly", "order_mix_daily", "order_customers"]
+
+    def dump():
+        conn = sqlite3.connect(db_path)
+        try:
+            return {t: sorted(conn.execute(f"SELECT * FROM {t}")) for t in tables}
+        finally:
+            conn.close()
+
+    async def prepare():
+        async with opened_db():
+            await _fill(rnd, 300)
+
+    def reset():
+        conn = sqlite3.connect(db_path)
+        conn.executescript(
+            "DELETE FROM order_daily_counts; DELETE FROM order_hourly; DELETE FROM order_mix_daily; "
+            "DELETE FROM order_customers; UPDATE order_totals SET live = 0, deleted = 0; "
+            "UPDATE schema_backfills SET cursor = 0, until_id = (SELECT MAX(id) FROM orders);"
+        )
+        conn.close()
+
+    async def backfill(runners):
+        await db.init_db()
+        # несколько экземпляров бота стартуют одновременно, и каждый гонит бэкфиллы
+        await asyncio.gather(*(migrations.run_backfills(db.DB_PATH) for _ in range(runners)))
+        assert migrations.is_done("order_rollups")
+
+    asyncio.run(prepare())
+    reset()
+    asyncio.run(backfill(1))
+    expected = dump()
+    reset()
+    asyncio.run(backfill(2))
+    assert dump() == expected
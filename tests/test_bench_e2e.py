@@ -0,0 +1,24 @@
+"""Дымовой прогон сквозного бенчмарка: все сценарии проходят через bot.main.dp без ошибок."""
+import argparse
+import asyncio
+
+from benchmarks import bench_e2e
+from bot import db, metrics
+
+
+def test_all_flows_run_against_dispatcher(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", tmp_path / "bench.sqlite3")
+    args = argparse.Namespace(users=2, iterations=1, history=12, api_latency_ms=0.0,
+                              scenarios=list(bench_e2e.SCENARIOS))
+    metrics.HANDLER_ERRORS.clear()
+
+    results = asyncio.run(bench_e2e.run(args))
+
+    assert set(results) == set(bench_e2e.SCENARIOS)
+    for name, r in results.items():
+        assert r["updates"] > 0, name
+        assert r["api_calls_per_update"] > 0, name
+    assert results["order"]["updates"] == 2 * 4
+    assert results["delete_undo"]["updates"] == 2 * 5
+    assert results["order"]["sql_per_update"] > 0
+    assert not metrics.HANDLER_ERRORS._values
@@ -0,0 +1,158 @@
+import asyncio
+import sqlite3
+import types
+
+import pytest
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from bot import repo
+from bot.services import broadcast
+from tests.conftest import opened_db
+
+
+@pytest.fixture(autouse=True)
+def fast_broadcast(monkeypatch):
+    monkeypatch.setattr(broadcast, "BROADCAST_RATE", 1000)
+    monkeypatch.setattr(broadcast, "BROADCAST_BATCH", 3)
+
+
+class FakeBot:
+    def __init__(self, *, blocked=(), flood_once=()):
+        self.delivered = []
+        self.admin_texts = []
+        self.blocked = set(blocked)
+        self.flood_once = set(flood_once)
+
+    async def send_message(self, chat_id, text, **kw):
+        method = SendMessage(chat_id=chat_id, text=text)
+        if chat_id in self.flood_once:
+            self.flood_once.discard(chat_id)
+            raise TelegramRetryAfter(method=method, message="flood", retry_after=0)
+        if chat_id in self.blocked:
+            raise TelegramForbiddenError(method=method, message="blocked")
+        if chat_id == 999:
+            self.admin_texts.append(text)
+        else:
+            self.delivered.append(chat_id)
+        return types.SimpleNamespace(message_id=1)
+
+    async def edit_message_text(self, text, **kw):
+        self.admin_texts.append(text)
+
+
+async def _seed(users):
+    for uid in users:
+        await repo.create_order(user_id=uid, chat_id=uid, drink="latte", size="small", milk="no")
+
+
+def test_broadcast_sends_everyone_once_and_handles_errors(db_path):
+    bot = FakeBot(blocked={4}, flood_once={2})
+
+    async def scenario():
+        async with opened_db():
+            await _seed([1, 2, 3, 4, 5, 6, 7, 1, 2])
+            total = await repo.count_users_with_orders()
+            job_id = await repo.create_broadcast(admin_chat=999, text="hi", total=total)
+            await broadcast.run_broadcast(bot, job_id)
+            return await repo.get_broadcast(job_id)
+
+    job = asyncio.run(scenario())
+    assert sorted(bot.delivered) == [1, 2, 3, 5, 6, 7]
+    assert (job.status, job.sent, job.failed, job.cursor_uid) == ("done", 6, 1, 7)
+    assert bot.admin_texts[-1].startswith("✅ Рассылка завершена")
+
+
+def test_resume_continues_after_saved_cursor(db_path):
+    bot = FakeBot()
+
+    async def scenario():
+        async with opened_db():
+            await _seed([1, 2, 3, 4, 5])
+            job_id = await repo.create_broadcast(admin_chat=999, text="hi", total=5)
+            # «упали» после первой пачки
+            await repo.save_broadcast_progress(job_id, cursor_uid=3, sent=3, failed=0)
+            assert await broadcast.resume_broadcasts(bot) == 1
+            await asyncio.gather(*broadcast._RUNNING.values())
+            return await repo.get_broadcast(job_id)
+
+    job = asyncio.run(scenario())
+    assert bot.delivered == [4, 5]
+    assert (job.status, job.sent) == ("done", 5)
+
+
+def test_two_resumers_race_for_one_job(db_path):
+    bot = FakeBot()
+
+    async def scenario():
+        async with opened_db():
+            await _seed([1, 2, 3, 4, 5, 6, 7])
+            job_id = await repo.create_broadcast(admin_chat=999, text="hi", total=7)
+            await repo.save_broadcast_progress(job_id, cursor_uid=2, sent=2, failed=0)
+            # два экземпляра бота поднялись одновременно
+            taken = await asyncio.gather(broadcast.resume_broadcasts(bot, owner="a"),
+                                         broadcast.resume_broadcasts(bot, owner="b"))
+            await asyncio.gather(*broadcast._RUNNING.values())
+            await broadcast.stop_broadcasts()
+            return taken, await repo.get_broadcast(job_id)
+
+    taken, job = asyncio.run(scenario())
+    assert sorted(taken) == [0, 1]
+    assert bot.delivered == [3, 4, 5, 6, 7]
+    assert (job.status, job.sent) == ("done", 7)
+
+
+def test_expired_lease_is_taken_over_and_old_owner_stops(db_path, monkeypatch):
+    monkeypatch.setattr(broadcast, "BROADCAST_LEASE_SEC", 1)
+    bot = FakeBot()
+
+    async def scenario():
+        async with opened_db():
+            await _seed([1, 2, 3, 4, 5])
+            job_id = await repo.create_broadcast(admin_chat=999, text="hi", total=5)
+            assert await repo.claim_broadcast(job_id, owner="dead", lease_sec=-10)
+            assert await broadcast.resume_broadcasts(bot, owner="b") == 1
+            await asyncio.gather(*broadcast._RUNNING.values())
+            # прежний владелец ожил: прогресс он уже сохранить не может
+            lost = await repo.save_broadcast_progress(job_id, cursor_uid=1, sent=1, failed=0, owner="dead")
+            return lost, await repo.get_broadcast(job_id)
+
+    lost, job = asyncio.run(scenario())
+    assert lost is False
+    assert bot.delivered == [1, 2, 3, 4, 5]
+    assert (job.status, job.cursor_uid) == ("done", 5)
+
+
+def test_stop_cancels_jobs_and_watchers_before_db_closes(db_path, caplog):
+    class SlowBot(FakeBot):
+        async def send_message(self, chat_id, text, **kw):
+            if chat_id != 999:
+                await asyncio.sleep(0.01)
+            return await super().send_message(chat_id, text, **kw)
+
+    bot = SlowBot()
+
+    async def scenario():
+        async with opened_db():
+            await _seed(list(range(1, 31)))
+            mine = await repo.create_broadcast(admin_chat=999, text="hi", total=30)
+            theirs = await repo.create_broadcast(admin_chat=999, text="hi", total=30)
+            assert await repo.claim_broadcast(theirs, owner="other", lease_sec=60)
+            assert await broadcast.resume_broadcasts(bot, owner="me") == 1
+            assert broadcast._WATCHERS
+            while len(bot.delivered) < 5:
+                await asyncio.sleep(0.01)
+            await broadcast.stop_broadcasts(owner="me")
+            assert not broadcast._RUNNING and not broadcast._WATCHERS
+
+    with caplog.at_level("ERROR", logger="broadcast"):
+        asyncio.run(scenario())
+    assert not caplog.records
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT status, owner, lease_until IS NULL, cursor_uid FROM broadcasts ORDER BY id").fetchall()
+    conn.close()
+    # своя аренда отдана — после рестарта рассылку подхватят сразу; чужая не тронута
+    (status, owner, released, cursor), theirs = rows
+    assert (status, owner, released) == ("running", None, 1)
+    assert cursor % 3 == 0 and cursor < 30
+    assert theirs[:3] == ("running", "other", 0)
@@ -0,0 +1,36 @@
+import pytest
+
+from bot import catalog, keyboards
+
+
+@pytest.mark.parametrize("text, code", [
+    ("Latte", "latte"), ("latte", "latte"), ("  LATTE ", "latte"), ("Латте", "latte"), ("лате", "latte"),
+    ("Flat White", "flat white"), ("flat   white", "flat white"), ("Флэт уайт", "flat white"),
+    ("Espresso", None), ("", None), (None, None),
+])
+def test_match_drink(text, code):
+    assert catalog.match_drink(text) == code
+
+
+def test_match_size_and_milk():
+    assert catalog.match_size("Medium") == "medium"
+    assert catalog.match_size("большой") == "large"
+    assert catalog.match_milk("Да") == "yes"
+    assert catalog.match_milk("N") == "no"
+    assert catalog.match_milk("maybe") is None
+
+
+@pytest.mark.parametrize("locale", [None, "en", "ru"])
+def test_every_keyboard_button_is_recognized(locale):
+    def labels(kb):
+        return [b.text for row in kb.keyboard for b in row
+                if b.text not in (keyboards.BTN_CANCEL, keyboards.BTN_BACK)]
+
+    assert {catalog.match_drink(t) for t in labels(keyboards.drink_kb(locale))} == set(catalog.DRINKS)
+    assert {catalog.match_size(t) for t in labels(keyboards.size_kb(locale))} == set(catalog.SIZES)
+    assert {catalog.match_milk(t) for t in labels(keyboards.milk_kb(locale))} == {"yes", "no"}
+
+
+def test_ambiguous_alias_is_rejected():
+    with pytest.raises(ValueError):
+        catalog.Matcher((catalog.Option("a", {"en": "A"}, ("x",)), catalog.Option("b", {"en": "B"}, ("X",))))
@@ -0,0 +1,94 @@
+import asyncio
+import random
+import sqlite3
+
+from bot import db, migrations, repo
+from tests.conftest import opened_db
+
+
+def _raw_counts(path, user_id, since, until):
+    conn = sqlite3.connect(path)
+    rows = conn.execute(
+        "SELECT drink, COUNT(*) FROM orders "
+        "WHERE user_id=? AND deleted_at IS NULL AND created_at>=? AND created_at<? "
+        "GROUP BY drink",
+        (user_id, since, until),
+    ).fetchall()
+    conn.close()
+    return dict(rows)
+
+
+def test_counts_match_raw_scan_after_deletes_and_undo(db_path):
+    rnd = random.Random(7)
+    drinks = ["latte", "mocha", "americano"]
+    start = 1_700_000_000
+
+    async def scenario():
+        async with opened_db():
+            ids = []
+            for _ in range(300):
+                ids.append(await repo.create_order(
+                    user_id=rnd.choice([1, 2]), chat_id=1, drink=rnd.choice(drinks),
+                    size="small", milk="no", created_at=start + rnd.randrange(10 * 86400),
+                ))
+            for oid in rnd.sample(ids, 60):
+                for uid in (1, 2):
+                    await repo.soft_delete(user_id=uid, order_id=oid)
+            for oid in rnd.sample(ids, 30):
+                for uid in (1, 2):
+                    await repo.undo_delete(user_id=uid, order_id=oid)
+
+            ranges = [(0, 2_147_483_647), (start, start + 86400)]
+            ranges += [tuple(sorted(rnd.randrange(start - 86400, start + 11 * 86400) for _ in range(2)))
+                       for _ in range(40)]
+            for since, until in ranges:
+                got = await repo.drink_counts_between(user_id=1, since=since, until=until)
+                assert dict(got) == _raw_counts(db_path, 1, since, until), (since, until)
+                assert [c for _, c in got] == sorted((c for _, c in got), reverse=True)
+
+    asyncio.run(scenario())
+
+
+def test_backfill_builds_aggregate_for_existing_orders(db_path, monkeypatch):
+    monkeypatch.setattr(migrations, "MIGRATION_CHUNK", 1)
+    monkeypatch.setattr(migrations, "MIGRATION_PAUSE_MS", 0)
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "CREATE TABLE orders (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, "
+        "chat_id INTEGER NOT NULL, drink TEXT NOT NULL, size TEXT NOT NULL, milk TEXT NOT NULL, "
+        "created_at INTEGER NOT NULL, deleted_at INTEGER, locale TEXT)"
+    )
+    conn.executemany(
+        "INSERT INTO orders(user_id, chat_id, drink, size, milk, created_at, deleted_at) VALUES (1, 1, ?, 's', 'no', ?, ?)",
+        [("latte", 100, None), ("latte", 90_000, None), ("mocha", 200, 5)],
+    )
+    conn.commit()
+    conn.close()
+
+    everything = dict(user_id=1, since=0, until=2_147_483_647)
+
+    async def scenario():
+        async with opened_db():
+            # агрегат пуст, бэкфилл не прошёл — ответ всё равно верный (по orders)
+            before = await repo.drink_counts_between(**everything)
+            # пока бэкфилл идёт, заказы приходят и удаляются — и старые, и новые
+            stop = asyncio.Event()
+            task = asyncio.create_task(migrations.run_backfills(db.DB_PATH, stop))
+            await repo.soft_delete(user_id=1, order_id=2)
+            new_id = await repo.create_order(user_id=1, chat_id=1, drink="mocha", size="s", milk="no",
+                                             created_at=300)
+            await task
+            await db.init_db()  # повторный старт не должен удваивать агрегат
+            assert migrations.is_done("order_daily_counts")
+            after = await repo.drink_counts_between(**everything)
+            await repo.soft_delete(user_id=1, order_id=new_id)
+            return before, after, await repo.drink_counts_between(**everything)
+
+    before, after, last = asyncio.run(scenario())
+    assert before == [("latte", 2)]
+    assert after == [("latte", 1), ("mocha", 1)]
+    assert last == [("latte", 1)]
+    conn = sqlite3.connect(db_path)
+    assert dict(conn.execute("SELECT drink, SUM(cnt) FROM order_daily_counts GROUP BY drink")) == \
+        {"latte": 1, "mocha": 0}
+    conn.close()
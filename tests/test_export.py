@@ -0,0 +1,64 @@
+import asyncio
+import csv
+import io
+import random
+
+from bot import helpers
+from bot.repo import ExportRow
+
+START = 1_699_833_600  # 2023-11-13 00:00 UTC
+
+
+def _rows(n):
+    rnd = random.Random(4)
+    drinks = ["latte", "mocha", "flat white", "раф «Лаванда»", 'капучино, "двойной"']
+    return [
+        ExportRow(i, rnd.choice(drinks), rnd.choice(["small", "medium", "large", "большой"]),
+                  rnd.choice(["yes", "no"]), START + i * 37, rnd.choice([None, 18000, 24050]))
+        for i in range(1, n + 1)
+    ]
+
+
+async def _batches(rows, sizes):
+    i = 0
+    for size in sizes:
+        yield rows[i:i + size]
+        i += size
+    yield rows[i:]
+
+
+def test_spooled_export_matches_in_memory_csv(monkeypatch):
+    monkeypatch.setattr(helpers, "EXPORT_SPOOL_MAX", 16 * 1024)
+    rows = _rows(3000)
+
+    async def spool():
+        f, count = await helpers.spool_orders_csv(_batches(rows, [1, 999, 0, 500]))
+        try:
+            return f.read(), count, f._rolled
+        finally:
+            f.close()
+
+    data, count, rolled = asyncio.run(spool())
+    assert rolled  # перевалило за порог и ушло на диск
+    assert count == len(rows)
+    assert data == helpers.orders_to_csv(rows)
+
+    parsed = list(csv.reader(io.StringIO(data.decode("utf-8"), newline="")))
+    assert parsed[0] == ["id", "created_at", "drink", "size", "milk", "total", "estimated_total"]
+    assert [(int(p[0]), p[2], p[3]) for p in parsed[1:]] == [(r.id, r.drink, r.size) for r in rows]
+    # total — только сохранённая сумма; оценка — лишь там, где суммы нет
+    assert [p[5] for p in parsed[1:]] == ["" if r.total is None else f"{r.total / 100:.2f}" for r in rows]
+    assert all(not p[6] for p, r in zip(parsed[1:], rows) if r.total is not None)
+    assert any(p[6] for p in parsed[1:])
+    assert "раф «Лаванда»".encode("utf-8") in data
+
+
+def test_empty_export_is_just_the_header():
+    async def spool():
+        f, count = await helpers.spool_orders_csv(_batches([], []))
+        try:
+            return f.read(), count
+        finally:
+            f.close()
+
+    assert asyncio.run(spool()) == (helpers.orders_to_csv([]), 0)
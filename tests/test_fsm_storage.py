@@ -0,0 +1,89 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+
+from bot import db
+from bot.fsm_storage import SQLiteStorage
+from bot.order_states import OrderState
+
+KEY = StorageKey(bot_id=42, chat_id=1, user_id=1)
+
+
+@pytest.fixture(autouse=True)
+def migrated(db_path):
+    asyncio.run(db.init_db())
+
+
+def _rows(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT key, state, data FROM fsm_state").fetchall()
+
+
+def test_flow_survives_restart(db_path):
+    async def first_process():
+        storage = SQLiteStorage(flush_ms=10_000)
+        await storage.set_state(KEY, OrderState.size)
+        await storage.update_data(KEY, {"drink": "latte"})
+        assert _rows(db_path) == []  # write-behind: ещё не на диске
+        await storage.close()
+
+    async def second_process():
+        storage = SQLiteStorage()
+        try:
+            return await storage.get_state(KEY), await storage.get_data(KEY)
+        finally:
+            await storage.close()
+
+    asyncio.run(first_process())
+    assert asyncio.run(second_process()) == (OrderState.size.state, {"drink": "latte"})
+
+
+def test_batched_flush_and_clear_deletes_row(db_path):
+    async def scenario():
+        storage = SQLiteStorage(flush_ms=20)
+        for uid in range(1, 6):
+            await storage.set_state(StorageKey(bot_id=42, chat_id=uid, user_id=uid), OrderState.drink)
+        await asyncio.sleep(0.1)
+        stored = len(_rows(db_path))
+        await storage.set_state(KEY, None)
+        await storage.set_data(KEY, {})
+        await storage.close()
+        return stored
+
+    assert asyncio.run(scenario()) == 5
+    assert len(_rows(db_path)) == 4
+
+
+def test_abandoned_flow_expires(db_path):
+    async def scenario():
+        storage = SQLiteStorage(state_ttl=60)
+        await storage.set_state(KEY, OrderState.milk)
+        await storage.flush()
+        storage._front.clear()
+        with sqlite3.connect(db_path) as conn:
+            conn.execute("UPDATE fsm_state SET updated_at = ?", (int(time.time()) - 3600,))
+        try:
+            return await storage.get_state(KEY)
+        finally:
+            await storage.close()
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_second_instance_sees_flushed_state(db_path):
+    async def scenario():
+        a = SQLiteStorage(flush_ms=10)
+        b = SQLiteStorage(front_ttl=0)
+        try:
+            assert await b.get_state(KEY) is None
+            await a.set_state(KEY, OrderState.size)
+            await asyncio.sleep(0.05)
+            return await b.get_state(KEY)
+        finally:
+            await a.close()
+            await b.close()
+
+    assert asyncio.run(scenario()) == OrderState.size.state
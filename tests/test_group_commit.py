@@ -0,0 +1,91 @@
+import asyncio
+import sqlite3
+
+import aiosqlite
+import pytest
+
+from bot import db, repo
+from tests.conftest import opened_db
+
+
+@pytest.fixture(autouse=True)
+def group_commit(monkeypatch):
+    monkeypatch.setattr(db, "DB_GROUP_COMMIT_MS", 5)
+
+
+def _batch_window(conn) -> asyncio.Event:
+    """После executemany пачки управление уходит другим корутинам — окно для гонки.
+    Событие взводится, когда окно открыто."""
+    original = conn.executemany
+    opened = asyncio.Event()
+
+    async def executemany(sql, params):
+        try:
+            return await original(sql, params)
+        finally:
+            opened.set()
+            await asyncio.sleep(0.01)
+
+    conn.executemany = executemany
+    return opened
+
+
+async def _during(opened, coro):
+    await opened.wait()
+    return await coro
+
+
+async def _order(uid):
+    return await repo.create_order(user_id=uid, chat_id=uid, drink="latte", size="small", milk="no")
+
+
+def test_ids_match_rows_with_concurrent_writes(db_path):
+    async def scenario():
+        async with opened_db():
+            seeded = [await _order(1000 + i) for i in range(10)]
+            opened = _batch_window(db.get_db())
+            results = await asyncio.gather(
+                *(_order(uid) for uid in range(1, 41)),
+                *(_during(opened, repo.create_broadcast(admin_chat=1, text="x", total=0)) for _ in range(5)),
+                *(_during(opened, repo.soft_delete(user_id=1000 + i, order_id=oid))
+                  for i, oid in enumerate(seeded)),
+            )
+            return seeded, results
+
+    seeded, results = asyncio.run(scenario())
+    ids = results[:40]
+    assert all(results[45:])
+    conn = sqlite3.connect(db_path)
+    owners = dict(conn.execute("SELECT id, user_id FROM orders"))
+    deleted = {oid for (oid,) in conn.execute("SELECT id FROM orders WHERE deleted_at IS NOT NULL")}
+    conn.close()
+    assert [owners[oid] for oid in ids] == list(range(1, 41))
+    assert deleted == set(seeded)
+
+
+def test_failed_batch_keeps_other_writes(db_path):
+    async def scenario():
+        async with opened_db():
+            seeded = [await _order(1000 + i) for i in range(5)]
+            opened = _batch_window(db.get_db())
+            # drink NOT NULL: строка валит executemany пачки посередине
+            bad = repo.create_order(user_id=7, chat_id=7, drink=None, size="small", milk="no")
+            results = await asyncio.gather(
+                _order(1), bad, _order(2),
+                *(_during(opened, repo.soft_delete(user_id=1000 + i, order_id=oid)) for i, oid in enumerate(seeded)),
+                return_exceptions=True,
+            )
+            return seeded, results
+
+    seeded, results = asyncio.run(scenario())
+    assert isinstance(results[1], aiosqlite.IntegrityError)
+    assert results[3:] == [True] * 5
+    conn = sqlite3.connect(db_path)
+    owners = dict(conn.execute("SELECT id, user_id FROM orders"))
+    deleted = {oid for (oid,) in conn.execute("SELECT id FROM orders WHERE deleted_at IS NOT NULL")}
+    conn.close()
+    # строки пачки до сбойной не закоммичены чужим commit и не задвоены повтором по одной
+    assert sorted(owners.values()).count(1) == 1
+    assert (owners[results[0]], owners[results[2]]) == (1, 2)
+    assert 7 not in owners.values()
+    assert deleted == set(seeded)
@@ -0,0 +1,108 @@
+import asyncio
+
+from bot import repo
+from bot.keyboards import history_more_kb
+from bot.services.history import parse_cb
+from tests.conftest import opened_db
+
+START = 1_700_000_000
+
+
+async def _order(drink, created_at, user_id=1):
+    return await repo.create_order(user_id=user_id, chat_id=user_id, drink=drink, size="small", milk="no",
+                                   created_at=created_at)
+
+
+async def _page(cursor, *, drink=None, limit=3):
+    rows = await repo.orders_page_after(user_id=1, drink=drink, after=cursor, limit=limit)
+    if not rows:
+        return [], None
+    # курсор — так же, как его несёт кнопка «Показать ещё»
+    last_id, *_rest, last_created = rows[-1]
+    data = history_more_kb(drink=drink or "all", cursor=(last_created, last_id)).inline_keyboard[0][0].callback_data
+    return [r[0] for r in rows], parse_cb(data)["cursor"]
+
+
+async def _walk(*, drink=None, limit=3):
+    seen, cursor = [], None
+    while True:
+        ids, cursor = await _page(cursor, drink=drink, limit=limit)
+        if not ids:
+            return seen
+        seen += ids
+
+
+def test_pages_cover_same_second_ties_once(db_path):
+    async def scenario():
+        async with opened_db():
+            # семь заказов в одну секунду: граница страницы режет их посередине
+            ids = [await _order("latte", START) for _ in range(7)]
+            ids += [await _order("mocha", START + 1), await _order("latte", START - 1)]
+            await _order("latte", START, user_id=2)
+            return ids, await _walk()
+
+    ids, seen = asyncio.run(scenario())
+    assert seen == [ids[8], *ids[:7], ids[7]]
+
+
+def test_deleted_rows_do_not_shift_pages(db_path):
+    async def scenario():
+        async with opened_db():
+            ids = [await _order("latte", START + i) for i in range(9)]
+            first, cursor = await _page(None)
+            # удалили и уже показанный заказ, и тот, что ждёт на следующей странице
+            await repo.soft_delete(user_id=1, order_id=ids[1])
+            await repo.soft_delete(user_id=1, order_id=ids[4])
+            second, cursor = await _page(cursor)
+            third, cursor = await _page(cursor)
+            return ids, first, second, third, await _page(cursor)
+
+    ids, first, second, third, last = asyncio.run(scenario())
+    assert first == ids[:3]
+    assert second == [ids[3], ids[5], ids[6]]
+    assert third == ids[7:]
+    assert last == ([], None)
+
+
+def test_drink_filter_pages_only_that_drink(db_path):
+    async def scenario():
+        async with opened_db():
+            ids = [await _order("latte" if i % 3 else "mocha", START + i // 2) for i in range(12)]
+            return ids, await _walk(drink="mocha", limit=2), await _walk(drink="all", limit=5)
+
+    ids, mocha, everything = asyncio.run(scenario())
+    assert mocha == ids[::3]
+    assert everything == ids
+
+
+def test_parse_cb_accepts_legacy_offset_buttons():
+    assert parse_cb("history_more:latte:1700000000:42") == {"cmd": "more", "drink": "latte",
+                                                            "cursor": (1_700_000_000, 42)}
+    # старая кнопка со смещением и мусор — первая страница, а не ValueError
+    assert parse_cb("history_more:latte:10") == {"cmd": "more", "drink": "latte", "cursor": None}
+    assert parse_cb("history_more:all") == {"cmd": "more", "drink": "all", "cursor": None}
+    assert parse_cb("history_more:all:x:y")["cursor"] is None
+    assert parse_cb("history_filter:mocha") == {"cmd": "filter", "drink": "mocha", "cursor": None}
+
+
+def test_order_numbers_follow_live_orders_with_ties_by_id(db_path):
+    async def scenario():
+        async with opened_db():
+            # порядок вставки не совпадает с created_at; три заказа в одну секунду
+            ids = {}
+            for key, ts in [("c", START + 5), ("a", START), ("t1", START + 3), ("t2", START + 3),
+                            ("t3", START + 3), ("d", START + 9), ("b", START + 1)]:
+                ids[key] = await _order("latte", ts)
+            other = await _order("latte", START - 1, user_id=2)
+            await repo.soft_delete(user_id=1, order_id=ids["b"])
+            page = [ids[k] for k in ("t2", "t3", "c", "d")]
+            return ids, other, (await repo.user_order_numbers(1, page),
+                                await repo.user_order_numbers(1, [ids["t1"], ids["b"], other]),
+                                await repo.user_order_numbers(2, [ids["a"], other]))
+
+    ids, other, (page, mixed, foreign) = asyncio.run(scenario())
+    # удалённый «b» не считается: t1, t2, t3 — номера 2, 3, 4
+    assert page == {ids["t2"]: 3, ids["t3"]: 4, ids["c"]: 5, ids["d"]: 6}
+    # удалённый и чужой заказы в ответ не попадают
+    assert mixed == {ids["t1"]: 2}
+    assert foreign == {other: 1}
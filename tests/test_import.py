@@ -0,0 +1,164 @@
+import asyncio
+import csv
+import importlib
+import json
+import random
+import sqlite3
+
+from bot import db, migrations, repo
+from tests.conftest import opened_db
+
+tool = importlib.import_module("bot.tools.import")
+
+START = 1_699_833_600  # 2023-11-13 00:00 UTC
+DRINKS = ["latte", "mocha", "americano"]
+SIZES = ["small", "medium", "large"]
+AGGREGATES = ["order_daily_counts", "order_totals", "order_hourly", "order_mix_daily", "order_customers"]
+
+
+def _records(rnd, n):
+    out = []
+    for _ in range(n):
+        out.append({
+            "user_id": rnd.randrange(1, 40), "drink": rnd.choice(DRINKS), "size": rnd.choice(SIZES),
+            "milk": rnd.choice(["yes", "no"]), "created_at": START + rnd.randrange(30 * 86400),
+            "total": rnd.choice([None, 18000, 24000]),
+            "deleted_at": START + 40 * 86400 if rnd.random() < 0.1 else None,
+        })
+    return out
+
+
+def _dump(path, tables):
+    conn = sqlite3.connect(path)
+    try:
+        return {t: sorted(conn.execute(f"SELECT * FROM {t}").fetchall()) for t in tables}
+    finally:
+        conn.close()
+
+
+def _schema(path):
+    conn = sqlite3.connect(path)
+    try:
+        return sorted(conn.execute("SELECT type, name, sql FROM sqlite_master WHERE tbl_name = 'orders'").fetchall())
+    finally:
+        conn.close()
+
+
+async def _seed(rnd, n):
+    async with opened_db():
+        for _ in range(n):
+            await repo.create_order(user_id=rnd.randrange(1, 40), chat_id=1, drink=rnd.choice(DRINKS),
+                                    size=rnd.choice(SIZES), milk="no", created_at=START + rnd.randrange(86400),
+                                    total=18000)
+
+
+def _write_jsonl(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for rec in records:
+            f.write(json.dumps(rec) + "\n")
+
+
+def test_aggregates_match_trigger_inserts(db_path, tmp_path, monkeypatch):
+    records = _records(random.Random(3), 2000)
+    src = tmp_path / "history.jsonl"
+    _write_jsonl(src, records)
+
+    # эталон: те же строки обычными INSERT, агрегаты ведут триггеры
+    ref = tmp_path / "ref.sqlite3"
+    monkeypatch.setattr(db, "DB_PATH", ref)
+    asyncio.run(_seed(random.Random(1), 50))
+    conn = sqlite3.connect(ref)
+    conn.executemany(
+        "INSERT INTO orders(user_id, chat_id, drink, size, milk, created_at, deleted_at, total) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(r["user_id"], r["user_id"], r["drink"], r["size"], r["milk"], r["created_at"], r["deleted_at"],
+          r["total"]) for r in records],
+    )
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(db, "DB_PATH", db_path)
+    asyncio.run(_seed(random.Random(1), 50))
+    schema = _schema(db_path)
+    stats = asyncio.run(tool.load(src, tz="UTC", batch=300))
+
+    assert (stats.read, stats.imported, stats.rejected) == (2000, 2000, 0)
+    assert _schema(db_path) == schema
+    assert _dump(db_path, ["orders"] + AGGREGATES) == _dump(ref, ["orders"] + AGGREGATES)
+
+    async def queries():
+        await db.open_db()
+        try:
+            assert migrations.is_done("order_rollups")
+            live = [r for r in records if r["deleted_at"] is None]
+            assert await repo.count_total_orders() == 50 + len(live)
+            counts = await repo.drink_counts_between(user_id=7, since=START + 86400, until=START + 20 * 86400)
+            expected = {}
+            for r in live:
+                if r["user_id"] == 7 and START + 86400 <= r["created_at"] < START + 20 * 86400:
+                    expected[r["drink"]] = expected.get(r["drink"], 0) + 1
+            assert {c.drink: c.cnt for c in counts} == expected
+            # после загрузки триггеры снова на месте
+            await repo.create_order(user_id=999, chat_id=1, drink="latte", size="small", milk="no",
+                                    created_at=START, total=18000)
+            assert await repo.count_total_orders() == 51 + len(live)
+            assert await repo.count_new_customers(since=START, until=START + 1) == 1
+        finally:
+            await db.close_db()
+
+    asyncio.run(queries())
+
+
+def test_csv_export_format_and_rejects(db_path, tmp_path):
+    src = tmp_path / "export.csv"
+    with open(src, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["id", "created_at", "drink", "size", "milk", "total"])
+        w.writerow([1, "2023-11-13T10:20:30+00:00", "Латте", "Большой", "yes", "310.00"])
+        w.writerow([2, "2023-11-13T10:45:00+00:00", "latte", "small", "no", ""])
+        w.writerow([3, "2023-11-13 13:20:30", "mocha", "medium", "no", "240.50"])
+        w.writerow([4, "2023-11-13T10:20:30+00:00", "tea", "small", "no", ""])
+        w.writerow([5, "вчера", "latte", "small", "no", ""])
+        w.writerow([6, "2023-11-13T10:20:30+00:00"])
+
+    stats = asyncio.run(tool.load(src, user_id=42, tz="Europe/Moscow"))
+    assert (stats.read, stats.imported, stats.rejected) == (6, 3, 3)
+    assert [no for no, _ in stats.errors] == [5, 6, 7]
+    assert "tea" in stats.errors[0][1]
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT user_id, chat_id, drink, size, milk, created_at, total FROM orders ORDER BY id").fetchall()
+    conn.close()
+    assert rows == [
+        (42, 42, "latte", "large", "yes", START + 10 * 3600 + 20 * 60 + 30, 31000),
+        (42, 42, "latte", "small", "no", START + 10 * 3600 + 45 * 60, None),
+        (42, 42, "mocha", "medium", "no", START + 10 * 3600 + 20 * 60 + 30, 24050),
+    ]
+    assert "отклонено: 3" in tool.render_stats(stats)
+
+
+def test_legacy_json_array_and_dry_run(db_path, tmp_path):
+    src = tmp_path / "orders.json"
+    legacy = [{"drink": "latte", "size": "small", "milk": "no", "ts": START + i * 60} for i in range(25)]
+    legacy[4] = ["не объект"]
+    src.write_text(json.dumps(legacy, indent=2), encoding="utf-8")
+
+    # массив читается кусками: записи, разрезанные границей куска, не теряются
+    with open(src, encoding="utf-8") as f:
+        items = list(tool._iter_json_array(f, chunk_size=16))
+    assert [no for no, _ in items] == list(range(1, 26))
+    assert isinstance(items[4][1], ValueError) and items[5][1][3] == START + 5 * 60
+
+    asyncio.run(_seed(random.Random(2), 5))
+    before = _dump(db_path, ["orders"] + AGGREGATES)
+    schema = _schema(db_path)
+    stats = asyncio.run(tool.load(src, user_id=7, dry_run=True))
+    assert (stats.imported, stats.rejected) == (24, 1)
+    assert _dump(db_path, ["orders"] + AGGREGATES) == before
+    assert _schema(db_path) == schema
+
+    stats = asyncio.run(tool.load(src, user_id=7, rebuild_indexes=False))
+    assert stats.errors == [(5, "запись — не объект")]
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*), MIN(created_at) FROM orders WHERE user_id = 7 AND chat_id = 7").fetchone() \
+        == (24, START)
+    conn.close()
@@ -0,0 +1,62 @@
+import asyncio
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import EditMessageReplyMarkup, SendMessage
+
+from bot import keyboards
+from bot.session import MarkupCachingSession
+
+
+def _fields(form) -> dict:
+    return {opts["name"]: value for opts, _, value in form._fields}
+
+
+def test_static_and_parameterized_keyboards_are_shared():
+    assert keyboards.drink_kb() is keyboards.drink_kb()
+    assert keyboards.main_kb() is keyboards.main_kb()
+    a = keyboards.history_actions_kb(10, display_no=3)
+    assert keyboards.history_actions_kb(10, display_no=3) is a
+    assert keyboards.history_actions_kb(11, display_no=3) is not a
+    assert a.inline_keyboard[0][1].callback_data == "delete:10"
+
+
+def test_cached_markup_json_matches_plain_session():
+    async def scenario():
+        plain, cached = AiohttpSession(), MarkupCachingSession(markup_cache_size=2)
+        bot = Bot("42:TEST", session=cached)
+        methods = [
+            SendMessage(chat_id=1, text="hi", reply_markup=keyboards.drink_kb()),
+            SendMessage(chat_id=1, text="hi", reply_markup=keyboards.drink_kb()),
+            EditMessageReplyMarkup(chat_id=1, message_id=5,
+                                   reply_markup=keyboards.confirm_delete_kb(7, 2)),
+            SendMessage(chat_id=1, text="no markup"),
+        ]
+        for m in methods:
+            assert _fields(cached.build_form_data(bot, m)) == _fields(plain.build_form_data(bot, m))
+        await plain.close()
+        await cached.close()
+        return cached
+
+    cached = asyncio.run(scenario())
+    assert (cached.markup_hits, cached.markup_misses) == (1, 2)
+
+
+def test_one_off_markups_do_not_evict_shared():
+    async def scenario():
+        plain, cached = AiohttpSession(), MarkupCachingSession(markup_cache_size=2)
+        bot = Bot("42:TEST", session=cached)
+        shared = SendMessage(chat_id=1, text="hi", reply_markup=keyboards.drink_kb())
+        assert _fields(cached.build_form_data(bot, shared)) == _fields(plain.build_form_data(bot, shared))
+        for n in range(5):
+            one_off = SendMessage(chat_id=1, text="hi", reply_markup=keyboards.undo_delete_kb(7, seconds_left=n))
+            assert _fields(cached.build_form_data(bot, one_off)) == _fields(plain.build_form_data(bot, one_off))
+        cached.build_form_data(bot, shared)
+        await plain.close()
+        await cached.close()
+        return cached
+
+    cached = asyncio.run(scenario())
+    assert not keyboards.is_shared(keyboards.history_more_kb(drink="all", cursor=(1, 2)))
+    assert len(cached._markup_json) == 1
+    assert (cached.markup_hits, cached.markup_misses) == (1, 1)
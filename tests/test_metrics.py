@@ -0,0 +1,103 @@
+import asyncio
+import inspect
+import os
+import subprocess
+import sys
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Message, Update
+
+from bot import metrics, repo
+
+
+def _update(update_id, user_id, text):
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 1700000000,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "U"},
+            "text": text,
+        },
+    })
+
+
+async def _offline(make_request, bot, method):
+    """Вместо сети: вызов API «успешен» сразу."""
+    return True
+
+
+def test_histogram_renders_cumulative_buckets():
+    h = metrics.Histogram("t_seconds", "test", ("fn",), buckets=(0.01, 0.1))
+    metrics.REGISTRY.remove(h)
+    for v in (0.005, 0.05, 0.05, 3):
+        h.observe(v, 'a"b')
+    text = "\n".join(h.render())
+    assert 't_seconds_bucket{fn="a\\"b",le="0.01"} 1' in text
+    assert 't_seconds_bucket{fn="a\\"b",le="0.1"} 3' in text
+    assert 't_seconds_bucket{fn="a\\"b",le="+Inf"} 4' in text
+    assert 't_seconds_count{fn="a\\"b"} 4' in text
+    assert h.quantile(0.5, 'a"b') == 0.1
+
+
+def test_every_repo_function_is_timed():
+    public = [fn for name, fn in vars(repo).items()
+              if not name.startswith("_") and getattr(fn, "__module__", None) == repo.__name__
+              and (inspect.iscoroutinefunction(fn) or inspect.isasyncgenfunction(fn))]
+    assert public
+    assert [fn.__name__ for fn in public if not getattr(fn, "__timed__", False)] == []
+
+
+def test_timed_async_generator_excludes_consumer_time():
+    @metrics.timed
+    async def gen_rows():
+        for i in range(3):
+            yield i
+
+    async def scenario():
+        async for _ in gen_rows():
+            await asyncio.sleep(0.02)
+
+    metrics.DB_SECONDS.clear()
+    asyncio.run(scenario())
+    assert metrics.DB_SECONDS.count("gen_rows") == 1
+    assert metrics.DB_SECONDS._series[("gen_rows",)][-1] < 0.02
+
+
+def test_handler_latency_and_api_calls_per_handler():
+    dp = Dispatcher()
+
+    @dp.message()
+    async def handle_ping(message: Message, bot: Bot):
+        await bot.send_message(message.chat.id, "pong")
+        await bot.send_message(message.chat.id, "pong")
+
+    metrics.setup_dispatcher(dp)
+    bot = Bot("42:TEST")
+    metrics.setup_bot(bot)
+    bot.session.middleware(_offline)
+    for m in (metrics.UPDATES, metrics.HANDLER_SECONDS, metrics.API_CALLS):
+        m.clear()
+
+    async def scenario():
+        for i in range(3):
+            await dp.feed_update(bot, _update(i, 1, "ping"))
+        await bot.session.close()
+
+    asyncio.run(scenario())
+    assert metrics.UPDATES.count("message") == 3
+    assert metrics.HANDLER_SECONDS.count("handle_ping") == 3
+    assert metrics.API_CALLS.get("handle_ping", "SendMessage") == 6
+    text = metrics.render()
+    assert 'bot_api_calls_total{handler="handle_ping",method="SendMessage"} 6' in text
+    assert "# TYPE bot_handler_seconds histogram" in text
+
+
+def test_metrics_server_is_off_unless_port_is_set():
+    # значение по умолчанию — из окружения без METRICS_PORT, как у свежего деплоя
+    env = {k: v for k, v in os.environ.items() if k != "METRICS_PORT"}
+    out = subprocess.run([sys.executable, "-c", "from bot import metrics; print(metrics.METRICS_PORT)"],
+                         env=env, capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == "0"
+    assert asyncio.run(metrics.start_server(port=0)) is None
@@ -0,0 +1,76 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from bot import db, migrations, repo
+from tests.conftest import opened_db
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(migrations, "MIGRATION_CHUNK", 2)
+    monkeypatch.setattr(migrations, "MIGRATION_PAUSE_MS", 0)
+
+
+def _raw(path):
+    conn = sqlite3.connect(path)
+    live, deleted = conn.execute(
+        "SELECT SUM(deleted_at IS NULL), SUM(deleted_at IS NOT NULL) FROM orders"
+    ).fetchone()
+    conn.close()
+    return live or 0, deleted or 0
+
+
+def test_totals_follow_inserts_deletes_and_undo(db_path):
+    async def scenario():
+        async with opened_db():
+            ids = [await repo.create_order(user_id=u, chat_id=u, drink="latte", size="s", milk="no")
+                   for u in (1, 2, 2, 3)]
+            await repo.soft_delete(user_id=2, order_id=ids[1])
+            await repo.soft_delete(user_id=3, order_id=ids[3])
+            await repo.undo_delete(user_id=3, order_id=ids[3])
+            await db.get_db().execute("DELETE FROM orders WHERE id = ?", (ids[0],))
+            await db.get_db().commit()
+            return await repo.count_total_orders(), await repo.count_deleted()
+
+    assert asyncio.run(scenario()) == _raw(db_path) == (2, 1)
+
+
+def test_totals_backfilled_online_for_existing_orders(db_path):
+    async def prepare():
+        # база «до» миграции 3: заказы есть, счётчиков нет
+        await db.init_db()
+        conn = sqlite3.connect(db_path)
+        conn.executemany(
+            "INSERT INTO orders(user_id, chat_id, drink, size, milk, created_at, deleted_at) "
+            "VALUES (1, 1, 'latte', 's', 'no', 100, ?)",
+            [(None,), (None,), (5,), (None,), (None,)],
+        )
+        conn.executescript(
+            "DROP TABLE order_totals; DROP TRIGGER trg_orders_totals_insert; "
+            "DROP TRIGGER trg_orders_totals_update; DROP TRIGGER trg_orders_totals_delete; "
+            "DELETE FROM schema_backfills WHERE name = 'order_totals'; "
+            "DROP TRIGGER trg_orders_rollup_insert; DROP TRIGGER trg_orders_rollup_soft_delete; "
+            "DROP TRIGGER trg_orders_rollup_undo; DROP TRIGGER trg_orders_rollup_delete; "
+            "ALTER TABLE orders DROP COLUMN total; "
+            "ALTER TABLE broadcasts DROP COLUMN owner; ALTER TABLE broadcasts DROP COLUMN lease_until; "
+            "PRAGMA user_version = 2;"
+        )
+        conn.close()
+
+    async def scenario():
+        async with opened_db():
+            assert not migrations.is_done("order_totals")
+            before = await repo.count_total_orders(), await repo.count_deleted()
+            task = asyncio.create_task(migrations.run_backfills(db.DB_PATH))
+            await repo.soft_delete(user_id=1, order_id=1)
+            await repo.soft_delete(user_id=1, order_id=5)
+            await repo.create_order(user_id=1, chat_id=1, drink="tea", size="s", milk="no")
+            await task
+            return before, (await repo.count_total_orders(), await repo.count_deleted())
+
+    asyncio.run(prepare())
+    before, after = asyncio.run(scenario())
+    assert before == (4, 1)
+    assert after == _raw(db_path) == (3, 3)
@@ -0,0 +1,120 @@
+import asyncio
+import random
+
+import pytest
+
+from bot import helpers, migrations, repo
+from bot.services import pricing
+from coffee_utils.pricing import HOUR, HappyHour, Loyalty, Pricer, Volume
+from tests.conftest import opened_db
+
+MONDAY = 1_699_833_600  # 2023-11-13 00:00 UTC
+PRICES = {"latte": {"small": 20000, "large": 28000}}
+MILK = {"milk": {"yes": 3000, "no": 0}}
+
+
+def _pricer(**kw):
+    rules = (Loyalty(10, 10), HappyHour(20, 8, 10, weekdays=(0, 1, 2, 3, 4)), Volume(5, 3))
+    return Pricer(PRICES, MILK, rules, **kw)
+
+
+def test_base_price_with_modifier():
+    p = _pricer()
+    assert p.price("latte", "small", "no", MONDAY) == 20000
+    assert p.price("latte", "large", "yes", MONDAY) == 31000
+    with pytest.raises(ValueError):
+        p.price("tea", "small", "no", MONDAY)
+
+
+def test_happy_hour_weekdays_and_local_time():
+    p = _pricer()
+    assert p.price("latte", "small", "no", MONDAY + 8 * HOUR) == 16000
+    assert p.price("latte", "small", "no", MONDAY + 10 * HOUR) == 20000
+    assert p.price("latte", "small", "no", MONDAY + 5 * 24 * HOUR + 8 * HOUR) == 20000  # суббота
+    # в UTC+3 08:00 — это 05:00 UTC
+    assert _pricer(utc_offset=3 * HOUR).price("latte", "small", "no", MONDAY + 5 * HOUR) == 16000
+
+
+def test_happy_hour_over_midnight():
+    p = Pricer(PRICES, MILK, (HappyHour(50, 22, 2),))
+    assert [p.price("latte", "small", "no", MONDAY + h * HOUR) for h in (21, 22, 1, 2)] == [20000, 10000, 10000, 20000]
+
+
+def test_happy_hour_over_midnight_with_weekdays():
+    # пятница 22:00 — суббота 02:00; в ночь на пятницу и на воскресенье скидки нет
+    p = Pricer(PRICES, MILK, (HappyHour(50, 22, 2, weekdays=(4,)),))
+    friday, saturday, sunday = (MONDAY + d * 24 * HOUR for d in (4, 5, 6))
+    assert [p.price("latte", "small", "no", t) for t in
+            (friday + 1 * HOUR, friday + 23 * HOUR, saturday + 1 * HOUR, saturday + 23 * HOUR, sunday + 1 * HOUR)] \
+        == [20000, 10000, 10000, 20000, 20000]
+    # воскресенье 22:00 — понедельник 02:00: переход через конец недели
+    p = Pricer(PRICES, MILK, (HappyHour(50, 22, 2, weekdays=(6,)),))
+    assert [p.price("latte", "small", "no", t) for t in (MONDAY + 1 * HOUR, sunday + 1 * HOUR, sunday + 23 * HOUR)] \
+        == [10000, 20000, 10000]
+
+
+def test_loyalty_and_volume_thresholds():
+    p = _pricer()
+    assert p.price("latte", "small", "no", MONDAY, order_no=9) == 20000
+    assert p.price("latte", "small", "no", MONDAY, order_no=10) == 18000
+    assert p.price("latte", "small", "no", MONDAY, order_no=500) == 18000
+    assert p.price("latte", "small", "no", MONDAY, nth_today=2) == 20000
+    assert p.price("latte", "small", "no", MONDAY, nth_today=3) == 19000
+
+
+def test_discounts_stack_up_to_cap():
+    kw = dict(order_no=10, nth_today=3)
+    # 0.9 * 0.8 * 0.95 = 0.684 → потолок 30% даёт 0.7
+    assert _pricer().price("latte", "small", "no", MONDAY + 9 * HOUR, **kw) == 13680
+    assert _pricer(max_discount_pct=30).price("latte", "small", "no", MONDAY + 9 * HOUR, **kw) == 14000
+
+
+def test_batch_matches_single_price():
+    p = _pricer(utc_offset=3 * HOUR)
+    rnd = random.Random(7)
+    n = 500
+    cols = (
+        [rnd.choice(["latte", "tea"]) for _ in range(n)],
+        [rnd.choice(["small", "large"]) for _ in range(n)],
+        [rnd.choice(["yes", "no"]) for _ in range(n)],
+        [MONDAY + rnd.randrange(14 * 24 * HOUR) for _ in range(n)],
+    )
+    order_no = [rnd.randrange(20) for _ in range(n)]
+    nth_today = [rnd.randrange(5) for _ in range(n)]
+    got = p.price_batch(*cols, order_no=order_no, nth_today=nth_today)
+    want = [p.price(d, s, m, t, order_no=k, nth_today=q) if d == "latte" else None
+            for d, s, m, t, k, q in zip(*cols, order_no, nth_today)]
+    assert got == want
+
+
+def test_every_menu_item_has_price():
+    for drink in pricing.PRICES:
+        for size in pricing.PRICES[drink]:
+            assert pricing.PRICER.base(drink, size, "no") > 0
+
+
+def test_quote_counts_previous_orders_and_total_is_stored(db_path, monkeypatch):
+    monkeypatch.setattr(migrations, "MIGRATION_PAUSE_MS", 0)
+    monkeypatch.setattr(pricing, "PRICER", _pricer())
+    ts = MONDAY + 12 * HOUR
+
+    async def scenario():
+        async with opened_db():
+            quotes = []
+            for i in range(3):
+                total = await pricing.quote_order(user_id=1, drink="latte", size="small", milk="no", ts=ts + i)
+                await repo.create_order(user_id=1, chat_id=1, drink="latte", size="small", milk="no",
+                                        created_at=ts + i, total=total)
+                quotes.append(total)
+            # старый заказ без суммы — в экспорте только оценка по прайсу, отдельной колонкой
+            await repo.create_order(user_id=1, chat_id=1, drink="latte", size="large", milk="yes",
+                                    created_at=ts - 3 * 24 * HOUR)
+            rows = await repo.orders_for_period(user_id=1, since=0, until=ts + 10)
+            return quotes, rows, helpers.orders_to_csv(rows)
+
+    quotes, rows, csv_bytes = asyncio.run(scenario())
+    assert quotes == [20000, 20000, 19000]
+    assert sorted((r.total for r in rows), key=lambda t: t or 0) == [None, 19000, 20000, 20000]
+    assert pricing.estimate_totals(rows) == [31000 if r.total is None else None for r in rows]
+    exported = {line.split(",")[0]: line.split(",")[5:] for line in csv_bytes.decode().splitlines()[1:]}
+    assert sorted(exported.values()) == [["", "310.00"], ["190.00", ""], ["200.00", ""], ["200.00", ""]]
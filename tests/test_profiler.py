@@ -0,0 +1,54 @@
+import asyncio
+import marshal
+import time
+
+from bot import profiler
+
+
+def _spin(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+async def busy_handler():
+    for _ in range(20):
+        _spin(0.01)
+        await asyncio.sleep(0)
+
+
+def test_parse_duration():
+    assert profiler.parse_duration("30s") == 30
+    assert profiler.parse_duration("2m") == 120
+    assert profiler.parse_duration("15") == 15
+    assert profiler.parse_duration("0") is None
+    assert profiler.parse_duration("1h") is None
+    assert profiler.parse_duration("999") is None
+
+
+def test_sampler_roots_stacks_at_handler():
+    async def scenario():
+        job = asyncio.create_task(profiler.sample(0.3, {busy_handler.__code__}, interval_ms=1))
+        await asyncio.sleep(0)
+        await busy_handler()
+        return await job
+
+    stacks = asyncio.run(scenario())
+    assert not profiler.is_running()
+    mine = {s: n for s, n in stacks.items() if s.startswith("busy_handler ")}
+    assert mine, stacks
+    assert any("_spin (tests/test_profiler.py" in s for s in mine)
+    assert profiler.sample_summary(stacks).splitlines()[1].startswith(("busy_handler", "<other>"))
+
+
+def test_cpu_profile_dumps_pstats():
+    async def scenario():
+        job = asyncio.create_task(profiler.cpu_profile(0.1))
+        await asyncio.sleep(0)
+        await busy_handler()
+        return await job
+
+    stats = asyncio.run(scenario())
+    raw = marshal.loads(profiler.pstats_bytes(stats))
+    assert any(name == "_spin" for (_, _, name) in raw)
+    assert "_spin" in profiler.cpu_summary(stats)
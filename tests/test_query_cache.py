@@ -0,0 +1,64 @@
+
+import asyncio
+
+from bot import repo
+from bot.cache import CACHE, QueryCache, _MISSING
+from bot.services import analytics
+from tests.conftest import opened_db
+
+
+def test_lru_eviction_and_counters():
+    c = QueryCache(maxsize=2, ttl=60)
+    c.put("a", 1, "A", c.generation(1))
+    c.put("b", 1, "B", c.generation(1))
+    assert c.get("a") == "A"          # a стал самым свежим
+    c.put("c", 2, "C", c.generation(2))
+    assert c.get("b") is _MISSING     # вытеснен b
+    assert c.stats() == {"size": 2, "hits": 1, "misses": 1, "evictions": 1}
+
+
+def test_ttl_expiry():
+    c = QueryCache(maxsize=10, ttl=-1)
+    c.put("a", 1, "A", c.generation(1))
+    assert c.get("a") is _MISSING
+
+
+def test_invalidate_user_drops_own_and_global_entries_only():
+    c = QueryCache(maxsize=10, ttl=60)
+    c.put("u1", 1, 1, c.generation(1))
+    c.put("u2", 2, 2, c.generation(2))
+    c.put("g", None, 0, c.generation(None))
+    c.invalidate_user(1)
+    assert c.get("u1") is _MISSING
+    assert c.get("g") is _MISSING
+    assert c.get("u2") == 2
+
+
+def test_result_computed_before_invalidation_is_not_stored():
+    c = QueryCache(maxsize=10, ttl=60)
+    gen = c.generation(1)
+    c.invalidate_user(1)              # запись случилась, пока чтение было в полёте
+    c.put("u1", 1, "stale", gen)
+    assert c.get("u1") is _MISSING
+
+
+def test_rolling_windows_hit_cache_within_the_hour(db_path, monkeypatch):
+    hour = 1_700_000_000 // 3600 * 3600
+    # скользящие окна в пределах часа дают один и тот же ключ
+    assert {repo.window_end(hour + s, repo.HOUR) for s in (0, 1, 1799, 3599)} == {hour + 3600}
+    assert analytics.period_bounds("week", hour + 5) == analytics.period_bounds("week", hour + 3000)
+
+    now = [hour + 10]
+    monkeypatch.setattr(repo.time, "time", lambda: now[0])
+
+    async def scenario():
+        async with opened_db():
+            await repo.create_order(user_id=1, chat_id=1, drink="latte", size="small", milk="no",
+                                    created_at=hour - 86400)
+            first = await repo.top_drinks_last_30d(user_id=1)
+            hits = CACHE.hits
+            now[0] += 1200
+            assert await repo.top_drinks_last_30d(user_id=1) == first == [("latte", 1)]
+            return CACHE.hits - hits
+
+    assert asyncio.run(scenario()) == 1
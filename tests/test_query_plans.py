@@ -0,0 +1,129 @@
+"""EXPLAIN QUERY PLAN для каждого запроса repo.py: ни один не должен сканировать orders целиком.
+
+SQL собирается trace-callback'ом с реальных вызовов, так что новые ветки
+запросов (фильтр по напитку, курсор и т.п.) проверяются автоматически.
+"""
+import asyncio
+import inspect
+import re
+import sqlite3
+
+from bot import db, migrations, repo
+from bot.cache import CACHE
+from tests.conftest import opened_db
+
+# полный проход по таблице: «SCAN orders» без USING ... INDEX (o — алиас orders в repo)
+FULL_SCAN = re.compile(r"^SCAN (orders|o|order_daily_counts|order_hourly|order_mix_daily|order_customers)$")
+DML = re.compile(r"^\s*(SELECT|WITH|UPDATE|DELETE)\b", re.I)
+
+U = 7
+NOW = 1_700_000_000
+
+
+def _calls(ids):
+    return {
+        "create_order": lambda: repo.create_order(user_id=U, chat_id=U, drink="tea", size="small", milk="no"),
+        "get_orders_page": lambda: repo.get_orders_page(user_id=U, drink="latte", offset=0, limit=5),
+        "orders_page_after": lambda: _all(
+            repo.orders_page_after(user_id=U, drink=None, after=None, limit=5),
+            repo.orders_page_after(user_id=U, drink="latte", after=(NOW, ids[0]), limit=5),
+        ),
+        "count_orders": lambda: _all(repo.count_orders(user_id=U), repo.count_orders(user_id=U, drink="latte")),
+        "get_order_by_id": lambda: repo.get_order_by_id(user_id=U, order_id=ids[0]),
+        "soft_delete": lambda: repo.soft_delete(user_id=U, order_id=ids[1]),
+        "undo_delete": lambda: repo.undo_delete(user_id=U, order_id=ids[1]),
+        "top_drinks_last_30d": lambda: repo.top_drinks_last_30d(user_id=U),
+        "orders_for_period": lambda: repo.orders_for_period(user_id=U, since=NOW, until=NOW + 999, drink="latte"),
+        "iter_orders_for_period": lambda: _drain(
+            repo.iter_orders_for_period(user_id=U, since=NOW, until=NOW + 999, batch_size=1),
+            repo.iter_orders_for_period(user_id=U, since=NOW, until=NOW + 999, drink="latte", batch_size=1),
+        ),
+        "drink_counts_between": lambda: repo.drink_counts_between(user_id=U, since=NOW - 5 * repo.DAY,
+                                                                   until=NOW + 10, limit=5),
+        "count_total_orders": repo.count_total_orders,
+        "ping_db": repo.ping_db,
+        "count_deleted": repo.count_deleted,
+        "last_order_ts_global": repo.last_order_ts_global,
+        "last_order_ts_for": lambda: repo.last_order_ts_for(U),
+        "last_order_at": lambda: _all(repo.last_order_at(), repo.last_order_at(U)),
+        "user_order_numbers": lambda: repo.user_order_numbers(U, ids[:3]),
+        "user_order_counts": lambda: repo.user_order_counts(U, since=NOW),
+        "users_with_orders_after": lambda: repo.users_with_orders_after(0, 10),
+        "count_users_with_orders": repo.count_users_with_orders,
+        "order_buckets": lambda: _all(
+            repo.order_buckets(since=NOW - 3600, until=NOW + 999),
+            repo.order_buckets(since=NOW - 9 * repo.DAY, until=NOW + 999, step=repo.DAY, shift=3 * 3600),
+        ),
+        "order_heatmap": lambda: repo.order_heatmap(since=NOW - 9 * repo.DAY, until=NOW + 999, utc_offset=10800),
+        "order_mix": lambda: repo.order_mix(since=NOW - 5 * repo.DAY, until=NOW + 10),
+        "count_new_customers": lambda: repo.count_new_customers(since=NOW - repo.DAY, until=NOW + 10),
+        "create_broadcast": lambda: repo.create_broadcast(admin_chat=1, text="hi", total=1),
+        "get_broadcast": lambda: repo.get_broadcast(1),
+        "running_broadcasts": repo.running_broadcasts,
+        "claim_broadcast": lambda: repo.claim_broadcast(1, owner="a", lease_sec=60),
+        "release_broadcasts": lambda: repo.release_broadcasts(owner="a"),
+        "save_broadcast_progress": lambda: repo.save_broadcast_progress(1, cursor_uid=U, sent=1, failed=0),
+    }
+
+
+async def _all(*aws):
+    for aw in aws:
+        await aw
+
+
+async def _drain(*gens):
+    for gen in gens:
+        async for _ in gen:
+            pass
+
+
+def _repo_functions():
+    return {
+        name for name, fn in vars(repo).items()
+        if not name.startswith("_")
+        and (inspect.iscoroutinefunction(fn) or inspect.isasyncgenfunction(fn))
+        and fn.__module__ == repo.__name__
+    }
+
+
+def test_every_repo_query_uses_an_index(db_path):
+    statements: list[str] = []
+
+    async def scenario():
+        async with opened_db():
+            ids = [await repo.create_order(user_id=U, chat_id=U, drink=d, size="small", milk="no",
+                                           created_at=NOW + i)
+                   for i, d in enumerate(["latte", "tea", "latte", "mocha"])]
+            for conn in [db.get_db(), *db._READERS]:
+                await conn.set_trace_callback(statements.append)
+            calls = _calls(ids)
+            assert set(calls) == _repo_functions(), "новая функция repo без проверки плана"
+            for call in calls.values():
+                CACHE.clear()
+                await call()
+
+    asyncio.run(scenario())
+
+    conn = sqlite3.connect(db_path)
+    checked = 0
+    for sql in statements:
+        if not DML.match(sql):
+            continue
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+        scans = [step for step in plan if FULL_SCAN.match(step)]
+        assert not scans, f"{sql}\n→ {plan}"
+        checked += 1
+    conn.close()
+    assert checked >= len(_repo_functions())
+
+
+def test_migrations_replace_low_selectivity_indexes(db_path):
+    asyncio.run(db.init_db())
+    asyncio.run(db.init_db())  # повторный старт — ничего не применяет повторно
+    conn = sqlite3.connect(db_path)
+    names = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    conn.close()
+    assert version == len(migrations.MIGRATIONS)
+    assert {"idx_orders_live_user_created", "idx_orders_live_user_drink"} <= names
+    assert not names & {"idx_orders_drink", "idx_orders_deleted", "idx_orders_user_created"}
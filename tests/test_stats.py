@@ -0,0 +1,79 @@
+import json
+import random
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from bot import storage
+from bot.services import stats
+
+TODAY = date(2024, 3, 10)
+
+
+@pytest.fixture(autouse=True)
+def in_tmp(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(storage, "_last_id", {})
+    return tmp_path
+
+
+def _records(n, seed=1):
+    rnd = random.Random(seed)
+    out = []
+    for i in range(1, n + 1):
+        ts = datetime(2024, 3, 10, 12) - timedelta(days=rnd.randint(0, 60), minutes=rnd.randint(0, 600))
+        out.append({"id": i, "ts": ts.isoformat(timespec="seconds"),
+                    "drink": rnd.choice(["latte", "tea", "cocoa", "капучино"]), "size": "small", "milk": "no"})
+    return out
+
+
+def _naive(items, days):
+    return Counter(o["drink"] for o in items
+                   if days is None or 0 <= (TODAY - datetime.fromisoformat(o["ts"]).date()).days < days)
+
+
+def test_all_periods_in_one_pass_match_naive_counts():
+    items = _records(2000)
+    got = stats.aggregate(iter(items), today=TODAY)
+    for name, days in stats.PERIODS.items():
+        assert got[name] == _naive(items, days)
+        # тот же порядок при равенстве — render_stats не меняется
+        assert stats.render_stats(got[name]) == stats.render_stats(_naive(items, days))
+
+
+def test_log_batches_match_records_including_odd_lines(in_tmp):
+    items = _records(500)
+    items[10]["drink"] = 'fl"at'  # экранируется в JSON — кусок уйдёт в медленный путь
+    storage.write_orders_json(items)
+    with open(storage.ORDERS_LOG, "a", encoding="utf-8") as f:
+        f.write('{"id": 501, "ts": "2024-03-10T')  # недописанная строка
+
+    got = stats.aggregate_batches(storage.iter_day_drink_batches(chunk_size=4096), today=TODAY)
+    assert got == stats.aggregate(items, today=TODAY)
+
+
+def test_day_counts_are_maintained_incrementally(in_tmp, monkeypatch):
+    items = _records(300)
+    storage.write_orders_json(items[:200])
+
+    def expected(part):
+        return Counter((o["ts"][:10], o["drink"]) for o in part)
+
+    assert storage.day_drink_counts(chunk_size=1024) == expected(items[:200])
+    with open(storage.ORDERS_LOG, "a", encoding="utf-8") as f:
+        for o in items[200:]:
+            f.write(json.dumps(o, ensure_ascii=False) + "\n")
+        f.write('{"id": 301, "ts": "2024-03-10T')  # недописанная строка — ждёт следующего вызова
+
+    # второй вызов читает только дописанное
+    reads = []
+    monkeypatch.setattr(storage, "_day_drink_pairs",
+                        lambda buf, end, orig=storage._day_drink_pairs: reads.append(end) or orig(buf, end))
+    assert storage.day_drink_counts() == expected(items)
+    assert sum(reads) == sum(len(json.dumps(o, ensure_ascii=False).encode()) + 1 for o in items[200:])
+
+    # компакция переписывает лог — счётчики строятся заново
+    storage.write_orders_json(items[:50])
+    assert storage.day_drink_counts() == expected(items[:50])
+    assert stats.format_stats().count("•") > 0
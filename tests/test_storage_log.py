@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from bot import storage
+from bot.catalog import drink_label
+from bot.services import stats
+
+
+@pytest.fixture(autouse=True)
+def in_tmp(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(storage, "_last_id", {})
+    return tmp_path
+
+
+ORDER = {"drink": "latte", "size": "small", "milk": "no"}
+
+
+def test_append_assigns_sequential_ids():
+    ids = [storage.save_order_json(ORDER) for _ in range(3)]
+    assert ids == [1, 2, 3]
+    assert [o["id"] for o in storage.iter_orders_json()] == [1, 2, 3]
+
+
+def test_torn_last_line_is_skipped_and_not_glued(in_tmp, monkeypatch):
+    storage.save_order_json(ORDER)
+    with open(storage.ORDERS_LOG, "a", encoding="utf-8") as f:
+        f.write('{"id": 2, "ts": "2024-01-')  # «упали» посреди записи
+    monkeypatch.setattr(storage, "_last_id", {})  # рестарт процесса
+
+    assert storage.save_order_json(ORDER) == 2
+    assert [o["id"] for o in storage.iter_orders_json()] == [1, 2]
+
+    storage.compact_orders_log()
+    lines = (in_tmp / storage.ORDERS_LOG).read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["id"] for line in lines] == [1, 2]
+
+
+def test_id_recovered_from_log_when_sidecar_lags(in_tmp, monkeypatch):
+    for _ in range(3):
+        storage.save_order_json(ORDER)
+    (in_tmp / storage.ORDERS_LOG_ID).write_text("1")
+    monkeypatch.setattr(storage, "_last_id", {})
+    assert storage.save_order_json(ORDER) == 4
+
+
+def test_legacy_json_is_migrated(in_tmp):
+    legacy = [{"id": 5, "ts": "2024-01-01T10:00:00", "drink": "tea", "size": "big", "milk": "no"}]
+    (in_tmp / storage.ORDERS_JSON).write_text(json.dumps(legacy), encoding="utf-8")
+
+    assert storage.read_orders_json() == legacy
+    assert storage.save_order_json(ORDER) == 6
+    assert (in_tmp / (storage.ORDERS_JSON + ".bak")).exists()
+
+
+def test_format_stats_counts_today_and_all(in_tmp):
+    storage.write_orders_json([{"id": 1, "ts": "2001-01-01T10:00:00", "drink": "tea", "size": "big", "milk": "no"}])
+    storage.save_order_json(ORDER)
+    text = stats.format_stats()
+    today, all_time = text.split("За всё время:")
+    latte, tea = drink_label("latte"), drink_label("tea")
+    assert latte in today and tea not in today
+    assert latte in all_time and tea in all_time
@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+from bot.services import undo
+
+
+class FakeBot:
+    def __init__(self):
+        self.calls = []
+
+    async def edit_message_reply_markup(self, **kw):
+        self.calls.append(("markup", kw["message_id"], kw["reply_markup"] is None))
+
+    async def edit_message_text(self, **kw):
+        self.calls.append(("text", kw["message_id"], kw["text"]))
+
+
+def test_single_scheduler_finalizes_only_pending(monkeypatch):
+    monkeypatch.setattr(undo, "UNDO_DEADLINE_SEC", 2)
+    monkeypatch.setattr(undo, "UNDO_TICK_SEC", 1)
+    monkeypatch.setattr(undo, "SCHEDULER", undo.UndoScheduler())
+    bot = FakeBot()
+
+    async def scenario():
+        keys = []
+        for oid in (1, 2, 3):
+            key, rec = undo.remember_deleted(user_id=7, order_id=oid, item={}, index=0,
+                                             chat_id=7, message_id=100 + oid)
+            rec["deadline"] = time.monotonic() + 0.05 * oid
+            keys.append(key)
+            undo.start_undo_countdown(bot, key)
+        undo.UNDO_BIN.pop(keys[1])  # «Вернуть» для второго
+        await asyncio.sleep(0.3)
+        return undo.SCHEDULER._task
+
+    task = asyncio.run(scenario())
+    assert task.done()
+    assert not undo.UNDO_BIN
+    finalized = sorted(mid for kind, mid, _ in bot.calls if kind == "text")
+    assert finalized == [101, 103]
@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, Dispatcher
+from aiogram.types import Message
+
+from bot import webhook
+
+SECRET = "s3cret"
+AUTH = {webhook.SECRET_HEADER: SECRET}
+
+
+def _update(update_id, user_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 1700000000,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "U"},
+            "text": text,
+        },
+    }
+
+
+def _dispatcher(seen, gate=None):
+    dp = Dispatcher()
+
+    @dp.message()
+    async def on_message(message: Message):
+        if gate is not None:
+            await gate.wait()
+        seen.append((message.from_user.id, message.text))
+
+    return dp
+
+
+async def _post_all(app, updates, headers=AUTH):
+    async with TestClient(TestServer(app)) as client:
+        codes = []
+        for data in updates:
+            resp = await client.post("/webhook", json=data, headers=headers)
+            codes.append(resp.status)
+        await asyncio.gather(*(q.join() for q in app[webhook.UPDATES].queues))
+        return codes
+
+
+def test_secret_token_is_checked():
+    seen = []
+    bot = Bot("42:TEST")
+
+    async def scenario():
+        codes = []
+        for headers in ({}, {webhook.SECRET_HEADER: ""}, {webhook.SECRET_HEADER: "nope"}, AUTH):
+            app = webhook.build_app(_dispatcher(seen), bot, path="/webhook", secret=SECRET)
+            codes += await _post_all(app, [_update(len(codes) + 1, 1, str(len(codes)))], headers)
+        await bot.session.close()
+        return codes
+
+    assert asyncio.run(scenario()) == [401, 401, 401, 200]
+    assert seen == [(1, "3")]
+
+
+def test_webhook_requires_secret(monkeypatch):
+    bot = Bot("42:TEST")
+    with pytest.raises(ValueError):
+        webhook.build_app(_dispatcher([]), bot, path="/webhook", secret="")
+    monkeypatch.setattr(webhook, "WEBHOOK_SECRET", "")
+    with pytest.raises(RuntimeError):
+        asyncio.run(webhook.run_webhook(_dispatcher([]), bot))
+    asyncio.run(bot.session.close())
+
+
+def test_updates_of_one_user_keep_order():
+    seen = []
+    bot = Bot("42:TEST")
+    updates = [_update(i, 1 + i % 3, f"m{i}") for i in range(30)]
+
+    async def scenario():
+        app = webhook.build_app(_dispatcher(seen), bot, path="/webhook", secret=SECRET, workers=4)
+        codes = await _post_all(app, updates)
+        await bot.session.close()
+        return codes
+
+    assert set(asyncio.run(scenario())) == {200}
+    for uid in (1, 2, 3):
+        got = [text for u, text in seen if u == uid]
+        assert got == [u["message"]["text"] for u in updates if u["message"]["from"]["id"] == uid]
+
+
+def test_full_queue_answers_503():
+    seen = []
+    bot = Bot("42:TEST")
+
+    async def scenario():
+        gate = asyncio.Event()
+        app = webhook.build_app(_dispatcher(seen, gate), bot, path="/webhook", secret=SECRET,
+                                workers=1, queue_size=2)
+        async with TestClient(TestServer(app)) as client:
+            codes = []
+            for i in range(5):
+                resp = await client.post("/webhook", json=_update(i, 7, str(i)), headers=AUTH)
+                codes.append(resp.status)
+                await asyncio.sleep(0)
+            gate.set()
+            await app[webhook.UPDATES].queues[0].join()
+        await bot.session.close()
+        return codes
+
+    codes = asyncio.run(scenario())
+    # один в обработке, два в очереди, остальное — «повторите позже»
+    assert codes.count(200) == 3 and codes.count(503) == 2
+    assert len(seen) == 3